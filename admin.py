@@ -3,22 +3,20 @@ import logging
 from dotenv import load_dotenv
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
-from db_config import PotentialAdmin, SessionLocal
-from sqlalchemy.orm import Session
-from sqlalchemy.exc import IntegrityError
+from db_config import AsyncSessionLocal
+from sqlalchemy.ext.asyncio import AsyncSession
 from services.admin_service import AdminService
+from services.cache_service import admin_cache, get_cache_manager
+from services.metrics_service import handler_timed, job_timed
 
 load_dotenv()
 
-logging.basicConfig(
-    level=logging.INFO,  # Можна змінити на DEBUG для більш детального логування
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 SUPER_ADMIN_ID = int(os.getenv('SUPER_ADMIN_ID'))
 ADD_ADMIN, ADD_SUPER_ADMIN, REMOVE_ADMIN = range(3)
 
+@handler_timed()
 async def add_admin_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_super_admin(update.effective_user.id):
         await update.message.reply_text('У вас нема прав для додавання адміністратора')
@@ -26,16 +24,17 @@ async def add_admin_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text('Введіть ID або тег Telegram користувача, якого хочете зробити адміном')
     return ADD_ADMIN
 
+@handler_timed()
 async def add_admin_process(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_input = update.message.text
-    with SessionLocal() as session:
-        admin_service = AdminService(session)
+    async with AsyncSessionLocal() as session:
+        admin_service = AdminService(session, cache=get_cache_manager())
         try:
             new_admin_id = int(user_input)
             new_admin_username = None  
         except ValueError:
             new_admin_username = user_input.strip('@')
-            potential_admin = admin_service.get_potential_admin_by_username(new_admin_username)
+            potential_admin = await admin_service.get_potential_admin_by_username(new_admin_username)
             
             if potential_admin:
                 new_admin_id = potential_admin.user_id
@@ -44,12 +43,13 @@ async def add_admin_process(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     f"Помилка: Користувач із тегом @{new_admin_username} не надсилав команду /start або не збережений у базі."
                 )
                 return ConversationHandler.END
-        if admin_service.add_admin(new_admin_id, new_admin_username):
+        if await admin_service.add_admin(new_admin_id, new_admin_username):
             await update.message.reply_text(f"Користувача @{new_admin_username or new_admin_id} було додано як адміністратора.")
         else:
             await update.message.reply_text(f"Користувач @{new_admin_username or new_admin_id} вже є адміністратором.")
     return ConversationHandler.END
 
+@handler_timed()
 async def add_super_admin_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_super_admin(update.effective_user.id):
         await update.message.reply_text('У вас нема прав для додавання суперадміністратора')
@@ -57,29 +57,32 @@ async def add_super_admin_start(update: Update, context: ContextTypes.DEFAULT_TY
     await update.message.reply_text('Введіть ID або тег Telegram користувача, якого хочете зробити адміном')
     return ADD_SUPER_ADMIN
 
+@handler_timed()
 async def add_super_admin_process(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_input = update.message.text.strip()
-    with SessionLocal() as session:
-        admin_service = AdminService(session)
+    async with AsyncSessionLocal() as session:
+        admin_service = AdminService(session, cache=get_cache_manager())
         try:
             user_id = int(user_input)
             username = None
         except ValueError:
             username = user_input.strip('@')
-            potential_admin = admin_service.get_potential_admin_by_username(username)
+            potential_admin = await admin_service.get_potential_admin_by_username(username)
             if not potential_admin:
                 await update.message.reply_text(
                     f"Помилка: Користувач із тегом @{username} не надсилав команду /start або не збережений у базі."
                 )
-                return
+                return ConversationHandler.END
             user_id = potential_admin.user_id
-        existing_admin = admin_service.get_admin_by_id(user_id)
+        existing_admin = await admin_service.get_admin_by_id(user_id)
         if existing_admin:
-            message = admin_service.add_super_admin(existing_admin)
+            message = await admin_service.add_super_admin(existing_admin.user_id)
         else:
-            message = admin_service.new_super_admin(user_id, username)
-        await update.message.reply_text(message)   
+            message = await admin_service.new_super_admin(user_id, username)
+        await update.message.reply_text(message)
+    return ConversationHandler.END
 
+@handler_timed()
 async def remove_admin_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_super_admin(update.effective_user.id):
         await update.message.reply_text("У вас немає прав на видалення адміністратора.")
@@ -87,44 +90,43 @@ async def remove_admin_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await update.message.reply_text("Введіть ID або тег Telegram користувача, якого хочете видалити з адмінів.")
     return REMOVE_ADMIN
 
+@handler_timed()
 async def remove_admin_process(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_input = update.message.text
-    with SessionLocal() as session:
-        admin_service = AdminService(session)
+    async with AsyncSessionLocal() as session:
+        admin_service = AdminService(session, cache=get_cache_manager())
         try:
             admin_id = int(user_input)
         except ValueError:
             admin_username = user_input.strip('@')
-            admin = admin_service.get_admin_by_username(admin_username)
+            admin = await admin_service.get_admin_by_username(admin_username)
             if not admin:
                 await update.message.reply_text(f"Користувача з тегом @{admin_username} не знайдено серед адміністраторів.")
                 return ConversationHandler.END
-            admin_id = admin.id
+            admin_id = admin.user_id
         
-        result = admin_service.remove_admin_by_id(admin_id)
+        result = await admin_service.remove_admin_by_id(admin_id)
         await update.message.reply_text(result)
         return ConversationHandler.END
     
+async def load_admin_ids():
+    async with AsyncSessionLocal() as session:
+        return await AdminService(session).get_admin_ids()
+
 async def is_admin(user_id: int):
-    with SessionLocal() as session:
-        admin_service = AdminService(session)
-        admin = admin_service.get_admin_by_id(user_id)
-    return admin is not None
+    admin_ids, _ = await admin_cache.get(load_admin_ids)
+    return user_id in admin_ids
 
 async def is_super_admin(user_id: int):
-    with SessionLocal() as session:
-        admin_service = AdminService(session)
-        super_admin = admin_service.get_super_admin_by_id(user_id)
-    return super_admin is not None
+    _, super_admin_ids = await admin_cache.get(load_admin_ids)
+    return user_id in super_admin_ids
 
-def clean_old_potential_admins(session: Session) -> None:
-    PotentialAdmin.clean_old_potential_admins(session=session)
+@job_timed()
+async def clean_old_potential_admins() -> None:
+    async with AsyncSessionLocal() as session:
+        deleted = await AdminService(session).delete_expired_potential_admins()
+    if deleted:
+        logger.info("Видалено %d прострочених запитів /start", deleted)
 
-def add_potential_admin(session: Session, user_id: int, username: str) -> None:
-    try:
-        potential_admin = PotentialAdmin(user_id=user_id, username=username)
-        session.add(potential_admin)
-        session.commit()
-    except IntegrityError as e:
-        session.rollback()
-        logger.info('Користувач вже був доданий до бази раніше.', e)
\ No newline at end of file
+async def add_potential_admin(session: AsyncSession, user_id: int, username: str) -> None:
+    await AdminService(session).upsert_potential_admin(user_id, username)
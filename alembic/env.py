@@ -1,4 +1,5 @@
 import os
+import re
 from logging.config import fileConfig
 from sqlalchemy import engine_from_config, pool
 from alembic import context
@@ -24,10 +25,19 @@ config.set_main_option("sqlalchemy.url", DATABASE_URL)
 # Метадані для моделей
 target_metadata = Base.metadata  # Використовуємо Base.metadata з db_config.py
 
+# Секції user_groups створює подія after_create у db_config.py, моделей у них немає
+PARTITION_TABLE = re.compile(r"user_groups_p\d+")
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Не дає autogenerate пропонувати видалення секцій user_groups."""
+    if type_ == "table" and reflected and compare_to is None and PARTITION_TABLE.fullmatch(name):
+        return False
+    return True
+
 def run_migrations_offline():
     """Запуск міграцій в 'offline' режимі."""
     url = config.get_main_option("sqlalchemy.url")
-    context.configure(url=url, target_metadata=target_metadata, literal_binds=True)
+    context.configure(url=url, target_metadata=target_metadata, literal_binds=True, include_object=include_object)
 
     with context.begin_transaction():
         context.run_migrations()
@@ -41,7 +51,7 @@ def run_migrations_online():
     )
 
     with connectable.connect() as connection:
-        context.configure(connection=connection, target_metadata=target_metadata)
+        context.configure(connection=connection, target_metadata=target_metadata, include_object=include_object)
 
         with context.begin_transaction():
             context.run_migrations()
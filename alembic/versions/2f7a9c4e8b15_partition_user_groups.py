@@ -0,0 +1,114 @@
+"""partition user_groups by group_id with a composite primary key
+
+Revision ID: 2f7a9c4e8b15
+Revises: 9d4f1a6b3e27
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2f7a9c4e8b15'
+down_revision: Union[str, None] = '9d4f1a6b3e27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PARTITIONS = 16
+COPY_BATCH = 50000
+
+
+def upgrade() -> None:
+    # Нова таблиця поруч зі старою; бот продовжує писати в стару, поки дані переносяться
+    op.execute(
+        'CREATE TABLE user_groups_new ('
+        ' group_id BIGINT NOT NULL REFERENCES groups (group_id),'
+        ' user_id BIGINT NOT NULL,'
+        ' CONSTRAINT user_groups_new_pkey PRIMARY KEY (group_id, user_id)'
+        ') PARTITION BY HASH (group_id)'
+    )
+    for remainder in range(PARTITIONS):
+        op.execute(
+            f'CREATE TABLE user_groups_p{remainder} PARTITION OF user_groups_new '
+            f'FOR VALUES WITH (MODULUS {PARTITIONS}, REMAINDER {remainder})'
+        )
+    op.create_table('member_count_deltas',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('group_id', sa.BigInteger(), nullable=False),
+    sa.Column('added', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['group_id'], ['groups.group_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    # Зміни, що надходять під час перенесення, тригер одразу дублює в нову таблицю
+    op.execute('''
+        CREATE FUNCTION user_groups_mirror() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO user_groups_new (group_id, user_id) VALUES (NEW.group_id, NEW.user_id)
+                ON CONFLICT DO NOTHING;
+                RETURN NEW;
+            END IF;
+            DELETE FROM user_groups_new WHERE group_id = OLD.group_id AND user_id = OLD.user_id;
+            RETURN OLD;
+        END $$
+    ''')
+    op.execute(
+        'CREATE TRIGGER user_groups_mirror AFTER INSERT OR DELETE ON user_groups '
+        'FOR EACH ROW EXECUTE FUNCTION user_groups_mirror()'
+    )
+
+    # Наявні рядки переносяться пачками за id, кожна у власній транзакції, без довгих локів.
+    # FOR SHARE не дає паралельному DELETE проскочити між читанням пачки і її комітом
+    bind = op.get_bind()
+    with op.get_context().autocommit_block():
+        upper = bind.execute(sa.text('SELECT coalesce(max(id), 0) FROM user_groups')).scalar()
+        for start in range(0, upper, COPY_BATCH):
+            bind.execute(sa.text(
+                'INSERT INTO user_groups_new (group_id, user_id) '
+                'SELECT group_id, user_id FROM user_groups WHERE id > :start AND id <= :stop FOR SHARE '
+                'ON CONFLICT DO NOTHING'
+            ), {'start': start, 'stop': start + COPY_BATCH})
+
+    # Коротка заміна під локом: далі всі запити йдуть у нову таблицю
+    op.execute('LOCK TABLE user_groups IN ACCESS EXCLUSIVE MODE')
+    op.execute('DROP TRIGGER user_groups_mirror ON user_groups')
+    op.execute('DROP FUNCTION user_groups_mirror()')
+    op.drop_table('user_groups')
+    op.execute('ALTER TABLE user_groups_new RENAME TO user_groups')
+    op.execute('ALTER TABLE user_groups RENAME CONSTRAINT user_groups_new_pkey TO user_groups_pkey')
+    op.execute('ALTER TABLE user_groups RENAME CONSTRAINT user_groups_new_group_id_fkey TO user_groups_group_id_fkey')
+    # High-water mark за id більше не можлива; режим reconcile рахує приріст через member_count_deltas.
+    # Приєднання під час міграції враховує повна звірка, яку лідер запускає одразу після старту
+    op.drop_table('counter_watermarks')
+
+
+def downgrade() -> None:
+    op.create_table('counter_watermarks',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.execute('ALTER TABLE user_groups RENAME TO user_groups_partitioned')
+    op.execute('ALTER TABLE user_groups_partitioned RENAME CONSTRAINT user_groups_pkey TO user_groups_partitioned_pkey')
+    op.execute(
+        'ALTER TABLE user_groups_partitioned '
+        'RENAME CONSTRAINT user_groups_group_id_fkey TO user_groups_partitioned_group_id_fkey'
+    )
+    op.create_table('user_groups',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.BigInteger(), nullable=False),
+    sa.Column('group_id', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['group_id'], ['groups.group_id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'group_id', name='_user_group_uc')
+    )
+    op.create_index(op.f('ix_user_groups_id'), 'user_groups', ['id'], unique=False)
+    op.execute(
+        'INSERT INTO user_groups (user_id, group_id) '
+        'SELECT user_id, group_id FROM user_groups_partitioned ORDER BY group_id, user_id'
+    )
+    op.execute('DROP TABLE user_groups_partitioned')
+    op.drop_table('member_count_deltas')
@@ -0,0 +1,36 @@
+"""add group_poll_state table
+
+Revision ID: 3625b007f84f
+Revises: 8d665ede64b1
+Create Date: 2026-10-18 10:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3625b007f84f'
+down_revision: Union[str, None] = '8d665ede64b1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('group_poll_state',
+    sa.Column('group_id', sa.BigInteger(), nullable=False),
+    sa.Column('last_count', sa.Integer(), nullable=True),
+    sa.Column('interval_seconds', sa.Integer(), nullable=False),
+    sa.Column('next_poll_at', sa.DateTime(), nullable=False),
+    sa.Column('last_polled_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['group_id'], ['groups.group_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('group_id')
+    )
+    op.create_index(op.f('ix_group_poll_state_next_poll_at'), 'group_poll_state', ['next_poll_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_group_poll_state_next_poll_at'), table_name='group_poll_state')
+    op.drop_table('group_poll_state')
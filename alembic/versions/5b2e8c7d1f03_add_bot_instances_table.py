@@ -0,0 +1,33 @@
+"""add bot_instances table
+
+Revision ID: 5b2e8c7d1f03
+Revises: c41f0b6a9d27
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b2e8c7d1f03'
+down_revision: Union[str, None] = 'c41f0b6a9d27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('bot_instances',
+    sa.Column('instance_id', sa.String(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=False),
+    sa.Column('heartbeat_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('instance_id')
+    )
+    op.create_index(op.f('ix_bot_instances_heartbeat_at'), 'bot_instances', ['heartbeat_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_bot_instances_heartbeat_at'), table_name='bot_instances')
+    op.drop_table('bot_instances')
@@ -0,0 +1,28 @@
+"""add hll count mode to groups
+
+Revision ID: 6ebcd73e8488
+Revises: 71ba9fca2818
+Create Date: 2026-10-18 11:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6ebcd73e8488'
+down_revision: Union[str, None] = '71ba9fca2818'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('groups', sa.Column('count_mode', sa.String(), server_default='exact', nullable=False))
+    op.add_column('groups', sa.Column('hll_sketch', sa.LargeBinary(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('groups', 'hll_sketch')
+    op.drop_column('groups', 'count_mode')
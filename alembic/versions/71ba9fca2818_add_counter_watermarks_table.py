@@ -0,0 +1,30 @@
+"""add counter_watermarks table
+
+Revision ID: 71ba9fca2818
+Revises: 3625b007f84f
+Create Date: 2026-10-18 11:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '71ba9fca2818'
+down_revision: Union[str, None] = '3625b007f84f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('counter_watermarks',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('counter_watermarks')
@@ -0,0 +1,30 @@
+"""index potential_admins.requested_at
+
+Revision ID: 7c1e4b9a2d58
+Revises: e3b8d52a7c61
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c1e4b9a2d58'
+down_revision: Union[str, None] = 'e3b8d52a7c61'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY не блокує вставки з /start на час побудови індексу
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f('ix_potential_admins_requested_at'), 'potential_admins', ['requested_at'], unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_potential_admins_requested_at'), table_name='potential_admins')
@@ -0,0 +1,43 @@
+"""add group_name search indexes
+
+Revision ID: 8435d664ead9
+Revises: 6ebcd73e8488
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8435d664ead9'
+down_revision: Union[str, None] = '6ebcd73e8488'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Точний збіг без урахування регістру, пошук за префіксом (LIKE 'abc%') і ORDER BY ... LIMIT по індексу
+    op.create_index(
+        'ix_groups_group_name_lower', 'groups',
+        [sa.text('lower(group_name) COLLATE "C"')], unique=False,
+    )
+    # Нечіткий пошук за схожістю (%, similarity) і LIKE '%abc%'. Без pg_trgm на сервері
+    # find_groups шукає підрядок без індексу, тож міграція тоді пропускає розширення й індекс
+    available = op.get_bind().execute(
+        sa.text("SELECT EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm')")
+    ).scalar()
+    if not available:
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index(
+        'ix_groups_group_name_trgm', 'groups',
+        [sa.text('lower(group_name) gin_trgm_ops')], unique=False, postgresql_using='gin',
+    )
+
+
+def downgrade() -> None:
+    op.execute('DROP INDEX IF EXISTS ix_groups_group_name_trgm')
+    op.drop_index('ix_groups_group_name_lower', table_name='groups')
@@ -0,0 +1,26 @@
+"""add bot_instances.role
+
+Revision ID: a4d9e2f61b07
+Revises: 7c1e4b9a2d58
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4d9e2f61b07'
+down_revision: Union[str, None] = '7c1e4b9a2d58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('bot_instances', sa.Column('role', sa.String(), server_default='bot', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('bot_instances', 'role')
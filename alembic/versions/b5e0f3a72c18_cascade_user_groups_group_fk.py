@@ -0,0 +1,31 @@
+"""cascade user_groups.group_id on group delete
+
+Revision ID: b5e0f3a72c18
+Revises: a4d9e2f61b07
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5e0f3a72c18'
+down_revision: Union[str, None] = 'a4d9e2f61b07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # NOT VALID для секціонованих таблиць недоступний, тож новий ключ перевіряє всі рядки
+    # user_groups під локом SHARE ROW EXCLUSIVE: на великій таблиці це займе час
+    op.drop_constraint('user_groups_group_id_fkey', 'user_groups', type_='foreignkey')
+    op.create_foreign_key(
+        'user_groups_group_id_fkey', 'user_groups', 'groups', ['group_id'], ['group_id'], ondelete='CASCADE',
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint('user_groups_group_id_fkey', 'user_groups', type_='foreignkey')
+    op.create_foreign_key('user_groups_group_id_fkey', 'user_groups', 'groups', ['group_id'], ['group_id'])
@@ -0,0 +1,48 @@
+"""add update_queue and conversation_states tables
+
+Revision ID: c41f0b6a9d27
+Revises: 8435d664ead9
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41f0b6a9d27'
+down_revision: Union[str, None] = '8435d664ead9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('update_queue',
+    sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+    sa.Column('update_id', sa.BigInteger(), nullable=False),
+    sa.Column('chat_id', sa.BigInteger(), nullable=True),
+    sa.Column('payload', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('received_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.Column('locked_by', sa.String(), nullable=True),
+    sa.Column('locked_until', sa.DateTime(), nullable=True),
+    sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('update_id')
+    )
+    op.create_index('ix_update_queue_chat_id_id', 'update_queue', ['chat_id', 'id'], unique=False)
+    op.create_table('conversation_states',
+    sa.Column('handler_name', sa.String(), nullable=False),
+    sa.Column('conversation_key', sa.String(), nullable=False),
+    sa.Column('state', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('handler_name', 'conversation_key')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('conversation_states')
+    op.drop_index('ix_update_queue_chat_id_id', table_name='update_queue')
+    op.drop_table('update_queue')
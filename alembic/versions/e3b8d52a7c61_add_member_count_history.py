@@ -0,0 +1,43 @@
+"""add member count samples and rollups
+
+Revision ID: e3b8d52a7c61
+Revises: 2f7a9c4e8b15
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3b8d52a7c61'
+down_revision: Union[str, None] = '2f7a9c4e8b15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('member_count_samples',
+    sa.Column('group_id', sa.BigInteger(), nullable=False),
+    sa.Column('sampled_at', sa.DateTime(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['group_id'], ['groups.group_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('group_id', 'sampled_at')
+    )
+    op.create_table('member_count_rollups',
+    sa.Column('group_id', sa.BigInteger(), nullable=False),
+    sa.Column('resolution', sa.String(length=4), nullable=False),
+    sa.Column('bucket_start', sa.DateTime(), nullable=False),
+    sa.Column('min_count', sa.Integer(), nullable=False),
+    sa.Column('max_count', sa.Integer(), nullable=False),
+    sa.Column('last_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['group_id'], ['groups.group_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('group_id', 'resolution', 'bucket_start')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('member_count_rollups')
+    op.drop_table('member_count_samples')
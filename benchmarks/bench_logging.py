@@ -0,0 +1,87 @@
+"""Накладні витрати логування на одне приєднання: як було і як тепер.
+
+"До" відтворює виклики логера з початкової версії new_member/add_unique_member/get_user
+(basicConfig з рівнем DEBUG, f-рядки, синхронний запис у файл у потоці event loop).
+"Після" — виклики з поточного коду через setup_logging(): INFO, ліниве форматування,
+семплінг подій приєднання і запис у файл з окремого потоку.
+
+    python -m benchmarks.bench_logging --joins 20000
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logging_config import SAMPLED, TEXT_FORMAT, setup_logging, stop_logging  # noqa: E402
+
+group_logger = logging.getLogger("group")
+service_logger = logging.getLogger("services.group_service")
+
+
+def join_before(group_id: int, user_id: int) -> None:
+    group_title, full_name = "Benchmark group", "Test User"
+    group_logger.info("Отримано нових учасників у групі '%s' (%d)", group_title, group_id)
+    group_logger.info("Група оброблена: %s (ID: %d)", group_title, group_id)
+    group_logger.info("Спроба додати користувача: ID %d, ім'я: %s", user_id, full_name)
+    service_logger.debug(f"Виклик add_unique_member для групи {group_id} з user_id={user_id}")
+    service_logger.debug(f"Виклик get_user з параметрами: user_id={user_id}, group_id={group_id}")
+    service_logger.debug(f"Користувача не знайдено: user_id={user_id}, group_id={group_id}")
+    service_logger.debug(f"Виклик add_user з параметрами: user_id={user_id}, group_id={group_id}")
+    service_logger.debug(f"Користувача {user_id} додано до сесії для групи {group_id}")
+    service_logger.debug(f"Перед комітом: unique_members_count оновлено для групи {group_id}, user_id={user_id}")
+    service_logger.info(f"Користувача {user_id} успішно додано до групи {group_id}")
+    group_logger.info("Успіх: Користувача ID %d, ім'я %s додано до групи '%s'", user_id, full_name, group_title)
+    service_logger.debug(f"Виклик get_user з параметрами: user_id={user_id}, group_id={group_id}")
+    service_logger.debug(f"Користувача знайдено: user_id={user_id}, group_id={group_id}")
+
+
+def join_after(group_id: int, user_id: int) -> None:
+    group_title = "Benchmark group"
+    service_logger.debug("До %d груп додано %d нових учасників із %d", 1, 1, 1)
+    group_logger.info(
+        "Додано %d нових учасників із %d до групи '%s'", 1, 1, group_title,
+        extra={**SAMPLED, "group_id": group_id, "joined": 1, "added": 1},
+    )
+
+
+def measure(join, joins: int) -> float:
+    start = time.perf_counter()
+    for user_id in range(joins):
+        join(-1001, user_id)
+    return (time.perf_counter() - start) / joins
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--joins", type=int, default=20000)
+    args = parser.parse_args()
+
+    root = logging.getLogger()
+    with tempfile.TemporaryDirectory() as tmp:
+        before_log = open(os.path.join(tmp, "before.log"), "w")
+        logging.basicConfig(level=logging.DEBUG, format=TEXT_FORMAT, stream=before_log, force=True)
+        before = measure(join_before, args.joins)
+        before_log.close()
+
+        after_log = open(os.path.join(tmp, "after.log"), "w")
+        setup_logging(level="INFO", fmt="json", stream=after_log)
+        after = measure(join_after, args.joins)
+        after_queue_drain = time.perf_counter()
+        stop_logging()
+        drain = time.perf_counter() - after_queue_drain
+        after_log.close()
+        root.handlers.clear()
+
+        sizes = {name: os.path.getsize(os.path.join(tmp, f"{name}.log")) for name in ("before", "after")}
+
+    print(f"   до: {before * 1e6:.1f} мкс на приєднання у потоці event loop, {sizes['before'] / args.joins:.0f} Б логу")
+    print(f"після: {after * 1e6:.1f} мкс на приєднання у потоці event loop, {sizes['after'] / args.joins:.0f} Б логу"
+          f" (потік запису дописав чергу за {drain * 1000:.1f} мс)")
+
+
+if __name__ == "__main__":
+    main()
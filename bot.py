@@ -1,10 +1,27 @@
+import asyncio
 import logging
 import os
+import signal
+from typing import Optional
+from datetime import datetime
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from telegram import Update
-from telegram.ext import CommandHandler, ContextTypes, ApplicationBuilder, ConversationHandler, MessageHandler, filters
+from telegram.ext import Application, BasePersistence, CommandHandler, ContextTypes, ApplicationBuilder, ConversationHandler, MessageHandler, filters
 from dotenv import load_dotenv
-from db_config import SessionLocal, add_super_admin_if_not_exist, init_db
+from logging_config import setup_logging
+from db_config import AsyncSessionLocal, warm_up_pool
+from services.admin_service import AdminService
+from services.cache_service import CacheInvalidationListener, close_cache_manager, get_cache_manager
+from services.member_buffer_service import get_member_buffer
+from services.metrics_service import handler_timed, start_metrics_server
+from services.telegram_service import TelegramRateLimiter, build_request
+from services.update_queue_service import UPDATE_QUEUE_MODE, UpdateQueue
+from services.leader_service import LeaderElector
+from services.persistence_service import PostgresPersistence
+from services.cluster_service import BOT_ROLE, INSTANCE_HEARTBEAT_INTERVAL, InstanceRegistry
+from services.group_service import UNIQUE_COUNT_MODE
+from services.history_service import HISTORY_ROLLUP_INTERVAL
+from services.hll_service import HLL_FLUSH_INTERVAL
 from admin import (
     SUPER_ADMIN_ID, ADD_ADMIN, ADD_SUPER_ADMIN, REMOVE_ADMIN, 
     add_admin_start, remove_admin_start, add_super_admin_start,
@@ -12,55 +29,191 @@ from admin import (
     clean_old_potential_admins, add_potential_admin
     )
 from group import (
-    new_member, max_member_count, new_chat,
+    new_member, max_member_count, reconcile_unique_member_counts, rollup_member_count_history, merge_hll_sketches,
     count_active_groups, 
     count_specific_group_start, count_specific_group_process, 
     remove_group_start, remove_group_process,
-    leave_group,
+    leave_group, set_count_mode, group_history,
     REMOVE_GROUP, SPECIFIC_GROUP,
     )
 
 load_dotenv()
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+logger = logging.getLogger(__name__)
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 HEROKU_APP_NAME = os.getenv("HEROKU_APP_NAME") 
+RECONCILE_INTERVAL = int(os.getenv("RECONCILE_INTERVAL", 60))
+RECONCILE_FULL_INTERVAL = int(os.getenv("RECONCILE_FULL_INTERVAL", 3600))
+POTENTIAL_ADMIN_CLEANUP_INTERVAL = int(os.getenv("POTENTIAL_ADMIN_CLEANUP_INTERVAL", 3600))
+# Порт для GET /metrics у форматі Prometheus; без змінної сервер метрик не запускається
+METRICS_PORT = os.getenv("METRICS_PORT")
+# Telegram надсилає його в заголовку X-Telegram-Bot-Api-Secret-Token кожного запиту до вебхука
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
 
+# Планувальник, сервер метрик тощо цього процесу; bot_data лишається для серіалізовних даних
+background_services: dict = {}
+# Задачі планувальника, що виконуються лише в процесі-лідері
+LEADER_JOB_IDS = ("reconcile", "reconcile_full", "history_rollup", "potential_admins_cleanup")
 
+
+@handler_timed()
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
     username = update.effective_user.username
 
-    with SessionLocal() as session:
-        clean_old_potential_admins(session)
-
-        add_potential_admin(session, user_id, username)
+    async with AsyncSessionLocal() as session:
+        await add_potential_admin(session, user_id, username)
 
     await update.message.reply_text('Привіт! Я рахую унікальних учасників чату.')
 
-def scheduler_max_count(bot) -> None:
+async def warm_up_database() -> None:
+    """Відкриває з'єднання пулу і додає суперадміністратора, поки бот підключається до Telegram."""
+    await warm_up_pool()
+    async with AsyncSessionLocal() as session:
+        if await AdminService(session, cache=get_cache_manager()).ensure_super_admin(SUPER_ADMIN_ID):
+            logger.info("Суперадміністратора з ID %s додано в базу даних", SUPER_ADMIN_ID)
+
+async def startup(application) -> None:
+    member_buffer = get_member_buffer()
+    if member_buffer is not None:
+        await member_buffer.start()
+    if METRICS_PORT:
+        background_services["metrics_server"] = start_metrics_server(int(METRICS_PORT))
+    cache = get_cache_manager()
+    if cache is not None:
+        # Зміни груп і адміністраторів з інших процесів скидають кеші в пам'яті цього
+        listener = CacheInvalidationListener(cache)
+        background_services["cache_invalidation"] = listener
+        await listener.start()
+    if "scheduler" in background_services:
+        await start_scheduler(application)
+
+async def shutdown(application) -> None:
+    # Лок лідера відпускається одразу, щоб інший процес перейняв задачі без очікування
+    await stop_scheduler(application)
+    # Спершу записуємо буфер приєднань, поки Redis і база ще доступні
+    member_buffer = get_member_buffer()
+    if member_buffer is not None:
+        await member_buffer.stop()
+    # Останній запис буфера міг додати учасників до скетчів hll
+    try:
+        await merge_hll_sketches()
+    except Exception:
+        logger.exception("Не вдалося злити скетчі hll при зупинці")
+    listener = background_services.pop("cache_invalidation", None)
+    if listener is not None:
+        await listener.stop()
+    await close_cache_manager()
+    metrics_server = background_services.pop("metrics_server", None)
+    if metrics_server is not None:
+        metrics_server.stop()
+
+def scheduler_max_count(bot, registry: InstanceRegistry) -> AsyncIOScheduler:
+    """Створює планувальник фонових задач; запускає його startup().
+
+    Опитування кількості учасників, heartbeat і злиття скетчів hll виконуються в кожному процесі (кожен опитує
+    свій шард груп), звірка лічильників, агрегація історії і прибирання
+    запитів /start — лише в процесі-лідері.
+    """
     scheduler = AsyncIOScheduler()
-    scheduler.add_job(max_member_count, 'interval', minutes=1, args=[bot])
+    # Новий прохід не стартує, поки не завершився попередній
+    scheduler.add_job(max_member_count, 'interval', minutes=1, args=[bot, registry], max_instances=1, coalesce=True)
+    scheduler.add_job(registry.heartbeat, 'interval', seconds=INSTANCE_HEARTBEAT_INTERVAL, max_instances=1,
+                      coalesce=True)
+    # Скетчі hll накопичуються в пам'яті кожного процесу, тож кожен і зливає свої
+    scheduler.add_job(merge_hll_sketches, 'interval', seconds=HLL_FLUSH_INTERVAL, max_instances=1, coalesce=True)
+    if UNIQUE_COUNT_MODE == "reconcile":
+        # Задачі лідера створюються на паузі; при обранні лідером обидві запускаються одразу,
+        # тож повна звірка виправляє лічильники після зміни режиму, далі — раз на годину
+        scheduler.add_job(reconcile_unique_member_counts, 'interval', seconds=RECONCILE_INTERVAL,
+                          id="reconcile", next_run_time=None, max_instances=1, coalesce=True)
+        scheduler.add_job(reconcile_unique_member_counts, 'interval', seconds=RECONCILE_FULL_INTERVAL,
+                          kwargs={"full": True}, id="reconcile_full", next_run_time=None, max_instances=1,
+                          coalesce=True)
+    scheduler.add_job(rollup_member_count_history, 'interval', seconds=HISTORY_ROLLUP_INTERVAL,
+                      id="history_rollup", next_run_time=None, max_instances=1, coalesce=True)
+    scheduler.add_job(clean_old_potential_admins, 'interval', seconds=POTENTIAL_ADMIN_CLEANUP_INTERVAL,
+                      id="potential_admins_cleanup", next_run_time=None, max_instances=1, coalesce=True)
+    return scheduler
+
+
+def resume_leader_jobs(scheduler: AsyncIOScheduler) -> None:
+    for job_id in LEADER_JOB_IDS:
+        if scheduler.get_job(job_id) is not None:
+            scheduler.modify_job(job_id, next_run_time=datetime.now())
+
+
+def pause_leader_jobs(scheduler: AsyncIOScheduler) -> None:
+    for job_id in LEADER_JOB_IDS:
+        if scheduler.get_job(job_id) is not None:
+            scheduler.pause_job(job_id)
+
+
+async def start_scheduler(application) -> None:
+    """Реєструє процес у bot_instances і запускає планувальник; задачі лідера — під керуванням виборів."""
+    scheduler = background_services["scheduler"]
+    # Heartbeat до першого проходу, щоб процес одразу отримав свій шард
+    await background_services["instance_registry"].heartbeat()
     scheduler.start()
-    logging.info("Планувальник запущено: функція max_member_count буде виконуватись кожні 1 хвилин")
+    elector = LeaderElector(
+        "scheduler",
+        on_elected=lambda: resume_leader_jobs(scheduler),
+        on_demoted=lambda: pause_leader_jobs(scheduler),
+    )
+    background_services["scheduler_elector"] = elector
+    await elector.start()
+    logger.info("Планувальник запущено: функція max_member_count буде виконуватись кожні 1 хвилин для шарду процесу")
 
 
-def main() -> None:
-    init_db()
+async def stop_scheduler(application) -> None:
+    elector = background_services.pop("scheduler_elector", None)
+    if elector is not None:
+        await elector.stop()
+    scheduler = background_services.pop("scheduler", None)
+    if scheduler is not None and scheduler.running:
+        scheduler.shutdown(wait=False)
+    registry = background_services.pop("instance_registry", None)
+    if registry is not None:
+        # Решта процесів перерозподілить шарди на наступному проході, не чекаючи INSTANCE_TTL
+        await registry.leave()
+
+
+def setup_scheduler(application, role: str = BOT_ROLE) -> None:
+    """Готує планувальник і реєстр процесів; їх запустить startup(). Воркери черги реєструються з роллю worker."""
+    registry = InstanceRegistry(role=role)
+    background_services["instance_registry"] = registry
+    background_services["scheduler"] = scheduler_max_count(application.bot, registry)
 
-    super_admin_id = SUPER_ADMIN_ID
-    add_super_admin_if_not_exist(super_admin_id)
 
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
+def build_application(
+    persistence: Optional[BasePersistence] = None, rate_limiter: Optional[TelegramRateLimiter] = None,
+) -> Application:
+    """Створює Application з усіма обробниками.
+
+    З persistence стани розмов переживають перезапуск процесу, а воркери черги через неї
+    передають розмову один одному. Спільний rate_limiter потрібен, коли в процесі кілька
+    Application: ліміти Telegram діють на весь бот.
+    Хуків post_init/post_shutdown немає: фонові служби запускають і зупиняють
+    run_direct_webhook, run_queue_receiver і worker.py.
+    """
+    builder = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .request(build_request())
+        .rate_limiter(rate_limiter or TelegramRateLimiter())
+    )
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    application = builder.build()
+    persistent = persistence is not None
 
     application.add_handler(CommandHandler("start", start))
-    application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, new_chat))
+    application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, new_member))
 
     application.add_handler(ConversationHandler(
+        name="add_admin",
+        persistent=persistent,
         entry_points=[CommandHandler("add_admin", add_admin_start)],
         states={
             ADD_ADMIN: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_admin_process)],
@@ -68,6 +221,8 @@ def main() -> None:
         fallbacks=[],
     ))
     application.add_handler(ConversationHandler(
+        name="remove_admin",
+        persistent=persistent,
         entry_points=[CommandHandler("remove_admin", remove_admin_start)],
         states={
             REMOVE_ADMIN: [MessageHandler(filters.TEXT & ~filters.COMMAND, remove_admin_process)],
@@ -75,6 +230,8 @@ def main() -> None:
         fallbacks=[],
     ))
     application.add_handler(ConversationHandler(
+        name="add_super_admin",
+        persistent=persistent,
         entry_points=[CommandHandler("add_super_admin", add_super_admin_start)],
         states={
             ADD_SUPER_ADMIN: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_super_admin_process)],
@@ -84,6 +241,8 @@ def main() -> None:
 
     application.add_handler(CommandHandler("active_groups", count_active_groups))   
     application.add_handler(ConversationHandler(
+        name="specific_group",
+        persistent=persistent,
         entry_points=[CommandHandler("specific_group", count_specific_group_start)],
         states={
             SPECIFIC_GROUP: [MessageHandler(filters.TEXT & ~filters.COMMAND, count_specific_group_process)],
@@ -92,6 +251,8 @@ def main() -> None:
     ))
 
     application.add_handler(ConversationHandler(
+        name="remove_group",
+        persistent=persistent,
         entry_points=[CommandHandler("remove_group", remove_group_start)],
         states={
             REMOVE_GROUP: [MessageHandler(filters.TEXT & ~filters.COMMAND, remove_group_process)],
@@ -99,20 +260,93 @@ def main() -> None:
         fallbacks=[],
     ))
     application.add_handler(CommandHandler("leave_group", leave_group))
+    application.add_handler(CommandHandler("count_mode", set_count_mode))
+    application.add_handler(CommandHandler("history", group_history))
+    return application
+
+
+async def wait_for_stop_signal() -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+
+async def run_direct_webhook(application: Application, port: int, webhook_url: str) -> None:
+    """Режим direct: оновлення з вебхука обробляє цей процес.
+
+    Те саме, що Application.run_webhook, але без послідовних кроків: getMe паралельно з
+    відкриттям з'єднань до бази, реєстрація вебхука — паралельно з запуском фонових задач.
+    """
+    await asyncio.gather(application.initialize(), warm_up_database())
+    setup_scheduler(application)
+    try:
+        await asyncio.gather(
+            application.updater.start_webhook(
+                listen="0.0.0.0",  # Слухати на всіх інтерфейсах
+                port=port,
+                url_path=BOT_TOKEN,  # URL шлях вебхука (зазвичай це токен)
+                webhook_url=webhook_url,
+                secret_token=WEBHOOK_SECRET,
+            ),
+            startup(application),
+        )
+        await application.start()
+        logger.info("Вебхук приймає оновлення на порту %s", port)
+        await wait_for_stop_signal()
+    finally:
+        if application.updater.running:
+            await application.updater.stop()
+        if application.running:
+            await application.stop()
+        await shutdown(application)
+        await application.shutdown()
+
 
-    scheduler_max_count(application.bot)
+async def run_queue_receiver(application: Application, port: int, webhook_url: str) -> None:
+    """Режим черги: вебхук лише складає оновлення в update_queue, обробляють їх процеси worker.py.
+
+    Планувальник лишається в цьому процесі, а не у воркерах.
+    """
+    # Приймач черги потрібен лише в цьому режимі (tornado при цьому вже завантажений сервером метрик)
+    import receiver
+
+    await asyncio.gather(application.initialize(), warm_up_database())
+    setup_scheduler(application)
+    server = receiver.listen(receiver.make_receiver_app(UpdateQueue(), BOT_TOKEN, WEBHOOK_SECRET), port)
+    try:
+        await asyncio.gather(
+            application.bot.set_webhook(webhook_url, secret_token=WEBHOOK_SECRET),
+            startup(application),
+        )
+        logger.info("Вебхук приймає оновлення в чергу на порту %s", port)
+        await wait_for_stop_signal()
+    finally:
+        server.stop()
+        await shutdown(application)
+        await application.shutdown()
+
+
+def main() -> None:
+    # Схему до старту доводить release-фаза Heroku (migrate.py), тут таблиці не перевіряються
+    setup_logging()
+
+    # У режимі черги оновлення обробляють воркери зі спільним станом розмов, тут persistence не потрібна
+    persistence = PostgresPersistence() if UPDATE_QUEUE_MODE != "postgres" else None
+    application = build_application(persistence)
 
     if not HEROKU_APP_NAME:
         raise ValueError("HEROKU_APP_NAME не налаштовано. Додайте цю змінну у вашу конфігурацію.")
 
     WEBHOOK_URL = f"https://{HEROKU_APP_NAME}.herokuapp.com/{BOT_TOKEN}"
+    port = int(os.getenv("PORT", 8443))  # Використати змінну PORT для Heroku
 
-    application.run_webhook(
-        listen="0.0.0.0",  # Слухати на всіх інтерфейсах
-        port=int(os.getenv("PORT", 8443)),  # Використати змінну PORT для Heroku
-        url_path=BOT_TOKEN,  # URL шлях вебхука (зазвичай це токен)
-        webhook_url=WEBHOOK_URL
-    )
+    if UPDATE_QUEUE_MODE == "postgres":
+        asyncio.run(run_queue_receiver(application, port, WEBHOOK_URL))
+        return
+
+    asyncio.run(run_direct_webhook(application, port, WEBHOOK_URL))
     # application.run_polling()
 
 if __name__ == '__main__':
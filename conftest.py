@@ -0,0 +1,18 @@
+import pytest
+import pytest_asyncio
+from db_config import async_engine
+from test_db import create_test_database, drop_test_database
+
+@pytest.fixture(scope="session", autouse=True)
+def setup_and_teardown_database():
+    # Створення тестової бази
+    create_test_database()
+    yield
+    # Видалення тестової бази після завершення
+    drop_test_database()
+
+@pytest_asyncio.fixture(autouse=True)
+async def dispose_async_engine():
+    # Кожен тест має власний event loop, тож з'єднання asyncpg не можна переносити між тестами
+    yield
+    await async_engine.dispose()
@@ -1,10 +1,16 @@
+import asyncio
 import os
-from sqlalchemy import create_engine, ForeignKey, UniqueConstraint, Column, Integer, BigInteger, String, Boolean, DateTime
-from sqlalchemy.orm import sessionmaker, relationship, declarative_base
+import time
+from sqlalchemy import create_engine, event, func, text, ForeignKey, Index, UniqueConstraint, Column, Integer, BigInteger, String, Boolean, DateTime, LargeBinary
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker, relationship, declarative_base, deferred
 from sqlalchemy.sql import func
 from dotenv import load_dotenv
-from datetime import datetime, timedelta, timezone
-from sqlalchemy.exc import IntegrityError
+from services.metrics_service import REGISTRY
 
 
 load_dotenv()
@@ -13,10 +19,159 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Пул з'єднань. На Heroku Postgres ліміт з'єднань спільний для всіх дино й процесів,
+# тож (DB_POOL_SIZE + DB_MAX_OVERFLOW) x кількість процесів має вкладатися в нього
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 5))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+# Перевідкривати з'єднання, старші за N секунд (проксі й сервер рвуть довго простійні з'єднання)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+# Перевіряти з'єднання легким запитом перед видачею з пулу, щоб не отримати помилку після простою
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# statement_timeout на сервері в мілісекундах; 0 — без обмеження
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 0))
+
+DB_POOL_CHECKOUT_SECONDS = REGISTRY.histogram(
+    "db_pool_checkout_seconds", "Час очікування з'єднання з пулу",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+DB_POOL_TIMEOUTS = REGISTRY.counter("db_pool_timeouts_total", "Скільки разів пул не видав з'єднання за DB_POOL_TIMEOUT")
+DB_POOL_CHECKED_OUT = REGISTRY.gauge("db_pool_checked_out", "Кількість виданих з пулу з'єднань")
+DB_POOL_SATURATION = REGISTRY.gauge(
+    "db_pool_saturation", "Частка зайнятих з'єднань від DB_POOL_SIZE + DB_MAX_OVERFLOW"
+)
+
+DB_QUERY_SECONDS = REGISTRY.histogram("db_query_seconds", "Тривалість SQL-запитів")
+
+
+def record_pool_usage(checked_out: int, label: str) -> None:
+    capacity = DB_POOL_SIZE + max(DB_MAX_OVERFLOW, 0)
+    DB_POOL_CHECKED_OUT.set(checked_out, engine=label)
+    DB_POOL_SATURATION.set(checked_out / capacity if capacity else 0, engine=label)
+
+
+class _PoolMetricsMixin:
+    """Міряє час видачі з'єднання: очікування у черзі, відкриття, pre-ping."""
+
+    metrics_label = ""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            DB_POOL_TIMEOUTS.inc(engine=self.metrics_label)
+            raise
+        finally:
+            DB_POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - start, engine=self.metrics_label)
+
+
+class InstrumentedQueuePool(_PoolMetricsMixin, QueuePool):
+    metrics_label = "sync"
+
+
+class InstrumentedAsyncPool(_PoolMetricsMixin, AsyncAdaptedQueuePool):
+    metrics_label = "async"
+
+
+def engine_options(poolclass, connect_args: dict) -> dict:
+    return {
+        "poolclass": poolclass,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "connect_args": connect_args if DB_STATEMENT_TIMEOUT_MS else {},
+    }
+
+
+def track_pool_usage(sync_engine, label: str) -> None:
+    """Оновлює заповненість пулу на подіях checkout і checkin."""
+    # engine.pool читається під час події: dispose() замінює пул новим, а слухачі переносить
+    @event.listens_for(sync_engine, "checkout")
+    def _checked_out(dbapi_connection, connection_record, connection_proxy):
+        record_pool_usage(sync_engine.pool.checkedout(), label)
+
+    @event.listens_for(sync_engine, "checkin")
+    def _checked_in(dbapi_connection, connection_record):
+        # checkin спрацьовує ще до повернення з'єднання в чергу, тож пул досі рахує його виданим
+        record_pool_usage(sync_engine.pool.checkedout() - 1, label)
+
+
+def track_query_time(sync_engine, label: str) -> None:
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _start_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _end_query(conn, cursor, statement, parameters, context, executemany):
+        DB_QUERY_SECONDS.observe(time.perf_counter() - conn.info["query_start"].pop(), engine=label)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _failed_query(exception_context):
+        # after_cursor_execute для запиту з помилкою не викликається
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start"):
+            conn.info["query_start"].pop()
+
+
+# Синхронний двигун (psycopg2) потрібен лише init_db, скриптам і бенчмаркам; бот працює через
+# async_engine, тож двигун і сам psycopg2 створюються при першому зверненні до engine чи SessionLocal
+_engine = None
+_session_local = None
+
+
+def get_engine():
+    global _engine, _session_local
+    if _engine is None:
+        _engine = create_engine(
+            DATABASE_URL,
+            **engine_options(InstrumentedQueuePool, {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}),
+        )
+        track_pool_usage(_engine, InstrumentedQueuePool.metrics_label)
+        track_query_time(_engine, InstrumentedQueuePool.metrics_label)
+        _session_local = sessionmaker(autocommit=False, autoflush=False, bind=_engine)
+    return _engine
+
+
+def __getattr__(name: str):
+    # from db_config import engine, SessionLocal працює як і раніше, але без витрат при старті бота
+    if name == "engine":
+        return get_engine()
+    if name == "SessionLocal":
+        get_engine()
+        return _session_local
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Асинхронний двигун (asyncpg) для обробників бота, щоб запити не блокували event loop
+ASYNC_DATABASE_URL = make_url(DATABASE_URL).set(drivername="postgresql+asyncpg")
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    **engine_options(
+        InstrumentedAsyncPool, {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+    ),
+)
+track_pool_usage(async_engine.sync_engine, InstrumentedAsyncPool.metrics_label)
+track_query_time(async_engine.sync_engine, InstrumentedAsyncPool.metrics_label)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+async def warm_up_pool(connections: int = DB_POOL_SIZE) -> None:
+    """Відкриває з'єднання пулу заздалегідь, щоб перші оновлення не чекали на TCP/TLS і автентифікацію."""
+    async def ping():
+        async with async_engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+    await asyncio.gather(*(ping() for _ in range(max(1, connections))))
+
+
 Base = declarative_base()
 
+# Кількість hash-секцій user_groups; змінюється лише міграцією з перенесенням даних
+USER_GROUPS_PARTITIONS = 16
+
 class Admin(Base):
     __tablename__ = "admins"
 
@@ -35,50 +190,161 @@ class Group(Base):
     unique_members_count = Column(Integer, default=0)
     is_active = Column(Boolean, default=True)
     max_member_count = Column(Integer, default=0)
+    # exact — кожен учасник зберігається в user_groups; hll — лише HyperLogLog-скетч у hll_sketch
+    count_mode = Column(String, nullable=False, default="exact", server_default="exact")
+    hll_sketch = deferred(Column(LargeBinary, nullable=True))
 
-    unique_users = relationship("UserGroup", back_populates="group", cascade='all, delete')
+    # Учасників видаляє ON DELETE CASCADE у базі: ORM не завантажує їх і не видаляє по рядку
+    unique_users = relationship("UserGroup", back_populates="group", cascade='all, delete', passive_deletes=True)
+
+    # lower(group_name) у побайтовому порядку (COLLATE "C") обслуговує точний збіг без урахування регістру,
+    # LIKE 'abc%' і впорядкування результатів пошуку за префіксом.
+    # GIN-індекс ix_groups_group_name_trgm для нечіткого пошуку створюється лише міграцією, бо потребує pg_trgm.
+    __table_args__ = (
+        Index('ix_groups_group_name_lower', func.lower(group_name).collate('C')),
+    )
 
 class UserGroup(Base):
+    """Учасник групи: один B-tree за (group_id, user_id) без сурогатного id.
+
+    Таблиця розбита на USER_GROUPS_PARTITIONS hash-секцій за group_id, тож учасники
+    однієї групи лежать в одній секції, а індекс кожної секції невеликий.
+    """
+
     __tablename__ = "user_groups"
 
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(BigInteger, nullable=False)
-    group_id = Column(BigInteger, ForeignKey('groups.group_id'), nullable=False)
-    
-    __table_args__ = (UniqueConstraint('user_id', 'group_id', name='_user_group_uc'),)
+    group_id = Column(BigInteger, ForeignKey('groups.group_id', ondelete='CASCADE'), primary_key=True)
+    user_id = Column(BigInteger, primary_key=True)
+
+    __table_args__ = {"postgresql_partition_by": "HASH (group_id)"}
 
     group = relationship("Group", back_populates="unique_users")
 
 
+@event.listens_for(UserGroup.__table__, "after_create")
+def create_user_groups_partitions(target, connection, **kw):
+    for remainder in range(USER_GROUPS_PARTITIONS):
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS user_groups_p{remainder} PARTITION OF user_groups "
+            f"FOR VALUES WITH (MODULUS {USER_GROUPS_PARTITIONS}, REMAINDER {remainder})"
+        ))
+
+
+class MemberCountDelta(Base):
+    """Приріст учасників групи, ще не доданий до groups.unique_members_count (режим reconcile).
+
+    Кожна пакетна вставка в user_groups дописує сюди рядок на групу замість UPDATE
+    гарячого рядка groups; звірка забирає й видаляє ці рядки та оновлює лічильники.
+    """
+
+    __tablename__ = "member_count_deltas"
+
+    id = Column(BigInteger, primary_key=True)
+    group_id = Column(BigInteger, ForeignKey('groups.group_id', ondelete='CASCADE'), nullable=False)
+    added = Column(Integer, nullable=False)
+
+
+class GroupPollState(Base):
+    __tablename__ = "group_poll_state"
+
+    group_id = Column(BigInteger, ForeignKey('groups.group_id', ondelete='CASCADE'), primary_key=True)
+    last_count = Column(Integer, nullable=True)
+    interval_seconds = Column(Integer, nullable=False)
+    next_poll_at = Column(DateTime, nullable=False, index=True)
+    last_polled_at = Column(DateTime, nullable=True)
+
+
+class MemberCountSample(Base):
+    """Кількість учасників групи в момент опитування; пишеться лише тоді, коли вона змінилась.
+
+    Між двома рядками кількість лишалась такою, як у першому з них.
+    """
+
+    __tablename__ = "member_count_samples"
+
+    group_id = Column(BigInteger, ForeignKey('groups.group_id', ondelete='CASCADE'), primary_key=True)
+    sampled_at = Column(DateTime, primary_key=True)
+    count = Column(Integer, nullable=False)
+
+
+class MemberCountRollup(Base):
+    """Мінімум, максимум і останнє значення кількості учасників групи за годину або день."""
+
+    __tablename__ = "member_count_rollups"
+
+    group_id = Column(BigInteger, ForeignKey('groups.group_id', ondelete='CASCADE'), primary_key=True)
+    # hour або day
+    resolution = Column(String(4), primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    min_count = Column(Integer, nullable=False)
+    max_count = Column(Integer, nullable=False)
+    last_count = Column(Integer, nullable=False)
+
+
+class BotInstance(Base):
+    """Живий процес бота; за цими рядками між процесами ділиться опитування груп.
+
+    role відрізняє воркерів черги оновлень (worker): чати черги ділять лише вони.
+    """
+
+    __tablename__ = "bot_instances"
+
+    instance_id = Column(String, primary_key=True)
+    role = Column(String, nullable=False, server_default="bot")
+    started_at = Column(DateTime, nullable=False)
+    heartbeat_at = Column(DateTime, nullable=False, index=True)
+
+
+class UpdateQueueItem(Base):
+    """Оновлення Telegram, прийняте вебхуком і ще не оброблене воркером."""
+
+    __tablename__ = "update_queue"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    # Telegram повторює доставку, якщо вебхук не відповів вчасно; унікальність відкидає дублікати
+    update_id = Column(BigInteger, unique=True, nullable=False)
+    # Оновлення одного чату обробляються строго по черзі; NULL — оновлення без чату
+    chat_id = Column(BigInteger, nullable=True)
+    payload = Column(JSONB, nullable=False)
+    received_at = Column(DateTime, nullable=False, server_default=func.now())
+    locked_by = Column(String, nullable=True)
+    locked_until = Column(DateTime, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (Index('ix_update_queue_chat_id_id', 'chat_id', 'id'),)
+
+
+class ConversationState(Base):
+    """Стан ConversationHandler, спільний для всіх процесів бота."""
+
+    __tablename__ = "conversation_states"
+
+    handler_name = Column(String, primary_key=True)
+    # Ключ розмови (chat_id, user_id, ...) у вигляді JSON-масиву
+    conversation_key = Column(String, primary_key=True)
+    state = Column(JSONB, nullable=True)
+    updated_at = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+
+
+class PersistentData(Base):
+    """Дані Application (bot_data тощо), що мають пережити перезапуск процесу."""
+
+    __tablename__ = "persistent_data"
+
+    key = Column(String, primary_key=True)
+    data = Column(JSONB, nullable=False)
+    updated_at = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+
+
 class PotentialAdmin(Base):
     __tablename__ = "potential_admins"
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(BigInteger, unique=True, nullable=False)
     username = Column(String, nullable=True)
-    requested_at = Column(DateTime, default=func.now())
-
-    @staticmethod
-    def clean_old_potential_admins(session):
-        expiry_time = datetime.now(timezone.utc) - timedelta(hours=24)
-        session.query(PotentialAdmin).filter(PotentialAdmin.requested_at < expiry_time).delete()
-        session.flush()
-        session.commit()
-
-def add_super_admin_if_not_exist(super_admin_id):
-    with SessionLocal() as session:
-        try:
-            admin = session.query(Admin).filter_by(user_id=super_admin_id).first()
-            if not admin:
-                super_admin = Admin(user_id=super_admin_id, is_super_admin=True)
-                session.add(super_admin)
-                session.commit()
-                print(f"Супер адміністратора з ID {super_admin_id} додано в базу даних.")
-            else:
-                print(f"Супер адміністратор з ID {super_admin_id} вже існує в базі даних.")
-        except IntegrityError:
-            session.rollback()
-            print("Помилка: не вдалося додати супер адміністратора.")
+    # Застарілі записи видаляє фонова задача пачками за цим індексом
+    requested_at = Column(DateTime, default=func.now(), index=True)
 
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    """Створює таблиці за моделями; викликає лише migrate.py для порожньої бази, далі схему веде Alembic."""
+    Base.metadata.create_all(bind=get_engine())
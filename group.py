@@ -1,142 +1,217 @@
+import csv
+import io
 import logging
+import tempfile
+from datetime import datetime, timezone
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
-from services.group_service import GroupService
+from services.group_service import GroupService, parse_group_identifier
+from services.history_service import RESOLUTIONS, HistoryService
+from services.hll_service import HyperLogLog
+from services.cache_service import get_cache_manager, group_lru, member_count_cache
+from services.member_buffer_service import get_member_buffer
+from services.metrics_service import handler_timed, job_timed
+from logging_config import SAMPLED
+from services.poller_service import MemberCountPoller, mark_group_active
 from sqlalchemy.exc import IntegrityError
-from admin import is_admin
-from db_config import SessionLocal
+from admin import is_admin, is_super_admin
+from db_config import AsyncSessionLocal
 
-logging.basicConfig(
-    level=logging.INFO, 
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 REMOVE_GROUP, SPECIFIC_GROUP = range(2)
+TELEGRAM_MESSAGE_LIMIT = 4096
+CSV_SPOOL_SIZE = 1024 * 1024
+SEARCH_SUGGESTIONS = 5
+REPORT_CHUNK_SIZE = 500
 
-async def new_member(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    logger.info("Отримано нових учасників у групі '%s' (%d)", update.effective_chat.title, update.effective_chat.id)
+def format_current_count(current) -> str:
+    """current — (кількість, unix-час) з member_count_cache або None, якщо свіжих даних немає."""
+    if current is None:
+        return ""
+    count, fetched_at = current
+    return f'зараз - {count} (станом на {datetime.fromtimestamp(fetched_at, timezone.utc):%H:%M} UTC), '
+
+async def with_current_counts(rows, chunk_size: int = REPORT_CHUNK_SIZE):
+    """Додає до рядків звіту поточну кількість учасників з кешу, по одному запиту до Redis на chunk_size груп."""
+    chunk = []
+    async for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            current = await member_count_cache.get_many((row.group_id for row in chunk), get_cache_manager())
+            for row in chunk:
+                yield row, current.get(row.group_id)
+            chunk = []
+    if chunk:
+        current = await member_count_cache.get_many((row.group_id for row in chunk), get_cache_manager())
+        for row in chunk:
+            yield row, current.get(row.group_id)
+
+def format_unique_count(group) -> str:
+    if group.count_mode == "hll":
+        return (f'унікальних учасників - ≈{group.unique_members_count} '
+                f'(режим HLL, похибка ±{HyperLogLog().relative_error:.2%})')
+    return f'унікальних учасників - {group.unique_members_count} (точний режим)'
 
-    with SessionLocal() as session:
+@handler_timed()
+async def new_member(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    async with AsyncSessionLocal() as session:
         try:
-            group_service = GroupService(session)
+            group_service = GroupService(session, cache=get_cache_manager())
 
             group_id = update.effective_chat.id
             group_title = update.effective_chat.title
 
-            group = group_service.get_or_create_group(group_id, group_title)
-            logger.info("Група оброблена: %s (ID: %d)", group_title, group_id)
-
-            # Обробка нових учасників
-            for user in update.message.new_chat_members:
-                if user.id != context.bot.id:
-                    logger.info("Спроба додати користувача: ID %d, ім'я: %s", user.id, user.full_name)
-                    try:
-                        success = group_service.add_unique_member(group, user.id)
-                        if success:
-                            logger.info("Успіх: Користувача ID %d, ім'я %s додано до групи '%s'", user.id, user.full_name, group_title)
-                        else:
-                            logger.warning("Користувач ID %d вже є у групі '%s'", user.id, group_title)
-
-                        # Додаткова перевірка
-                        user_record = group_service.get_user(user_id=user.id, group_id=group.group_id)
-                        if not user_record:
-                            logger.warning("Користувач ID %d не знайдений у базі після додавання. Повторна спроба.", user.id)
-                            success = group_service.add_unique_member(group, user.id)
-                            if success:
-                                logger.info("Повторна спроба успішна: Користувача ID %d додано до групи '%s'", user.id, group_title)
-                            else:
-                                logger.error("Повторна спроба додавання користувача ID %d не вдалася.", user.id)
-
-                    except IntegrityError as e:
-                        session.rollback()
-                        logger.error("IntegrityError: Помилка при додаванні користувача ID %d до групи '%s': %s", user.id, group_title, str(e))
-                    except Exception as e:
-                        session.rollback()
-                        logger.error("Помилка: Користувач ID %d не був доданий до групи '%s': %s", user.id, group_title, str(e))
-
-            # Фінальний коміт після обробки всіх учасників
-            session.commit()
+            group = await group_service.get_or_create_group(group_id, group_title)
+
+            # Обробка нових учасників однією пачкою: один INSERT і один коміт на оновлення
+            user_ids = [user.id for user in update.message.new_chat_members if user.id != context.bot.id]
+            member_buffer = get_member_buffer()
+            if user_ids and member_buffer is not None:
+                # Режим write_behind: приєднання записуються у фоні пачками
+                buffered = await member_buffer.add(group.group_id, user_ids)
+                mark_group_active(group_id)
+                logger.info(
+                    "Буферизовано %d нових приєднань із %d для групи '%s'", buffered, len(user_ids), group_title,
+                    extra={**SAMPLED, "group_id": group_id, "joined": len(user_ids), "added": buffered},
+                )
+            elif user_ids:
+                try:
+                    added = await group_service.add_unique_members(group, user_ids)
+                    mark_group_active(group_id)
+                    if group.count_mode == "hll":
+                        # Учасники лише оновлюють скетч у пам'яті, кількість нових невідома
+                        logger.info(
+                            "Передано %d приєднань до HLL-скетчу групи '%s'", len(user_ids), group_title,
+                            extra={**SAMPLED, "group_id": group_id, "joined": len(user_ids)},
+                        )
+                    else:
+                        logger.info(
+                            "Додано %d нових учасників із %d до групи '%s'", added, len(user_ids), group_title,
+                            extra={**SAMPLED, "group_id": group_id, "joined": len(user_ids), "added": added},
+                        )
+                except IntegrityError as e:
+                    await session.rollback()
+                    logger.error("IntegrityError: Помилка при додаванні учасників до групи '%s': %s", group_title, str(e))
         except Exception as e:
-            session.rollback()
+            await session.rollback()
             logger.exception("Невідома помилка при обробці групи '%s' (ID: %d): %s", group_title, group_id, str(e))
 
-async def new_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    logger.info("Отримано нову групу '%s' (%d)", update.effective_chat.title, update.effective_chat.id)
+@job_timed()
+async def max_member_count(bot, registry=None) -> None:
+    await MemberCountPoller(bot, registry=registry).run_pass()
 
-    with SessionLocal() as session:
-        try:
-            group_service = GroupService(session)
+@job_timed()
+async def reconcile_unique_member_counts(full: bool = False) -> None:
+    async with AsyncSessionLocal() as session:
+        group_service = GroupService(session, cache=get_cache_manager())
+        await group_service.reconcile_unique_member_counts(full=full)
 
-            group_id = update.effective_chat.id
-            group_title = update.effective_chat.title
+@job_timed()
+async def merge_hll_sketches() -> None:
+    async with AsyncSessionLocal() as session:
+        await GroupService(session, cache=get_cache_manager()).merge_pending_sketches()
 
-            group_service.get_or_create_group(group_id, group_title)
-            logger.info("Група оброблена: %s (ID: %d)", group_title, group_id)
-        except Exception as e:
-            logger.exception("Невідома помилка при обробці групи '%s' (ID: %d): %s", group_title, group_id, str(e))
-        
-async def max_member_count(bot) -> None:
-    with SessionLocal() as session:
-        group_service = GroupService(session)
-        groups = group_service.get_active_groups()
-
-        for group in groups:
-            logger.debug(f"Отримано групи: {[group.group_name for group in groups]}")
-            try:
-                member_count = await bot.get_chat_member_count(chat_id=group.group_id)
-
-                if group.max_member_count is None:
-                    group.max_member_count = 0
-
-                if group.max_member_count < member_count:
-                    group.max_member_count = member_count
-                    logger.debug(f"Перед комітом: max_member_count для групи {group.group_name} = {group.max_member_count}")
-                    session.add(group)
-                    session.commit()
-                    logger.debug(f"Після коміту: max_member_count для групи {group.group_name} = {group.max_member_count}")
-            except Exception as e:
-                session.rollback()
-                logger.error(f"Помилка отримання даних для групи {group.group_name}: {e}")
+@job_timed()
+async def rollup_member_count_history() -> None:
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    async with AsyncSessionLocal() as session:
+        history_service = HistoryService(session)
+        await history_service.rollup(now)
+        await history_service.apply_retention(now)
 
+@handler_timed()
 async def count_active_groups(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin(update.effective_user.id):
         await update.message.reply_text("У вас немає прав на виконання цієї команди.")
         return
-    
-    active_groups = GroupService.get_active_groups()
-    counts = []
 
-    for group in active_groups:
-        counts.append(
-            f'Група "{group.group_name}": Максимальна кількість учасників - {group.max_member_count}'
-            )
+    as_csv = bool(context.args) and context.args[0].lower() == "csv"
+    async with AsyncSessionLocal() as session:
+        rows = GroupService(session).stream_active_group_stats()
+        if as_csv:
+            sent = await send_active_groups_csv(context.bot, update.effective_user.id, rows)
+        else:
+            sent = await send_active_groups_pages(context.bot, update.effective_user.id, rows)
 
-    if counts:
-        await context.bot.send_message(update.effective_user.id, "\n".join(counts))
-    else:
+    if not sent:
         await context.bot.send_message(update.effective_user.id, "Бот ще не доданий до жодної активної групи.")
 
+def format_group_line(group, current=None) -> str:
+    return (f'Група "{group.group_name}": Максимальна кількість учасників - {group.max_member_count}, '
+            f'{format_current_count(current)}{format_unique_count(group)}')
+
+async def send_active_groups_pages(bot, chat_id: int, rows) -> int:
+    """Надсилає звіт сторінками до TELEGRAM_MESSAGE_LIMIT символів, не накопичуючи весь список у пам'яті."""
+    page, page_length, total = [], 0, 0
+    async for row, current in with_current_counts(rows):
+        line = format_group_line(row, current)[:TELEGRAM_MESSAGE_LIMIT]
+        if page and page_length + len(line) + 1 > TELEGRAM_MESSAGE_LIMIT:
+            await bot.send_message(chat_id, "\n".join(page))
+            page, page_length = [], 0
+        page.append(line)
+        page_length += len(line) + 1
+        total += 1
+    if page:
+        await bot.send_message(chat_id, "\n".join(page))
+    return total
+
+async def send_active_groups_csv(bot, chat_id: int, rows) -> int:
+    """Надсилає звіт CSV-документом; великі звіти буферизуються на диску, а не в пам'яті."""
+    total = 0
+    with tempfile.SpooledTemporaryFile(max_size=CSV_SPOOL_SIZE, mode="w+b") as buffer:
+        text = io.TextIOWrapper(buffer, encoding="utf-8-sig", newline="")
+        writer = csv.writer(text)
+        writer.writerow([
+            "group_name", "max_member_count", "current_member_count", "current_fetched_at",
+            "unique_members_count", "count_mode",
+        ])
+        async for row, current in with_current_counts(rows):
+            count, fetched_at = current or (None, None)
+            if fetched_at is not None:
+                fetched_at = datetime.fromtimestamp(fetched_at, timezone.utc).isoformat(timespec="seconds")
+            writer.writerow([
+                row.group_name, row.max_member_count, count, fetched_at, row.unique_members_count, row.count_mode,
+            ])
+            total += 1
+        text.flush()
+        buffer.seek(0)
+        if total:
+            await bot.send_document(chat_id, document=buffer, filename="active_groups.csv",
+                                    caption=f"Активних груп: {total}")
+        text.detach()
+    return total
+
+@handler_timed()
 async def count_specific_group_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin(update.effective_user.id):
         await update.message.reply_text("У вас немає прав на виконання цієї команди.")
         return ConversationHandler.END
-    await update.message.reply_text("Введіть ID або точну назву групи для отримання інформації.")
+    await update.message.reply_text("Введіть ID або назву групи для отримання інформації.")
     return SPECIFIC_GROUP
 
+@handler_timed()
 async def count_specific_group_process(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    group_identifier = update.message.text.strip()
+    group_identifier = parse_group_identifier(update.message.text)
 
-    with SessionLocal() as session:
-        group = GroupService.get_group_by_identifier(session, group_identifier)
+    async with AsyncSessionLocal() as session:
+        group_service = GroupService(session, cache=get_cache_manager())
+        group = await group_service.get_group_by_identifier(group_identifier)
         if group:
-            message = (f'Група "{group.group_name}": Максимальна кількість учасників - '
-                    f'{group.max_member_count}')
-            await update.message.reply_text(message)
+            current = await member_count_cache.get_many([group.group_id], get_cache_manager())
+            await update.message.reply_text(format_group_line(group, current.get(group.group_id)))
+            return ConversationHandler.END
+
+        matches = await group_service.find_groups(group_identifier, limit=SEARCH_SUGGESTIONS)
+        if matches:
+            lines = ["Точного збігу немає. Можливо, ви мали на увазі:"]
+            lines += [f"{match.group_name} (ID {match.group_id})" for match in matches]
+            await update.message.reply_text("\n".join(lines))
         else:
             await update.message.reply_text("Групу не знайдено або бот не активний у цій групі.")
 
     return ConversationHandler.END
 
+@handler_timed()
 async def remove_group_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin(update.effective_user.id):
         await update.message.reply_text("У вас немає прав на виконання цієї команди.")
@@ -144,38 +219,109 @@ async def remove_group_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await update.message.reply_text("Введіть ID або назву групи, яку хочете видалити.")
     return REMOVE_GROUP
     
+@handler_timed()
 async def remove_group_process(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_input = update.message.text.strip()
-    with SessionLocal() as session:
-        group_service = GroupService(session)
+    user_input = parse_group_identifier(update.message.text)
+    async with AsyncSessionLocal() as session:
+        group_service = GroupService(session, cache=get_cache_manager())
 
         try:
-            result = group_service.delete_group(user_input)
+            result = await group_service.delete_group(user_input)
             await update.message.reply_text(result)
         except IntegrityError:
-            session.rollback()
+            await session.rollback()
             await update.message.reply_text("Виникла помилка при видаленні групи.")
         except Exception as e:
             await update.message.reply_text(f"Помилка: {e}")
 
     return ConversationHandler.END
     
+@handler_timed()
 async def leave_group(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin(update.effective_user.id):
         await update.message.reply_text("У вас немає прав на виконання цієї команди.")
         return ConversationHandler.END
     
-    group_identifier = ' '.join(context.args).strip() if context.args else update.effective_chat.id
+    group_identifier = parse_group_identifier(' '.join(context.args)) if context.args else update.effective_chat.id
 
-    with SessionLocal() as session:
-        group_service = GroupService(session)
+    async with AsyncSessionLocal() as session:
+        group_service = GroupService(session, cache=get_cache_manager())
 
-        group = group_service.get_group_by_identifier(session=session, group_identifier=group_identifier)
+        group = await group_service.get_group_by_identifier(group_identifier)
 
         if group:
-            result = group_service.delete_group(group_identifier)
+            result = await group_service.delete_group(group.group_id)
             await context.bot.leave_chat(group.group_id)
+            group_lru.invalidate(group.group_id)
             await update.message.reply_text(result or f"Бот покинув групу '{group.group_name}'.")
         else:
             await update.message.reply_text("Групу не знайдено.")
 
+@handler_timed()
+async def set_count_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await is_super_admin(update.effective_user.id):
+        await update.message.reply_text("У вас немає прав на виконання цієї команди.")
+        return
+
+    if not context.args or len(context.args) < 2:
+        sketch = HyperLogLog()
+        await update.message.reply_text(
+            "Використання: /count_mode <ID або назва групи> <exact|hll> [purge]\n"
+            f"У режимі hll стандартна похибка ±{sketch.relative_error:.2%}, "
+            f"у ~95% випадків — не більше ±{2 * sketch.relative_error:.2%}."
+        )
+        return
+
+    args = list(context.args)
+    purge_rows = args[-1] == "purge"
+    if purge_rows:
+        args.pop()
+    mode = args.pop()
+    group_identifier = parse_group_identifier(' '.join(args))
+
+    async with AsyncSessionLocal() as session:
+        group_service = GroupService(session, cache=get_cache_manager())
+        result = await group_service.set_count_mode(group_identifier, mode, purge_rows=purge_rows)
+    await update.message.reply_text(result)
+
+def format_history_line(rollup) -> str:
+    if rollup.resolution == "hour":
+        period = rollup.bucket_start.strftime("%Y-%m-%d %H:00")
+    else:
+        period = rollup.bucket_start.strftime("%Y-%m-%d")
+    if rollup.min_count == rollup.max_count:
+        return f"{period}: {rollup.last_count}"
+    return f"{period}: {rollup.min_count}–{rollup.max_count} (наприкінці {rollup.last_count})"
+
+@handler_timed()
+async def group_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await is_admin(update.effective_user.id):
+        await update.message.reply_text("У вас немає прав на виконання цієї команди.")
+        return
+
+    args = list(context.args or [])
+    resolution = "day"
+    if args and args[-1] in ("hours", "days"):
+        resolution = args.pop()[:-1]
+    if not args or resolution not in RESOLUTIONS:
+        await update.message.reply_text("Використання: /history <ID або назва групи> [hours|days]")
+        return
+    group_identifier = parse_group_identifier(' '.join(args))
+
+    async with AsyncSessionLocal() as session:
+        group = await GroupService(session, cache=get_cache_manager()).get_group_by_identifier(group_identifier)
+        if not group:
+            await update.message.reply_text("Групу не знайдено.")
+            return
+        history_service = HistoryService(session)
+        rollups = await history_service.get_history(group.group_id, resolution, limit=24 if resolution == "hour" else 30)
+        peak = await history_service.get_peak(group.group_id)
+
+    if not rollups:
+        await update.message.reply_text(f'Для групи "{group.group_name}" ще немає історії кількості учасників.')
+        return
+    lines = [f'Кількість учасників групи "{group.group_name}" (лише періоди зі змінами):']
+    lines += [format_history_line(rollup) for rollup in rollups]
+    if peak is not None:
+        lines.append(f"Пік: {peak.max_count} ({peak.bucket_start.strftime('%Y-%m-%d')})")
+    await update.message.reply_text("\n".join(lines)[:TELEGRAM_MESSAGE_LIMIT])
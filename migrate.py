@@ -0,0 +1,53 @@
+import logging
+import os
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import inspect, text
+from logging_config import setup_logging
+from db_config import get_engine, init_db
+
+logger = logging.getLogger(__name__)
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")
+
+
+def create_trigram_index(connection) -> bool:
+    """Те саме, що міграція 8435d664ead9: GIN-індекс для нечіткого пошуку, якщо pg_trgm доступне."""
+    available = connection.execute(
+        text("SELECT EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm')")
+    ).scalar()
+    if available:
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_groups_group_name_trgm ON groups USING gin (lower(group_name) gin_trgm_ops)"
+        ))
+    return bool(available)
+
+
+def migrate() -> None:
+    """Release-фаза: доводить схему до останньої ревізії Alembic.
+
+    Перші міграції ланцюжка змінюють таблиці, які колись створював create_all, тож на
+    порожній базі їх не виконати. Порожню базу створюємо за моделями одразу в стані head
+    і позначаємо цю ревізію; решту баз оновлює alembic upgrade head.
+    """
+    config = Config(ALEMBIC_INI)
+    engine = get_engine()
+    try:
+        tables = set(inspect(engine).get_table_names())
+        if not tables - {"alembic_version"}:
+            logger.info("Порожня база: створюємо схему за моделями і позначаємо ревізію head")
+            init_db()
+            with engine.begin() as connection:
+                if not create_trigram_index(connection):
+                    logger.warning("pg_trgm недоступне: нечіткий пошук груп працюватиме без індексу")
+            command.stamp(config, "head")
+        else:
+            command.upgrade(config, "head")
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    migrate()
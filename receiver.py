@@ -0,0 +1,47 @@
+import hmac
+import json
+import logging
+from typing import Optional
+import tornado.web
+from services.update_queue_service import UpdateQueue
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# Telegram не надсилає оновлень, більших за кілька сотень кілобайт
+MAX_UPDATE_SIZE = 1024 * 1024
+
+
+class TelegramWebhookHandler(tornado.web.RequestHandler):
+    """Приймає оновлення від Telegram, перевіряє його і кладе в чергу, не обробляючи."""
+
+    def initialize(self, queue: UpdateQueue, secret_token: Optional[str]) -> None:
+        self.queue = queue
+        self.secret_token = secret_token
+
+    async def post(self) -> None:
+        if self.secret_token and not hmac.compare_digest(
+            self.request.headers.get(SECRET_TOKEN_HEADER, ""), self.secret_token
+        ):
+            logger.warning("Відхилено запит до вебхука з неправильним secret token від %s", self.request.remote_ip)
+            raise tornado.web.HTTPError(403)
+        try:
+            payload = json.loads(self.request.body)
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+        if not isinstance(payload, dict) or not isinstance(payload.get("update_id"), int):
+            raise tornado.web.HTTPError(400)
+
+        if not await self.queue.enqueue(payload):
+            logger.debug("Повторна доставка оновлення %s", payload["update_id"])
+        self.set_status(200)
+
+
+def make_receiver_app(queue: UpdateQueue, url_path: str, secret_token: Optional[str]) -> tornado.web.Application:
+    return tornado.web.Application(
+        [(rf"/{url_path.strip('/')}/?", TelegramWebhookHandler, {"queue": queue, "secret_token": secret_token})],
+    )
+
+
+def listen(app: tornado.web.Application, port: int):
+    return app.listen(port, address="0.0.0.0", max_body_size=MAX_UPDATE_SIZE)
@@ -1,56 +1,157 @@
-from sqlalchemy.orm import Session
+import os
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
-from typing import Optional
+from typing import Optional, Set, Tuple
 from db_config import Admin, PotentialAdmin
+from services.cache_service import RedisCacheManager, admin_cache
+from services.metrics_service import service_timed
+
+# Скільки годин після /start користувача можна додати адміністратором за тегом
+POTENTIAL_ADMIN_TTL_HOURS = int(os.getenv("POTENTIAL_ADMIN_TTL_HOURS", 24))
+POTENTIAL_ADMIN_CLEANUP_BATCH = int(os.getenv("POTENTIAL_ADMIN_CLEANUP_BATCH", 1000))
+
+
+def potential_admin_expiry() -> datetime:
+    # requested_at зберігається без часової зони, тож asyncpg потребує naive datetime
+    return datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=POTENTIAL_ADMIN_TTL_HOURS)
+
+
 class AdminService:
-    def __init__(self, session: Session):
+    def __init__(self, session: AsyncSession, cache: Optional[RedisCacheManager] = None):
         self.session = session
-    def get_admin_by_id(self, user_id: int) -> Admin:
-        return self.session.query(Admin).filter_by(user_id=user_id).first()
+        self.cache = cache
+
+    async def _admins_changed(self) -> None:
+        admin_cache.invalidate()
+        if self.cache:
+            await self.cache.publish_admins_changed()
+
+    @service_timed()
+    async def get_admin_by_id(self, user_id: int) -> Admin:
+        result = await self.session.execute(select(Admin).filter_by(user_id=user_id))
+        return result.scalars().first()
     
-    def get_admin_by_username(self, username: int) -> Admin:
-        return self.session.query(Admin).filter_by(username=username).first()
+    @service_timed()
+    async def get_admin_ids(self) -> Tuple[Set[int], Set[int]]:
+        """Повертає ID усіх адміністраторів і окремо суперадміністраторів одним запитом."""
+        result = await self.session.execute(select(Admin.user_id, Admin.is_super_admin))
+        rows = result.all()
+        return {user_id for user_id, _ in rows}, {user_id for user_id, is_super in rows if is_super}
+
+    @service_timed()
+    async def get_admin_by_username(self, username: int) -> Admin:
+        result = await self.session.execute(select(Admin).filter_by(username=username))
+        return result.scalars().first()
     
-    def get_potential_admin_by_username(self, username: str) -> PotentialAdmin:
-        return self.session.query(PotentialAdmin).filter_by(username=username).first()
+    @service_timed()
+    async def get_potential_admin_by_username(self, username: str) -> PotentialAdmin:
+        # Прострочені записи можуть ще лежати до наступного прибирання, але вже не діють
+        result = await self.session.execute(
+            select(PotentialAdmin)
+            .filter_by(username=username)
+            .where(PotentialAdmin.requested_at >= potential_admin_expiry())
+            .order_by(PotentialAdmin.requested_at.desc())
+        )
+        return result.scalars().first()
+
+    @service_timed()
+    async def upsert_potential_admin(self, user_id: int, username: Optional[str]) -> None:
+        """Записує або оновлює запит /start одним INSERT ... ON CONFLICT DO UPDATE."""
+        stmt = insert(PotentialAdmin).values(
+            user_id=user_id, username=username, requested_at=datetime.now(timezone.utc).replace(tzinfo=None)
+        )
+        await self.session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[PotentialAdmin.user_id],
+                set_={"username": stmt.excluded.username, "requested_at": stmt.excluded.requested_at},
+            )
+        )
+        await self.session.commit()
+
+    @service_timed()
+    async def delete_expired_potential_admins(self, batch_size: int = POTENTIAL_ADMIN_CLEANUP_BATCH) -> int:
+        """Видаляє прострочені запити пачками, кожна у власній транзакції; повертає кількість видалених."""
+        expiry_time = potential_admin_expiry()
+        deleted = 0
+        while True:
+            expired = (
+                select(PotentialAdmin.id)
+                .where(PotentialAdmin.requested_at < expiry_time)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            result = await self.session.execute(
+                delete(PotentialAdmin).where(PotentialAdmin.id.in_(expired.scalar_subquery()))
+            )
+            await self.session.commit()
+            deleted += result.rowcount
+            if result.rowcount < batch_size:
+                return deleted
     
-    def add_admin(self, user_id: int, username: str = None) -> bool:
-        new_admin = Admin(user_id=user_id, username=username, is_super_admin=False)
+    @service_timed()
+    async def add_admin(self, user_id: int, username: str = None, is_super_admin: bool = False) -> bool:
+        new_admin = Admin(user_id=user_id, username=username, is_super_admin=is_super_admin)
         try:
             self.session.add(new_admin)
-            self.session.commit()
+            await self.session.commit()
+            await self._admins_changed()
             return True
         except IntegrityError:
-            self.session.rollback()
+            await self.session.rollback()
             return False
-    def remove_admin_by_id(self, user_id: int) -> str:
-        admin = self.get_admin_by_id(user_id=user_id)
+    @service_timed()
+    async def remove_admin_by_id(self, user_id: int) -> str:
+        admin = await self.get_admin_by_id(user_id=user_id)
         if not admin:
             return "Aдміністратора з таким ID не знайдено."
-        self.session.delete(admin)
-        self.session.commit()
+        await self.session.delete(admin)
+        await self.session.commit()
+        await self._admins_changed()
         return "Aдміністратора успішно видалено."
-    def get_super_admin_by_id(self, user_id: int) -> Admin:
-        return self.session.query(Admin).filter_by(user_id=user_id, is_super_admin=True).first()
+    @service_timed()
+    async def get_super_admin_by_id(self, user_id: int) -> Admin:
+        result = await self.session.execute(select(Admin).filter_by(user_id=user_id, is_super_admin=True))
+        return result.scalars().first()
         
-    def add_super_admin(self, user_id: int) -> str:
-        existing_admin = self.get_admin_by_id(user_id)
+    @service_timed()
+    async def add_super_admin(self, user_id: int) -> str:
+        existing_admin = await self.get_admin_by_id(user_id)
         if existing_admin:
             if existing_admin.is_super_admin:
                 return "Користувач вже є суперадміністратором."
             existing_admin.is_super_admin = True
-            self.session.commit()
+            await self.session.commit()
+            await self._admins_changed()
             return "Адміністратора було успішно призначено суперадміністратором."
     
-    def new_super_admin(self, user_id: int, username: Optional[str] = None) -> str:
-        new_super_admin = self.add_admin(user_id=user_id, username=username, is_super_admin=True)
-        self.session.add(new_super_admin)
-        self.session.commit()
+    @service_timed()
+    async def ensure_super_admin(self, user_id: int) -> bool:
+        """Додає суперадміністратора, якщо такого користувача ще немає; повертає True, якщо додано."""
+        result = await self.session.execute(
+            insert(Admin)
+            .values(user_id=user_id, is_super_admin=True)
+            .on_conflict_do_nothing(index_elements=[Admin.user_id])
+            .returning(Admin.id)
+        )
+        added = result.scalar() is not None
+        await self.session.commit()
+        if added:
+            await self._admins_changed()
+        return added
+
+    @service_timed()
+    async def new_super_admin(self, user_id: int, username: Optional[str] = None) -> str:
+        await self.add_admin(user_id=user_id, username=username, is_super_admin=True)
         return "Новий суперадміністратор доданий."
-    def remove_super_admin(self, user_id: int) -> str:
-        super_admin = self.session.query(Admin).filter_by(user_id=user_id, is_super_admin=True).first()
+    @service_timed()
+    async def remove_super_admin(self, user_id: int) -> str:
+        super_admin = await self.get_super_admin_by_id(user_id)
         if not super_admin:
             return "Суперадміністратора з таким ID не знайдено."
-        self.session.delete(super_admin)
-        self.session.commit()
-        return "Суперадміністратора успішно видалено."
\ No newline at end of file
+        await self.session.delete(super_admin)
+        await self.session.commit()
+        await self._admins_changed()
+        return "Суперадміністратора успішно видалено."
@@ -1,37 +1,526 @@
 import redis.asyncio as redis 
+import asyncio
 import json
-from typing import Optional, Set
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+from services.metrics_service import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+ADMIN_CACHE_TTL = float(os.getenv("ADMIN_CACHE_TTL", 300))
+REDIS_URL = os.getenv("REDIS_URL")
+GROUP_CACHE_TTL = int(os.getenv("GROUP_CACHE_TTL", 3600))
+GROUP_USERS_CACHE_TTL = int(os.getenv("GROUP_USERS_CACHE_TTL", 7 * 24 * 3600))
+GROUP_LRU_SIZE = int(os.getenv("GROUP_LRU_SIZE", 1024))
+GROUP_LRU_TTL = float(os.getenv("GROUP_LRU_TTL", 60))
+# Скільки секунд остання отримана кількість учасників вважається актуальною для звітів
+MEMBER_COUNT_CACHE_TTL = float(os.getenv("MEMBER_COUNT_CACHE_TTL", 600))
+MEMBER_COUNT_CACHE_SIZE = int(os.getenv("MEMBER_COUNT_CACHE_SIZE", 20000))
+# Канал Redis pub/sub, через який процеси скидають один одному group_lru і admin_cache
+CACHE_INVALIDATION_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL", "cache_invalidation")
+CACHE_INVALIDATION_RETRY_DELAY = float(os.getenv("CACHE_INVALIDATION_RETRY_DELAY", 5))
+
+
+def _group_key(group_id: int) -> str:
+    return f"group:{group_id}"
+
+
+def _group_users_key(group_id: int) -> str:
+    return f"group:{group_id}:users"
+
+
+def _fold_group_name(group_name: str) -> str:
+    """Назва групи без урахування регістру — так само, як lower(group_name) у пошуку в Postgres."""
+    return group_name.lower()
+
+
+def _group_name_key(group_name: str) -> str:
+    return f"group_name:{_fold_group_name(group_name)}"
+
+
+def _member_count_key(group_id: int) -> str:
+    return f"member_count:{group_id}"
+
+
+MEMBER_JOURNAL_PREFIX = "member_buffer:"
+
+
+def _member_journal_key(group_id: int) -> str:
+    return f"{MEMBER_JOURNAL_PREFIX}{group_id}"
+
 
 class RedisCacheManager:
-    def __init__(self, redis_url: str = "redis://localhost:6379"):
+    """Кеш груп і їхніх учасників у Redis перед Postgres.
+
+    Postgres лишається джерелом істини: множина group:{id}:users містить лише тих, хто
+    точно вже записаний у user_groups, тож промах кешу означає "перевір у базі", а не
+    "користувача немає". Будь-яка помилка Redis логується і трактується як промах.
+
+    Скидання груп і зміни адміністраторів публікуються в CACHE_INVALIDATION_CHANNEL, щоб
+    CacheInvalidationListener інших процесів скинув їхні кеші в пам'яті.
+    """
+
+    def __init__(self, redis_url: str = "redis://localhost:6379", client=None):
         self.redis_url = redis_url
-        self.redis = None
+        self.redis = client
+        # Власні повідомлення процес пропускає: свої кеші він уже скинув
+        self.origin = uuid.uuid4().hex
 
     async def connect(self):
-        self.redis = await redis.from_url(self.redis_url)
+        if self.redis is None:
+            self.redis = await redis.from_url(self.redis_url)
 
     async def close(self):
         if self.redis:
             await self.redis.close()
 
+    async def _client(self):
+        await self.connect()
+        return self.redis
+
     async def get_group(self, group_id: int) -> Optional[dict]:
-        group_data = await self.redis.get(f'group:{group_id}')
+        try:
+            group_data = await (await self._client()).get(_group_key(group_id))
+        except redis.RedisError as e:
+            logger.warning("Redis недоступний при читанні групи %s: %s", group_id, e)
+            return None
+        CACHE_REQUESTS.inc(cache="redis_group", result="hit" if group_data else "miss")
         if group_data:
             return json.loads(group_data)
         return None
-    
-    async def set_group(self, group_id: int, group_data: dict, ttl: int = 3600):
-        await self.redis.set(f'group{group_id}', json.dumps(group_data), ex=ttl)
-    
+
+    async def get_group_by_name(self, group_name: str) -> Optional[dict]:
+        try:
+            group_id = await (await self._client()).get(_group_name_key(group_name))
+        except redis.RedisError as e:
+            logger.warning("Redis недоступний при читанні групи '%s': %s", group_name, e)
+            return None
+        if group_id is None:
+            CACHE_REQUESTS.inc(cache="redis_group", result="miss")
+            return None
+        return await self.get_group(int(group_id))
+
+    def _publish(self, pipe, **message) -> None:
+        pipe.publish(CACHE_INVALIDATION_CHANNEL, json.dumps({"origin": self.origin, **message}))
+
+    async def set_group(self, group_id: int, group_data: dict, ttl: int = GROUP_CACHE_TTL, changed: bool = False):
+        """changed=True — дані групи змінились, і інші процеси мають скинути свої копії."""
+        try:
+            async with (await self._client()).pipeline(transaction=False) as pipe:
+                pipe.set(_group_key(group_id), json.dumps(group_data), ex=ttl)
+                pipe.set(_group_name_key(group_data["group_name"]), group_id, ex=ttl)
+                if changed:
+                    self._publish(pipe, groups=[group_id])
+                await pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("Redis недоступний при записі групи %s: %s", group_id, e)
+
     async def add_user_to_group(self, group_id: int, user_id: int):
-        key = f"group:{group_id}:users"
-        await self.redis.sadd(key, user_id)
-    
-    async def get_user_to_group(self, group_id: int, user_id: int):
-        key = f"group:{group_id}:users"
-        return await self.redis.sismember(key, user_id)
-
-    async def clear_group_cache(self, group_id: int):
-        await self.redis.delete(f'group:{group_id}', f'group_users{group_id}')
-    
-    
\ No newline at end of file
+        await self.add_users_to_group(group_id, [user_id])
+
+    async def add_users_to_group(self, group_id: int, user_ids: Iterable[int]):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        key = _group_users_key(group_id)
+        try:
+            async with (await self._client()).pipeline(transaction=False) as pipe:
+                pipe.sadd(key, *user_ids)
+                pipe.expire(key, GROUP_USERS_CACHE_TTL)
+                await pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("Redis недоступний при записі учасників групи %s: %s", group_id, e)
+
+    async def get_user_to_group(self, group_id: int, user_id: int) -> bool:
+        return (await self.get_known_users(group_id, [user_id]))[0]
+
+    async def get_known_users(self, group_id: int, user_ids: List[int]) -> List[bool]:
+        """Повертає для кожного user_id, чи відомо кешу, що він уже є учасником групи."""
+        if not user_ids:
+            return []
+        try:
+            flags = await (await self._client()).smismember(_group_users_key(group_id), user_ids)
+        except redis.RedisError as e:
+            logger.warning("Redis недоступний при перевірці учасників групи %s: %s", group_id, e)
+            return [False] * len(user_ids)
+        return [bool(flag) for flag in flags]
+
+    async def clear_group_cache(self, group_id: int, group_name: Optional[str] = None):
+        keys = [_group_key(group_id), _group_users_key(group_id)]
+        if group_name is not None:
+            keys.append(_group_name_key(group_name))
+        try:
+            async with (await self._client()).pipeline(transaction=False) as pipe:
+                pipe.delete(*keys)
+                self._publish(pipe, groups=[group_id])
+                await pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("Redis недоступний при очищенні кешу групи %s: %s", group_id, e)
+
+    async def invalidate_groups(self, group_ids: Iterable[int]):
+        """Скидає закешовані дані груп (але не множини учасників), наприклад після зміни лічильників."""
+        group_ids = list(group_ids)
+        if not group_ids:
+            return
+        try:
+            async with (await self._client()).pipeline(transaction=False) as pipe:
+                pipe.delete(*(_group_key(group_id) for group_id in group_ids))
+                self._publish(pipe, groups=group_ids)
+                await pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("Redis недоступний при скиданні кешу груп: %s", e)
+
+    async def publish_admins_changed(self):
+        try:
+            async with (await self._client()).pipeline(transaction=False) as pipe:
+                self._publish(pipe, admins=True)
+                await pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("Redis недоступний при публікації зміни адміністраторів: %s", e)
+
+    async def get_member_counts(self, group_ids: List[int]) -> Dict[int, Tuple[int, float]]:
+        """Повертає {group_id: (кількість, unix-час отримання)} для груп, що є в Redis."""
+        if not group_ids:
+            return {}
+        try:
+            values = await (await self._client()).mget([_member_count_key(group_id) for group_id in group_ids])
+        except redis.RedisError as e:
+            logger.warning("Redis недоступний при читанні кількості учасників: %s", e)
+            return {}
+        counts = {}
+        for group_id, value in zip(group_ids, values):
+            if value is not None:
+                count, fetched_at = json.loads(value)
+                counts[group_id] = (count, fetched_at)
+        return counts
+
+    async def set_member_counts(self, counts: Dict[int, int], fetched_at: float, ttl: float = MEMBER_COUNT_CACHE_TTL):
+        if not counts:
+            return
+        try:
+            async with (await self._client()).pipeline(transaction=False) as pipe:
+                for group_id, count in counts.items():
+                    pipe.set(_member_count_key(group_id), json.dumps([count, fetched_at]), ex=max(1, int(ttl)))
+                await pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("Redis недоступний при записі кількості учасників: %s", e)
+
+    async def journal_members(self, group_id: int, user_ids: Iterable[int]) -> bool:
+        """Записує ще не збережені в Postgres приєднання, щоб пережити падіння процесу."""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return True
+        try:
+            await (await self._client()).sadd(_member_journal_key(group_id), *user_ids)
+            return True
+        except redis.RedisError as e:
+            logger.warning("Redis недоступний при записі журналу групи %s: %s", group_id, e)
+            return False
+
+    async def discard_journal(self, members: dict) -> None:
+        """Прибирає з журналу приєднання, які вже збережено в Postgres."""
+        try:
+            async with (await self._client()).pipeline(transaction=False) as pipe:
+                for group_id, user_ids in members.items():
+                    if user_ids:
+                        pipe.srem(_member_journal_key(group_id), *user_ids)
+                await pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("Redis недоступний при очищенні журналу: %s", e)
+
+    async def load_journal(self) -> dict:
+        """Повертає незбережені приєднання з журналу як {group_id: {user_id, ...}}."""
+        members = {}
+        try:
+            client = await self._client()
+            async for key in client.scan_iter(match=f"{MEMBER_JOURNAL_PREFIX}*"):
+                key = key.decode() if isinstance(key, bytes) else key
+                group_id = int(key[len(MEMBER_JOURNAL_PREFIX):])
+                members[group_id] = {int(user_id) for user_id in await client.smembers(key)}
+        except redis.RedisError as e:
+            logger.warning("Redis недоступний при читанні журналу: %s", e)
+        return members
+
+
+class LocalGroupCache:
+    """Обмежений LRU-кеш груп у пам'яті процесу перед Redis.
+
+    Відома група читається без жодного мережевого запиту. Зміни з цього процесу скидають
+    запис явно через invalidate(), зміни з інших — CacheInvalidationListener. Записи
+    живуть не довше ttl секунд, тож без Redis зміни інших процесів видно з цією затримкою.
+    """
+
+    def __init__(self, maxsize: int = GROUP_LRU_SIZE, ttl: float = GROUP_LRU_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._groups: "OrderedDict[int, Tuple[float, dict]]" = OrderedDict()
+        self._names: dict = {}
+
+    def get(self, group_id: int) -> Optional[dict]:
+        entry = self._groups.get(group_id)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self.invalidate(group_id)
+            self._record(hit=False)
+            return None
+        self._groups.move_to_end(group_id)
+        self._record(hit=True)
+        return entry[1]
+
+    def _record(self, hit: bool) -> None:
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        CACHE_REQUESTS.inc(cache="group_lru", result="hit" if hit else "miss")
+
+    def get_by_name(self, group_name: str) -> Optional[dict]:
+        group_id = self._names.get(_fold_group_name(group_name))
+        if group_id is None:
+            self._record(hit=False)
+            return None
+        return self.get(group_id)
+
+    def set(self, group_id: int, group_data: dict) -> None:
+        self.invalidate(group_id)
+        self._groups[group_id] = (time.monotonic() + self.ttl, group_data)
+        self._names[_fold_group_name(group_data["group_name"])] = group_id
+        while len(self._groups) > self.maxsize:
+            evicted_id, (_, evicted_data) = self._groups.popitem(last=False)
+            self._forget_name(evicted_id, evicted_data)
+
+    def invalidate(self, group_id: int) -> None:
+        entry = self._groups.pop(group_id, None)
+        if entry is not None:
+            self._forget_name(group_id, entry[1])
+
+    def _forget_name(self, group_id: int, group_data: dict) -> None:
+        name = _fold_group_name(group_data["group_name"])
+        if self._names.get(name) == group_id:
+            del self._names[name]
+
+    def clear(self) -> None:
+        self._groups.clear()
+        self._names.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._groups)}
+
+
+group_lru = LocalGroupCache()
+
+
+class MemberCountCache:
+    """Остання отримана з Telegram кількість учасників груп і час її отримання.
+
+    Записує планувальник після кожного запиту get_chat_member_count; звіти адмінам
+    показують звідси поточну кількість без власних запитів до Telegram. Дані живуть
+    у пам'яті процесу і, якщо передано Redis, там же для інших процесів. Записи,
+    старші за ttl секунд, не повертаються.
+    """
+
+    def __init__(self, ttl: float = MEMBER_COUNT_CACHE_TTL, maxsize: int = MEMBER_COUNT_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._counts: "OrderedDict[int, Tuple[int, float]]" = OrderedDict()
+
+    def _fresh(self, entry: Tuple[int, float], max_age: float) -> bool:
+        return time.time() - entry[1] <= max_age
+
+    async def get_many(
+        self, group_ids: Iterable[int], cache: Optional[RedisCacheManager] = None, max_age: Optional[float] = None
+    ) -> Dict[int, Tuple[int, float]]:
+        """Повертає {group_id: (кількість, unix-час отримання)} для груп зі свіжими даними."""
+        group_ids = list(group_ids)
+        max_age = self.ttl if max_age is None else min(max_age, self.ttl)
+        found, missing = {}, []
+        for group_id in group_ids:
+            entry = self._counts.get(group_id)
+            if entry is not None and self._fresh(entry, max_age):
+                found[group_id] = entry
+            else:
+                missing.append(group_id)
+        if missing and cache is not None:
+            remote = await cache.get_member_counts(missing)
+            for group_id, entry in remote.items():
+                # Значення з Redis могло прийти від іншого процесу і бути новішим за локальне
+                self._store(group_id, entry)
+                if self._fresh(entry, max_age):
+                    found[group_id] = entry
+        CACHE_REQUESTS.inc(len(found), cache="member_count", result="hit")
+        CACHE_REQUESTS.inc(len(group_ids) - len(found), cache="member_count", result="miss")
+        return found
+
+    def _store(self, group_id: int, entry: Tuple[int, float]) -> None:
+        current = self._counts.get(group_id)
+        if current is not None and current[1] >= entry[1]:
+            return
+        self._counts.pop(group_id, None)
+        self._counts[group_id] = entry
+        while len(self._counts) > self.maxsize:
+            self._counts.popitem(last=False)
+
+    async def set_many(
+        self, counts: Dict[int, int], cache: Optional[RedisCacheManager] = None, fetched_at: Optional[float] = None
+    ) -> None:
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        for group_id, count in counts.items():
+            self._store(group_id, (count, fetched_at))
+        if cache is not None:
+            await cache.set_member_counts(counts, fetched_at, self.ttl)
+
+    def clear(self) -> None:
+        self._counts.clear()
+
+
+member_count_cache = MemberCountCache()
+
+_cache_manager: Optional[RedisCacheManager] = None
+
+
+def get_cache_manager() -> Optional[RedisCacheManager]:
+    """Повертає спільний RedisCacheManager або None, якщо REDIS_URL не налаштовано."""
+    global _cache_manager
+    if _cache_manager is None and REDIS_URL:
+        _cache_manager = RedisCacheManager(REDIS_URL)
+    return _cache_manager
+
+
+async def close_cache_manager() -> None:
+    if _cache_manager is not None:
+        await _cache_manager.close()
+
+
+AdminIds = Tuple[FrozenSet[int], FrozenSet[int]]
+
+
+class AdminCache:
+    """In-process кеш ID адміністраторів і суперадміністраторів з обмеженим TTL.
+
+    Усі ID завантажуються одним запитом, тож перевірка прав — це пошук у множині.
+    Зміни в цьому процесі скидають кеш явно через invalidate(), зміни з інших —
+    CacheInvalidationListener, а без Redis вони стають видимими не пізніше ніж через ttl секунд.
+    """
+
+    def __init__(self, ttl: float = ADMIN_CACHE_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._admin_ids: FrozenSet[int] = frozenset()
+        self._super_admin_ids: FrozenSet[int] = frozenset()
+        self._expires_at = 0.0
+        self._version = 0
+        self._lock = asyncio.Lock()
+
+    def _is_fresh(self) -> bool:
+        return time.monotonic() < self._expires_at
+
+    def _record(self, hit: bool) -> None:
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        CACHE_REQUESTS.inc(cache="admin", result="hit" if hit else "miss")
+
+    async def get(self, loader: Callable[[], Awaitable[AdminIds]]) -> AdminIds:
+        if self._is_fresh():
+            self._record(hit=True)
+            return self._admin_ids, self._super_admin_ids
+
+        async with self._lock:
+            # Поки чекали на лок, кеш міг перезавантажити інший обробник
+            if self._is_fresh():
+                self._record(hit=True)
+                return self._admin_ids, self._super_admin_ids
+
+            self._record(hit=False)
+            version = self._version
+            admin_ids, super_admin_ids = await loader()
+            self._admin_ids = frozenset(admin_ids)
+            self._super_admin_ids = frozenset(super_admin_ids)
+            # Якщо під час завантаження кеш скинули, дані могли застаріти — не позначаємо їх свіжими
+            if version == self._version:
+                self._expires_at = time.monotonic() + self.ttl
+            return self._admin_ids, self._super_admin_ids
+
+    def invalidate(self) -> None:
+        self._version += 1
+        self._expires_at = 0.0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._admin_ids)}
+
+
+admin_cache = AdminCache()
+
+
+class CacheInvalidationListener:
+    """Скидає group_lru і admin_cache цього процесу за повідомленнями інших процесів.
+
+    Без нього зміни з інших процесів ставали б видимими лише після TTL кешів. Повідомлення
+    pub/sub не зберігаються, тож після (пере)підписки кеші очищаються повністю: поки
+    з'єднання не було, скидання могли загубитися.
+    """
+
+    def __init__(
+        self,
+        cache: RedisCacheManager,
+        local_cache: LocalGroupCache = group_lru,
+        admins: AdminCache = admin_cache,
+        retry_delay: float = CACHE_INVALIDATION_RETRY_DELAY,
+    ):
+        self.cache = cache
+        self.local_cache = local_cache
+        self.admins = admins
+        self.retry_delay = retry_delay
+        self.subscribed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def apply(self, message: dict) -> None:
+        if message.get("origin") == self.cache.origin:
+            return
+        for group_id in message.get("groups", ()):
+            self.local_cache.invalidate(group_id)
+        if message.get("admins"):
+            self.admins.invalidate()
+
+    async def _listen(self) -> None:
+        pubsub = (await self.cache._client()).pubsub()
+        try:
+            await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+            self.local_cache.clear()
+            self.admins.invalidate()
+            self.subscribed.set()
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    self.apply(json.loads(message["data"]))
+        finally:
+            self.subscribed.clear()
+            await pubsub.aclose()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._listen()
+            except (redis.RedisError, OSError) as e:
+                logger.warning("Підписку на скидання кешів втрачено, повтор через %s с: %s", self.retry_delay, e)
+            await asyncio.sleep(self.retry_delay)
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
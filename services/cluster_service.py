@@ -0,0 +1,92 @@
+import logging
+import os
+import socket
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+from db_config import AsyncSessionLocal, BotInstance
+from services.metrics_service import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+INSTANCE_HEARTBEAT_INTERVAL = float(os.getenv("INSTANCE_HEARTBEAT_INTERVAL", 10))
+# Процес без heartbeat довше за цей час вважається мертвим, а його частка груп переходить іншим
+INSTANCE_TTL = float(os.getenv("INSTANCE_TTL", 30))
+
+# Процеси, що забирають оновлення з update_queue; решта (вебхук, режим direct) — "bot"
+BOT_ROLE = "bot"
+WORKER_ROLE = "worker"
+
+LIVE_INSTANCES = REGISTRY.gauge("cluster_live_instances", "Кількість живих процесів бота за heartbeat")
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def default_instance_id() -> str:
+    return f"{os.getenv('DYNO', socket.gethostname())}:{os.getpid()}"
+
+
+class InstanceRegistry:
+    """Членство процесів бота через таблицю bot_instances з heartbeat.
+
+    Живі процеси впорядковуються за instance_id, і кожен отримує шард (index, count).
+    Коли процес з'являється чи зникає (graceful leave() або пропущений heartbeat довше
+    за ttl), шарди решти перераховуються на наступному проході. shard(role=...) ділить
+    лише між процесами цієї ролі: чати черги — між воркерами, без приймача вебхука.
+    """
+
+    def __init__(
+        self,
+        instance_id: Optional[str] = None,
+        session_factory=AsyncSessionLocal,
+        ttl: float = INSTANCE_TTL,
+        role: str = BOT_ROLE,
+    ):
+        self.instance_id = instance_id or default_instance_id()
+        self.role = role
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.started_at = _utcnow()
+
+    async def heartbeat(self) -> None:
+        now = _utcnow()
+        async with self.session_factory() as session:
+            stmt = insert(BotInstance).values(
+                instance_id=self.instance_id, role=self.role, started_at=self.started_at, heartbeat_at=now,
+            )
+            await session.execute(
+                stmt.on_conflict_do_update(index_elements=[BotInstance.instance_id], set_={"heartbeat_at": now})
+            )
+            # Прибираємо процеси, що давно не подавали heartbeat, щоб таблиця не росла
+            await session.execute(
+                delete(BotInstance).where(BotInstance.heartbeat_at < now - timedelta(seconds=self.ttl * 10))
+            )
+            await session.commit()
+
+    async def live_instances(self, role: Optional[str] = None) -> List[str]:
+        threshold = _utcnow() - timedelta(seconds=self.ttl)
+        stmt = select(BotInstance.instance_id).where(BotInstance.heartbeat_at >= threshold)
+        if role is not None:
+            stmt = stmt.where(BotInstance.role == role)
+        async with self.session_factory() as session:
+            result = await session.execute(stmt.order_by(BotInstance.instance_id))
+            instances = list(result.scalars().all())
+        if role is None:
+            LIVE_INSTANCES.set(len(instances))
+        return instances
+
+    async def shard(self, role: Optional[str] = None) -> Optional[Tuple[int, int]]:
+        """Повертає (index, count) цього процесу серед живих (лише ролі role, якщо задано) або None,
+        якщо його heartbeat ще не видно."""
+        instances = await self.live_instances(role)
+        if self.instance_id not in instances:
+            return None
+        return instances.index(self.instance_id), len(instances)
+
+    async def leave(self) -> None:
+        async with self.session_factory() as session:
+            await session.execute(delete(BotInstance).filter_by(instance_id=self.instance_id))
+            await session.commit()
@@ -0,0 +1,69 @@
+import json
+import logging
+from typing import Dict, Iterable, Optional, Tuple
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from db_config import AsyncSessionLocal, ConversationState
+
+logger = logging.getLogger(__name__)
+
+StateKey = Tuple[str, str]
+
+
+def encode_conversation_key(key: tuple) -> str:
+    return json.dumps(list(key))
+
+
+def decode_conversation_key(key: str) -> tuple:
+    return tuple(json.loads(key))
+
+
+class ConversationStateStore:
+    """Стани розмов у таблиці conversation_states: (назва обробника, ключ розмови) -> стан."""
+
+    def __init__(self, session_factory=AsyncSessionLocal):
+        self.session_factory = session_factory
+
+    async def load(self, keys: Iterable[StateKey]) -> Dict[StateKey, object]:
+        keys = list(keys)
+        if not keys:
+            return {}
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(ConversationState.handler_name, ConversationState.conversation_key, ConversationState.state)
+                .where(tuple_(ConversationState.handler_name, ConversationState.conversation_key).in_(keys))
+            )
+            return {(name, key): state for name, key, state in result}
+
+    async def load_handler(self, handler_name: str) -> Dict[tuple, object]:
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(ConversationState.conversation_key, ConversationState.state).filter_by(handler_name=handler_name)
+            )
+            return {decode_conversation_key(key): state for key, state in result if state is not None}
+
+    async def save(self, changes: Dict[StateKey, Optional[object]]) -> None:
+        """Записує змінені стани; None означає, що розмову завершено, і рядок видаляється."""
+        ended = [key for key, state in changes.items() if state is None]
+        active = [
+            {"handler_name": name, "conversation_key": key, "state": state}
+            for (name, key), state in changes.items()
+            if state is not None
+        ]
+        if not ended and not active:
+            return
+        async with self.session_factory() as session:
+            if ended:
+                await session.execute(
+                    delete(ConversationState)
+                    .where(tuple_(ConversationState.handler_name, ConversationState.conversation_key).in_(ended))
+                )
+            if active:
+                stmt = insert(ConversationState).values(active)
+                await session.execute(
+                    stmt.on_conflict_do_update(
+                        index_elements=[ConversationState.handler_name, ConversationState.conversation_key],
+                        set_={"state": stmt.excluded.state, "updated_at": stmt.excluded.updated_at},
+                    )
+                )
+            await session.commit()
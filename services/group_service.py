@@ -1,45 +1,121 @@
 import logging
-from db_config import Group, SessionLocal, UserGroup
-from sqlalchemy.orm import Session
+import os
+from collections import defaultdict
+from db_config import Group, GroupPollState, MemberCountDelta, UserGroup
+from datetime import datetime
+from sqlalchemy import BigInteger, Integer, and_, column, delete, func, or_, select, text, update, values
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.exc import IntegrityError
-from typing import Optional, Union
+from sqlalchemy.dialects.postgresql import insert
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple, Union
+from services.cache_service import LocalGroupCache, RedisCacheManager, group_lru
+from services.hll_service import HyperLogLog, PendingSketches, pending_sketches
+from logging_config import SAMPLED
+from services.metrics_service import service_timed
 
-logging.basicConfig(
-    level=logging.DEBUG,  # Можна змінити на DEBUG для більш детального логування
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
+# inline — unique_members_count оновлюється в тій самій транзакції, що й вставка учасників;
+# reconcile — вставка не чіпає рядок groups, лічильник рахує reconcile_unique_member_counts()
+UNIQUE_COUNT_MODE = os.getenv("UNIQUE_COUNT_MODE", "inline")
+
+# asyncpg обмежує кількість параметрів запиту (32767), а кожен рядок займає два
+INSERT_CHUNK_SIZE = 5000
+
+GROUP_CACHE_FIELDS = (
+    "id", "group_id", "group_name", "unique_members_count", "is_active", "max_member_count", "count_mode",
+)
+
+
+def parse_group_identifier(value: Union[str, int]) -> Union[str, int]:
+    """Перетворює числовий рядок (зокрема з мінусом, як у chat_id) на int, решту лишає назвою."""
+    if isinstance(value, int):
+        return value
+    value = value.strip()
+    digits = value[1:] if value.startswith("-") else value
+    if digits.isdigit():
+        return int(value)
+    return value
+
+
+def group_name_key():
+    """Вираз індексу ix_groups_group_name_lower; запити мають повторювати його дослівно, з тим самим COLLATE."""
+    return func.lower(Group.group_name).collate("C")
+
+
+def group_to_cache(group: Group) -> dict:
+    return {field: getattr(group, field) for field in GROUP_CACHE_FIELDS}
+
+
+def group_from_cache(data: dict) -> Group:
+    """Відновлює групу з кешу як від'єднаний об'єкт лише для читання."""
+    return Group(**{field: data.get(field) for field in GROUP_CACHE_FIELDS})
+
+
 class GroupService:
-    def __init__(self, session: Session):
+    def __init__(
+        self,
+        session: AsyncSession,
+        cache: Optional[RedisCacheManager] = None,
+        local_cache: Optional[LocalGroupCache] = group_lru,
+    ):
         self.session = session
+        self.cache = cache
+        self.local_cache = local_cache
+
+    # Наявність pg_trgm перевіряється один раз на процес
+    _has_trgm: Optional[bool] = None
+
+    async def _cache_group(self, group: Group, changed: bool = False) -> None:
+        """Записує знімок групи в обидва рівні кешу; changed — скинути застарілі копії в інших процесах."""
+        group_data = group_to_cache(group)
+        if self.local_cache is not None:
+            self.local_cache.set(group.group_id, group_data)
+        if self.cache:
+            await self.cache.set_group(group.group_id, group_data, changed=changed)
+
+    async def _forget_groups(self, group_ids: Iterable[int]) -> None:
+        group_ids = list(group_ids)
+        if self.local_cache is not None:
+            for group_id in group_ids:
+                self.local_cache.invalidate(group_id)
+        if self.cache:
+            await self.cache.invalidate_groups(group_ids)
 
     def add_user(self, user_id: int, group_id: int) -> UserGroup:
         """Додає користувача до бази."""
-        logger.debug(f"Виклик add_user з параметрами: user_id={user_id}, group_id={group_id}")
+        logger.debug("Виклик add_user з параметрами: user_id=%s, group_id=%s", user_id, group_id)
         user = UserGroup(user_id=user_id, group_id=group_id)
         self.session.add(user)
-        logger.debug(f"Користувача {user_id} додано до сесії для групи {group_id}")
+        logger.debug("Користувача %s додано до сесії для групи %s", user_id, group_id)
         return user
 
-    def get_user(self, user_id: int, group_id: int) -> UserGroup:
+    @service_timed()
+    async def get_user(self, user_id: int, group_id: int) -> UserGroup:
         """Отримує користувача за ID."""
-        logger.debug(f"Виклик get_user з параметрами: user_id={user_id}, group_id={group_id}")
-        user = self.session.query(UserGroup).filter_by(user_id=user_id, group_id=group_id).first()
+        logger.debug("Виклик get_user з параметрами: user_id=%s, group_id=%s", user_id, group_id)
+        if self.cache and await self.cache.get_user_to_group(group_id, user_id):
+            return UserGroup(user_id=user_id, group_id=group_id)
+        result = await self.session.execute(select(UserGroup).filter_by(user_id=user_id, group_id=group_id))
+        user = result.scalars().first()
         if user:
-            logger.debug(f"Користувача знайдено: user_id={user_id}, group_id={group_id}")
+            logger.debug("Користувача знайдено: user_id=%s, group_id=%s", user_id, group_id)
+            if self.cache:
+                await self.cache.add_user_to_group(group_id, user_id)
         else:
-            logger.debug(f"Користувача не знайдено: user_id={user_id}, group_id={group_id}")
+            logger.debug("Користувача не знайдено: user_id=%s, group_id=%s", user_id, group_id)
         return user
 
-    def add_unique_member(self, group: Group, user_id: int) -> bool:
+    @service_timed()
+    async def add_unique_member(self, group: Group, user_id: int) -> bool:
         """Додає унікального учасника до групи."""
-        logger.debug(f"Виклик add_unique_member для групи {group.group_id} з user_id={user_id}")
+        logger.debug("Виклик add_unique_member для групи %s з user_id=%s", group.group_id, user_id)
 
         # Перевірка існуючого користувача
-        existing_user = self.get_user(user_id=user_id, group_id=group.group_id)
+        existing_user = await self.get_user(user_id=user_id, group_id=group.group_id)
         if existing_user:
-            logger.info(f"Користувач {user_id} вже існує в групі {group.group_id}")
+            logger.info("Користувач %s вже існує в групі %s", user_id, group.group_id, extra=SAMPLED)
             return False
 
         try:
@@ -47,58 +123,487 @@ class GroupService:
             self.add_user(user_id=user_id, group_id=group.group_id)
 
             # Атомарне оновлення лічильника
-            self.session.query(Group).filter_by(group_id=group.group_id).update({"unique_members_count": Group.unique_members_count + 1})
+            await self.session.execute(
+                update(Group)
+                .filter_by(group_id=group.group_id)
+                .values(unique_members_count=Group.unique_members_count + 1)
+            )
 
             logger.debug(
-                f"Перед комітом: unique_members_count оновлено для групи {group.group_id}, user_id={user_id}"
+                "Перед комітом: unique_members_count оновлено для групи %s, user_id=%s", group.group_id, user_id
             )
-            self.session.commit()  # Збереження транзакції
-            logger.info(f"Користувача {user_id} успішно додано до групи {group.group_id}")
+            await self.session.commit()  # Збереження транзакції
+            logger.info("Користувача %s успішно додано до групи %s", user_id, group.group_id, extra=SAMPLED)
+            if self.cache:
+                await self.cache.add_user_to_group(group.group_id, user_id)
+            await self._forget_groups([group.group_id])
             return True
         except IntegrityError:
-            self.session.rollback()
-            logger.error(f"Помилка при додаванні користувача {user_id} до групи {group.group_id}", exc_info=True)
+            await self.session.rollback()
+            logger.error("Помилка при додаванні користувача %s до групи %s", user_id, group.group_id, exc_info=True)
             return False
 
-    @staticmethod
-    def get_group_by_identifier(session, group_identifier: Union[str, int]) -> Optional[Group]:
+    async def _insert_members(
+        self, members: Dict[int, Iterable[int]], hll_group_ids: Optional[Set[int]] = None
+    ) -> Tuple[Dict[int, int], Dict[int, int]]:
+        """Вставляє пари (група, користувач) і повертає кількість нових учасників і нові лічильники груп.
+
+        Групи в режимі hll не отримують рядків у user_groups: їхні учасники додаються до
+        скетчу в пам'яті (pending_sketches), а лічильник оновлює merge_pending_sketches().
+        Якщо hll_group_ids не передано, режими груп зчитуються з бази.
+        """
+        pending = {group_id: list(dict.fromkeys(user_ids)) for group_id, user_ids in members.items()}
+        pending = {group_id: user_ids for group_id, user_ids in pending.items() if user_ids}
+        if not pending:
+            return {}, {}
+        if hll_group_ids is None:
+            hll_group_ids = set((await self.session.execute(
+                select(Group.group_id).where(Group.group_id.in_(list(pending)), Group.count_mode == "hll")
+            )).scalars())
+        for group_id in hll_group_ids & pending.keys():
+            pending_sketches.add(group_id, pending.pop(group_id))
+
+        if self.cache:
+            # Тих, кого кеш уже знає як учасників, у базу не відправляємо
+            for group_id, user_ids in pending.items():
+                known = await self.cache.get_known_users(group_id, user_ids)
+                pending[group_id] = [user_id for user_id, is_known in zip(user_ids, known) if not is_known]
+        rows = [
+            {"user_id": user_id, "group_id": group_id}
+            for group_id, user_ids in pending.items()
+            for user_id in user_ids
+        ]
+        if not rows:
+            return {}, {}
+
+        # INSERT ... ON CONFLICT DO NOTHING замість SELECT + INSERT на кожного користувача.
+        # RETURNING повертає лише реально вставлені рядки, тож лічильники лишаються точними.
+        inserted: Dict[int, int] = defaultdict(int)
+        unique_members_counts: Dict[int, int] = {}
+        try:
+            for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+                stmt = (
+                    insert(UserGroup)
+                    .values(rows[start:start + INSERT_CHUNK_SIZE])
+                    .on_conflict_do_nothing(index_elements=[UserGroup.group_id, UserGroup.user_id])
+                    .returning(UserGroup.group_id)
+                )
+                for group_id in (await self.session.execute(stmt)).scalars():
+                    inserted[group_id] += 1
+            if inserted and UNIQUE_COUNT_MODE == "inline":
+                increments = values(
+                    column("group_id", BigInteger), column("added", Integer), name="increments"
+                ).data(list(inserted.items()))
+                result = await self.session.execute(
+                    update(Group)
+                    .where(Group.group_id == increments.c.group_id)
+                    .values(unique_members_count=Group.unique_members_count + increments.c.added)
+                    .returning(Group.group_id, Group.unique_members_count)
+                    .execution_options(synchronize_session=False)
+                )
+                unique_members_counts = dict(result.all())
+            elif inserted:
+                # Режим reconcile: приріст дописується окремими рядками і не блокує рядки groups
+                await self.session.execute(
+                    insert(MemberCountDelta),
+                    [{"group_id": group_id, "added": added} for group_id, added in inserted.items()],
+                )
+            await self.session.commit()
+        except IntegrityError:
+            await self.session.rollback()
+            logger.error("Помилка при пакетному додаванні учасників до груп %s", list(pending), exc_info=True)
+            raise
+
+        if self.cache:
+            # Після коміту всі ці користувачі точно є в user_groups — і нові, і ті, що були раніше
+            for group_id, user_ids in pending.items():
+                await self.cache.add_users_to_group(group_id, user_ids)
+
+        logger.debug("До %d груп додано %d нових учасників із %d", len(pending), sum(inserted.values()), len(rows))
+        return dict(inserted), unique_members_counts
+
+    @service_timed()
+    async def merge_pending_sketches(self, pending: PendingSketches = pending_sketches) -> Dict[int, int]:
+        """Зливає накопичені в пам'яті скетчі з groups.hll_sketch і повертає нові лічильники груп.
+
+        Рядок кожної групи блокується і перезаписується один раз на злиття, а не на кожне приєднання.
+        """
+        batch = pending.take()
+        if not batch:
+            return {}
+        counts = {}
+        try:
+            # Порядок за group_id, щоб процеси, які зливають одночасно, не блокували один одного навхрест
+            result = await self.session.execute(
+                select(Group.group_id, Group.hll_sketch)
+                .where(Group.group_id.in_(list(batch)), Group.count_mode == "hll")
+                .order_by(Group.group_id)
+                .with_for_update()
+            )
+            for group_id, sketch_data in result.all():
+                sketch = HyperLogLog.from_bytes(sketch_data)
+                sketch.merge(batch[group_id])
+                merged = sketch.to_bytes()
+                if merged == sketch_data:
+                    continue
+                counts[group_id] = sketch.count()
+                await self.session.execute(
+                    update(Group)
+                    .filter_by(group_id=group_id)
+                    .values(hll_sketch=merged, unique_members_count=counts[group_id])
+                    .execution_options(synchronize_session=False)
+                )
+            await self.session.commit()
+        except Exception:
+            await self.session.rollback()
+            pending.restore(batch)
+            raise
+        await self._forget_groups(counts)
+        return counts
+
+    @service_timed()
+    async def add_unique_members(self, group: Group, user_ids: Iterable[int]) -> int:
+        """Додає пачку унікальних учасників одним запитом і повертає кількість нових."""
+        if group.count_mode is None:
+            # Знімок із кешу старого формату: режим дізнаємося з бази
+            hll_group_ids = None
+        else:
+            hll_group_ids = {group.group_id} if group.count_mode == "hll" else set()
+        inserted, unique_members_counts = await self._insert_members({group.group_id: user_ids}, hll_group_ids)
+        if group.group_id in unique_members_counts:
+            # Значення вже в базі; set_committed_value не робить об'єкт "брудним" для наступного flush
+            set_committed_value(group, "unique_members_count", unique_members_counts[group.group_id])
+            await self._cache_group(group, changed=True)
+        return inserted.get(group.group_id, 0)
+
+    @service_timed()
+    async def add_unique_members_bulk(self, members: Dict[int, Iterable[int]]) -> Dict[int, int]:
+        """Додає учасників одразу до багатьох груп в одній транзакції; повертає кількість нових по групах."""
+        inserted, unique_members_counts = await self._insert_members(members)
+        await self._forget_groups(unique_members_counts)
+        return inserted
+
+    @service_timed()
+    async def set_count_mode(self, group_identifier: Union[str, int], mode: str, purge_rows: bool = False) -> str:
+        """Перемикає групу між точним підрахунком (exact) і HyperLogLog (hll).
+
+        При переході на hll скетч будується з наявних рядків user_groups, які можна
+        одразу видалити (purge_rows). Повернення до exact неможливе: окремих ID учасників
+        у режимі hll не зберігається.
+        """
+        if mode not in ("exact", "hll"):
+            return "Невідомий режим підрахунку. Доступні режими: exact, hll."
+        group = await self.get_group_by_identifier(group_identifier, use_cache=False)
+        if not group:
+            return "Такої групи не було знайдено."
+        if group.count_mode == mode:
+            return f"Група {group.group_name} вже використовує режим {mode}."
+        if mode == "exact":
+            return "Повернення з режиму hll до exact неможливе: окремі учасники не зберігались."
+
+        sketch = HyperLogLog()
+        user_ids = await self.session.stream_scalars(
+            select(UserGroup.user_id).filter_by(group_id=group.group_id).execution_options(yield_per=5000)
+        )
+        async for user_id in user_ids:
+            sketch.add(user_id)
+        await self.session.execute(
+            update(Group)
+            .filter_by(group_id=group.group_id)
+            .values(count_mode="hll", hll_sketch=sketch.to_bytes(), unique_members_count=sketch.count())
+            .execution_options(synchronize_session=False)
+        )
+        if purge_rows:
+            await self.session.execute(delete(UserGroup).filter_by(group_id=group.group_id))
+        await self.session.commit()
+
+        if self.local_cache is not None:
+            self.local_cache.invalidate(group.group_id)
+        if self.cache:
+            await self.cache.clear_group_cache(group.group_id, group.group_name)
+        return (f"Група {group.group_name} тепер рахується через HyperLogLog "
+                f"(стандартна похибка ±{sketch.relative_error:.2%}, "
+                f"у ~95% випадків — не більше ±{2 * sketch.relative_error:.2%}).")
+
+    @service_timed()
+    async def reconcile_unique_member_counts(self, full: bool = False) -> Dict[int, int]:
+        """Дораховує unique_members_count з member_count_deltas і повертає приріст по групах.
+
+        Інкрементальний прохід видаляє накопичені рядки приросту і додає їхні суми до
+        лічильників у тій самій транзакції, тож кожен приріст враховується рівно один раз,
+        незалежно від порядку комітів вставок. full=True перераховує лічильники з user_groups
+        повністю (наприклад, після зміни режиму з inline).
+        """
+        if full:
+            # Видалення приростів і підрахунок в одному запиті бачать один знімок бази:
+            # вставка, закомічена пізніше, лишить свій приріст для наступного проходу
+            cleared = delete(MemberCountDelta).returning(MemberCountDelta.id).cte("cleared")
+            totals = dict((await self.session.execute(
+                select(UserGroup.group_id, func.count()).group_by(UserGroup.group_id).add_cte(cleared)
+            )).all())
+            # Групи в режимі hll рахуються скетчем, старі рядки user_groups для них не показові
+            before = dict((await self.session.execute(
+                select(Group.group_id, Group.unique_members_count).filter_by(count_mode="exact")
+            )).all())
+            changes = {
+                group_id: totals.get(group_id, 0) - (count or 0)
+                for group_id, count in before.items()
+                if totals.get(group_id, 0) != (count or 0)
+            }
+            if changes:
+                exact = values(
+                    column("group_id", BigInteger), column("total", Integer), name="totals"
+                ).data([(group_id, totals.get(group_id, 0)) for group_id in changes])
+                await self.session.execute(
+                    update(Group)
+                    .where(Group.group_id == exact.c.group_id)
+                    .values(unique_members_count=exact.c.total)
+                    .execution_options(synchronize_session=False)
+                )
+        else:
+            deltas = (await self.session.execute(
+                delete(MemberCountDelta).returning(MemberCountDelta.group_id, MemberCountDelta.added)
+            )).all()
+            if not deltas:
+                # commit, а не rollback: rollback скинув би завантажені в сесію об'єкти
+                await self.session.commit()
+                return {}
+            changes: Dict[int, int] = defaultdict(int)
+            for group_id, added in deltas:
+                changes[group_id] += added
+            changes = dict(changes)
+            increments = values(
+                column("group_id", BigInteger), column("added", Integer), name="increments"
+            ).data(list(changes.items()))
+            await self.session.execute(
+                update(Group)
+                .where(Group.group_id == increments.c.group_id, Group.count_mode == "exact")
+                .values(unique_members_count=func.coalesce(Group.unique_members_count, 0) + increments.c.added)
+                .execution_options(synchronize_session=False)
+            )
+
+        await self.session.commit()
+        await self._forget_groups(changes)
+        logger.info("Звірка лічильників: змінено %d груп", len(changes))
+        return changes
+
+    @service_timed()
+    async def get_group_by_identifier(self, group_identifier: Union[str, int], use_cache: bool = True) -> Optional[Group]:
+        """Шукає групу за ID або назвою; з кешу повертається від'єднаний об'єкт лише для читання.
+
+        Порядок: LRU у пам'яті процесу, потім Redis, потім Postgres.
+        """
+        if use_cache and self.local_cache is not None:
+            if isinstance(group_identifier, int):
+                cached = self.local_cache.get(group_identifier)
+            else:
+                cached = self.local_cache.get_by_name(group_identifier)
+            if cached:
+                return group_from_cache(cached)
+
+        if use_cache and self.cache:
+            if isinstance(group_identifier, int):
+                cached = await self.cache.get_group(group_identifier)
+            else:
+                cached = await self.cache.get_group_by_name(group_identifier)
+            if cached:
+                if self.local_cache is not None:
+                    self.local_cache.set(cached["group_id"], cached)
+                return group_from_cache(cached)
+
         if isinstance(group_identifier, int):
-            return session.query(Group).filter_by(group_id=group_identifier).first()
-        else: 
-            return session.query(Group).filter_by(group_name=group_identifier).first()
-
-    @staticmethod
-    def get_active_groups() -> list:
-        with SessionLocal() as session:
-            active_groups = session.query(Group).filter_by(is_active=True).all()
-            return active_groups
-        
-    def create_group(self, group_id: int, group_name: str) -> Group:
+            stmt = select(Group).filter_by(group_id=group_identifier)
+        else:
+            # Без урахування регістру через індекс ix_groups_group_name_lower; точний збіг регістру має пріоритет
+            stmt = (
+                select(Group)
+                .where(group_name_key() == group_identifier.lower())
+                .order_by((Group.group_name == group_identifier).desc(), Group.id)
+            )
+        # populate_existing оновлює об'єкт з identity map, якщо рядок змінювали UPDATE-ами в обхід ORM
+        result = await self.session.execute(stmt.execution_options(populate_existing=True))
+        group = result.scalars().first()
+        if group:
+            await self._cache_group(group)
+        return group
+
+    async def _trigram_available(self) -> bool:
+        if GroupService._has_trgm is None:
+            result = await self.session.execute(
+                text("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+            )
+            GroupService._has_trgm = bool(result.scalar())
+        return GroupService._has_trgm
+
+    @service_timed()
+    async def find_groups(self, query: Union[str, int], limit: int = 10) -> List[Group]:
+        """Шукає групи за ID або частиною назви; результати впорядковані за релевантністю.
+
+        Спершу точний збіг без урахування регістру, далі збіг за префіксом, далі
+        нечіткий (триграмний) збіг, якщо в базі встановлено pg_trgm, інакше збіг за підрядком.
+        """
+        query = parse_group_identifier(query)
+        if isinstance(query, int):
+            group = await self.get_group_by_identifier(query)
+            return [group] if group else []
+
+        needle = query.lower()
+        if not needle:
+            return []
+        lowered = group_name_key()
+        prefix_match = lowered.startswith(needle, autoescape=True)
+
+        # Префікс обслуговує btree-індекс ix_groups_group_name_lower; у побайтовому порядку точний збіг
+        # коротший за решту збігів за префіксом, тож іде першим без окремого ранжування
+        result = await self.session.execute(select(Group).where(prefix_match).order_by(lowered).limit(limit))
+        groups = list(result.scalars().all())
+        if len(groups) >= limit:
+            return groups
+
+        # Нечіткий пошук дорожчий, тож лише добираємо решту місць
+        if await self._trigram_available():
+            # Вираз GIN-індексу ix_groups_group_name_trgm — lower(group_name) без COLLATE
+            trigram_key = func.lower(Group.group_name)
+            fuzzy = (
+                select(Group)
+                .where(trigram_key.op("%")(needle), ~prefix_match)
+                .order_by(func.similarity(trigram_key, needle).desc(), lowered)
+            )
+        else:
+            # Без pg_trgm підрядок шукається послідовним скануванням
+            fuzzy = select(Group).where(lowered.contains(needle, autoescape=True), ~prefix_match).order_by(lowered)
+        result = await self.session.execute(fuzzy.limit(limit - len(groups)))
+        return groups + list(result.scalars().all())
+
+    @service_timed()
+    async def get_active_groups(self) -> list:
+        result = await self.session.execute(select(Group).filter_by(is_active=True))
+        return list(result.scalars().all())
+
+    async def stream_active_group_stats(self, batch_size: int = 500) -> AsyncIterator:
+        """Віддає рядки (group_id, group_name, max_member_count, unique_members_count, count_mode) через серверний курсор."""
+        result = await self.session.stream(
+            select(Group.group_id, Group.group_name, Group.max_member_count, Group.unique_members_count, Group.count_mode)
+            .filter_by(is_active=True)
+            .order_by(Group.group_name)
+            .execution_options(yield_per=batch_size)
+        )
+        async for row in result:
+            yield row
+
+    @service_timed()
+    async def get_active_group_counts(self) -> List:
+        """Повертає (group_id, group_name, max_member_count) активних груп без завантаження ORM-об'єктів."""
+        result = await self.session.execute(
+            select(Group.group_id, Group.group_name, Group.max_member_count).filter_by(is_active=True)
+        )
+        return list(result.all())
+
+    @service_timed()
+    async def get_due_groups(
+        self, now: datetime, extra_group_ids: Iterable[int] = (), shard: Optional[Tuple[int, int]] = None
+    ) -> List:
+        """Повертає активні групи, яким настав час опитування, разом зі станом опитування.
+
+        Групи без збереженого стану (нові) вважаються простроченими, extra_group_ids
+        опитуються позачергово (наприклад, у них щойно були нові учасники). shard=(index, count)
+        лишає з прострочених лише групи, для яких abs(group_id) % count == index.
+        """
+        due = or_(GroupPollState.group_id.is_(None), GroupPollState.next_poll_at <= now)
+        if shard is not None and shard[1] > 1:
+            index, count = shard
+            due = and_(due, func.abs(Group.group_id) % count == index)
+        conditions = [due]
+        extra_group_ids = list(extra_group_ids)
+        if extra_group_ids:
+            # Активні групи опитує процес, що бачив нових учасників, незалежно від шарду
+            conditions.append(Group.group_id.in_(extra_group_ids))
+        result = await self.session.execute(
+            select(
+                Group.group_id,
+                Group.group_name,
+                Group.max_member_count,
+                GroupPollState.last_count,
+                GroupPollState.interval_seconds,
+            )
+            .outerjoin(GroupPollState, GroupPollState.group_id == Group.group_id)
+            .where(Group.is_active.is_(True), or_(*conditions))
+        )
+        return list(result.all())
+
+    @service_timed()
+    async def upsert_poll_states(self, states: List[dict]) -> None:
+        """Зберігає стан опитування груп одним INSERT ... ON CONFLICT DO UPDATE."""
+        if not states:
+            return
+        stmt = insert(GroupPollState).values(states)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[GroupPollState.group_id],
+            set_={
+                "last_count": stmt.excluded.last_count,
+                "interval_seconds": stmt.excluded.interval_seconds,
+                "next_poll_at": stmt.excluded.next_poll_at,
+                "last_polled_at": stmt.excluded.last_polled_at,
+            },
+        )
+        await self.session.execute(stmt)
+        await self.session.commit()
+
+    @service_timed()
+    async def bulk_update_max_member_counts(self, member_counts: Dict[int, int]) -> int:
+        """Оновлює max_member_count для багатьох груп одним UPDATE ... FROM (VALUES ...)."""
+        if not member_counts:
+            return 0
+        counts = values(
+            column("group_id", BigInteger), column("member_count", Integer), name="counts"
+        ).data(list(member_counts.items()))
+        # GREATEST лишає більше значення, тож паралельні записи не можуть зменшити максимум
+        stmt = (
+            update(Group)
+            .where(Group.group_id == counts.c.group_id)
+            .where(func.coalesce(Group.max_member_count, 0) < counts.c.member_count)
+            .values(max_member_count=func.greatest(func.coalesce(Group.max_member_count, 0), counts.c.member_count))
+            .execution_options(synchronize_session=False)
+        )
+        result = await self.session.execute(stmt)
+        await self.session.commit()
+        await self._forget_groups(member_counts)
+        return result.rowcount
+
+    @service_timed()
+    async def create_group(self, group_id: int, group_name: str) -> Group:
         group = Group(group_id=group_id, group_name=group_name, unique_members_count=0)
         self.session.add(group)
-        self.session.commit()
+        await self.session.commit()
+        await self._cache_group(group)
         return group
 
-    def get_or_create_group(self, group_id: int, group_name: str) -> Group:
-        group = self.get_group_by_identifier(self.session, group_id)
+    @service_timed()
+    async def get_or_create_group(self, group_id: int, group_name: str) -> Group:
+        group = await self.get_group_by_identifier(group_id)
         if not group:
-            group = self.create_group(group_id, group_name)
             try:
-                self.session.commit()
+                group = await self.create_group(group_id, group_name)
             except IntegrityError:
-                self.session.rollback()
-                group = self.get_group_by_identifier(self.session, group_id)
+                # Групу паралельно створив інший обробник
+                await self.session.rollback()
+                group = await self.get_group_by_identifier(group_id)
         return group
-    
-    def delete_group(self, group_identifier: Union[str, int]) -> str:
-        group = self.get_group_by_identifier(self.session, group_identifier)
+
+    @service_timed()
+    async def delete_group(self, group_identifier: Union[str, int]) -> str:
+        # Видаляти можна лише об'єкт із сесії, тож читаємо з бази в обхід кешу
+        group = await self.get_group_by_identifier(group_identifier, use_cache=False)
         if not group:
             return "Такої групи не було знайдено."
         try:
-            self.session.delete(group)
-            self.session.commit()
+            await self.session.delete(group)
+            await self.session.commit()
+            if self.local_cache is not None:
+                self.local_cache.invalidate(group.group_id)
+            if self.cache:
+                await self.cache.clear_group_cache(group.group_id, group.group_name)
             return f"Групу {group.group_name} було видаленно."
         except IntegrityError:
-            self.session.rollback()
+            await self.session.rollback()
             return "Сталася помилка при видаленні групи"
-
@@ -0,0 +1,175 @@
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+from sqlalchemy import delete, exists, func, literal, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from db_config import MemberCountRollup, MemberCountSample
+from services.metrics_service import service_timed
+
+logger = logging.getLogger(__name__)
+
+# Як часто лідер перераховує агрегати і скільки останніх годин перераховує щоразу:
+# запас покриває зразки, які поллер записав уже після попереднього запуску
+HISTORY_ROLLUP_INTERVAL = int(os.getenv("HISTORY_ROLLUP_INTERVAL", 900))
+HISTORY_ROLLUP_LOOKBACK_HOURS = int(os.getenv("HISTORY_ROLLUP_LOOKBACK_HOURS", 3))
+# Скільки днів зберігаються сирі зразки і погодинні агрегати; 0 — без обмеження
+HISTORY_SAMPLE_RETENTION_DAYS = int(os.getenv("HISTORY_SAMPLE_RETENTION_DAYS", 7))
+HISTORY_HOURLY_RETENTION_DAYS = int(os.getenv("HISTORY_HOURLY_RETENTION_DAYS", 90))
+HISTORY_DAILY_RETENTION_DAYS = int(os.getenv("HISTORY_DAILY_RETENTION_DAYS", 0))
+
+RESOLUTIONS = ("hour", "day")
+
+
+class HistoryService:
+    """Історія кількості учасників груп.
+
+    Поллер дописує в member_count_samples лише зміни кількості, тож між двома зразками
+    значення не змінювалось. rollup() складає з них погодинні, а з погодинних — денні
+    агрегати min/max/last у member_count_rollups; агрегати є лише для періодів зі змінами.
+    Запити історії читають тільки агрегати.
+    """
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def add_samples(self, rows: Iterable[dict]) -> None:
+        """Додає зразки {group_id, sampled_at, count} без коміту, в транзакції викликача."""
+        rows = list(rows)
+        if rows:
+            await self.session.execute(insert(MemberCountSample).values(rows).on_conflict_do_nothing())
+
+    @service_timed()
+    async def rollup(self, now: datetime) -> None:
+        """Перераховує агрегати, починаючи з останньої погодинної години або HISTORY_ROLLUP_LOOKBACK_HOURS тому."""
+        lookback = now - timedelta(hours=HISTORY_ROLLUP_LOOKBACK_HOURS)
+        latest = (await self.session.execute(
+            select(func.max(MemberCountRollup.bucket_start)).where(MemberCountRollup.resolution == "hour")
+        )).scalar()
+        if latest is None:
+            # Перший запуск: агрегуємо всі наявні зразки
+            latest = (await self.session.execute(select(func.min(MemberCountSample.sampled_at)))).scalar()
+            if latest is None:
+                return
+        since = min(latest, lookback).replace(minute=0, second=0, microsecond=0)
+
+        await self._rollup_hours(since)
+        await self._rollup_days(since.replace(hour=0))
+        await self.session.commit()
+
+    async def _rollup_hours(self, since: datetime) -> None:
+        sample = aliased(MemberCountSample)
+        # Значення до першого зразка години діяло на її початку, тож теж входить у min/max
+        previous = (
+            select(sample.count)
+            .where(sample.group_id == MemberCountSample.group_id, sample.sampled_at < MemberCountSample.sampled_at)
+            .order_by(sample.sampled_at.desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+        samples = (
+            select(
+                MemberCountSample.group_id,
+                MemberCountSample.sampled_at,
+                MemberCountSample.count,
+                func.coalesce(previous, MemberCountSample.count).label("previous"),
+            )
+            .where(MemberCountSample.sampled_at >= since)
+            .subquery()
+        )
+        bucket = func.date_trunc("hour", samples.c.sampled_at)
+        await self._upsert(
+            select(
+                samples.c.group_id,
+                literal("hour"),
+                bucket,
+                func.min(func.least(samples.c.count, samples.c.previous)),
+                func.max(func.greatest(samples.c.count, samples.c.previous)),
+                func.array_agg(aggregate_order_by(samples.c.count, samples.c.sampled_at.desc()))[1],
+            ).group_by(samples.c.group_id, bucket)
+        )
+
+    async def _rollup_days(self, since: datetime) -> None:
+        hours = (
+            select(MemberCountRollup)
+            .where(MemberCountRollup.resolution == "hour", MemberCountRollup.bucket_start >= since)
+            .subquery()
+        )
+        bucket = func.date_trunc("day", hours.c.bucket_start)
+        await self._upsert(
+            select(
+                hours.c.group_id,
+                literal("day"),
+                bucket,
+                func.min(hours.c.min_count),
+                func.max(hours.c.max_count),
+                func.array_agg(aggregate_order_by(hours.c.last_count, hours.c.bucket_start.desc()))[1],
+            ).group_by(hours.c.group_id, bucket)
+        )
+
+    async def _upsert(self, rows) -> None:
+        stmt = insert(MemberCountRollup).from_select(
+            ["group_id", "resolution", "bucket_start", "min_count", "max_count", "last_count"], rows
+        )
+        await self.session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[MemberCountRollup.group_id, MemberCountRollup.resolution, MemberCountRollup.bucket_start],
+                set_={
+                    "min_count": stmt.excluded.min_count,
+                    "max_count": stmt.excluded.max_count,
+                    "last_count": stmt.excluded.last_count,
+                },
+            )
+        )
+
+    @service_timed()
+    async def apply_retention(self, now: datetime) -> None:
+        """Видаляє зразки й агрегати, старші за строки зберігання."""
+        if HISTORY_SAMPLE_RETENTION_DAYS:
+            cutoff = now - timedelta(days=HISTORY_SAMPLE_RETENTION_DAYS)
+            newer = aliased(MemberCountSample)
+            # Останній зразок перед межею лишається: це значення, що діяло на її момент
+            result = await self.session.execute(
+                delete(MemberCountSample).where(
+                    MemberCountSample.sampled_at < cutoff,
+                    exists().where(
+                        newer.group_id == MemberCountSample.group_id,
+                        newer.sampled_at > MemberCountSample.sampled_at,
+                        newer.sampled_at < cutoff,
+                    ),
+                )
+            )
+            logger.info("Видалено %d старих зразків кількості учасників", result.rowcount)
+        for resolution, days in (("hour", HISTORY_HOURLY_RETENTION_DAYS), ("day", HISTORY_DAILY_RETENTION_DAYS)):
+            if days:
+                await self.session.execute(
+                    delete(MemberCountRollup).where(
+                        MemberCountRollup.resolution == resolution,
+                        MemberCountRollup.bucket_start < now - timedelta(days=days),
+                    )
+                )
+        await self.session.commit()
+
+    @service_timed()
+    async def get_history(self, group_id: int, resolution: str = "day", limit: int = 30) -> List[MemberCountRollup]:
+        """Останні limit агрегатів групи в хронологічному порядку."""
+        result = await self.session.execute(
+            select(MemberCountRollup)
+            .where(MemberCountRollup.group_id == group_id, MemberCountRollup.resolution == resolution)
+            .order_by(MemberCountRollup.bucket_start.desc())
+            .limit(limit)
+        )
+        return list(reversed(result.scalars().all()))
+
+    @service_timed()
+    async def get_peak(self, group_id: int) -> Optional[MemberCountRollup]:
+        """День, коли кількість учасників групи була найбільшою (перший з таких)."""
+        result = await self.session.execute(
+            select(MemberCountRollup)
+            .where(MemberCountRollup.group_id == group_id, MemberCountRollup.resolution == "day")
+            .order_by(MemberCountRollup.max_count.desc(), MemberCountRollup.bucket_start)
+            .limit(1)
+        )
+        return result.scalar()
@@ -0,0 +1,149 @@
+import hashlib
+import math
+import os
+from typing import Dict, Iterable, Optional
+
+HLL_PRECISION = 14
+# Як часто нові регістри скетчів зливаються з groups.hll_sketch
+HLL_FLUSH_INTERVAL = int(os.getenv("HLL_FLUSH_INTERVAL", 10))
+
+
+class HyperLogLog:
+    """HyperLogLog-скетч для наближеного підрахунку унікальних ID.
+
+    З точністю p використовується m = 2**p однобайтових регістрів (16 КБ при p=14),
+    незалежно від кількості учасників. Стандартна відносна похибка оцінки —
+    1.04 / sqrt(m), тобто близько 0.81% при p=14; приблизно у 95% випадків оцінка
+    відхиляється від точного значення не більше ніж на 1.6%. Оцінка рахується за
+    гістограмою регістрів (покращений оцінювач Ertl, 2017) і не має зсуву в усьому
+    діапазоні, зокрема при переході від linear counting до сирої оцінки HLL
+    (≈2.5 * m–5 * m, тобто 40–80 тис. учасників при p=14), де класична формула
+    завищує результат на кілька відсотків. Невеликі групи рахуються майже точно.
+    """
+
+    def __init__(self, precision: int = HLL_PRECISION, registers: Optional[bytes] = None):
+        if not 4 <= precision <= 16:
+            raise ValueError("Точність HyperLogLog має бути від 4 до 16")
+        self.precision = precision
+        self.m = 1 << precision
+        if registers is not None and len(registers) != self.m:
+            raise ValueError("Розмір регістрів не відповідає точності")
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(self.m)
+
+    @staticmethod
+    def _hash(value: int) -> int:
+        digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+    def add(self, value: int) -> bool:
+        """Додає значення; повертає True, якщо скетч змінився."""
+        hashed = self._hash(value)
+        index = hashed >> (64 - self.precision)
+        remaining_bits = 64 - self.precision
+        rest = hashed & ((1 << remaining_bits) - 1)
+        rank = remaining_bits - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def update(self, values: Iterable[int]) -> None:
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: "HyperLogLog") -> None:
+        if other.precision != self.precision:
+            raise ValueError("Не можна об'єднати скетчі різної точності")
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    @staticmethod
+    def _sigma(x: float) -> float:
+        if x == 1.0:
+            return math.inf
+        y, z = 1.0, x
+        while True:
+            x *= x
+            previous = z
+            z += x * y
+            y += y
+            if z == previous:
+                return z
+
+    @staticmethod
+    def _tau(x: float) -> float:
+        if x == 0.0 or x == 1.0:
+            return 0.0
+        y, z = 1.0, 1.0 - x
+        while True:
+            x = math.sqrt(x)
+            previous = z
+            y *= 0.5
+            z -= (1.0 - x) ** 2 * y
+            if z == previous:
+                return z / 3
+
+    def count(self) -> int:
+        m = self.m
+        q = 64 - self.precision
+        histogram = [0] * (q + 2)
+        for register in self.registers:
+            histogram[register] += 1
+        if histogram[0] == m:
+            return 0
+        z = m * self._tau(1.0 - histogram[q + 1] / m)
+        for k in range(q, 0, -1):
+            z = 0.5 * (z + histogram[k])
+        z += m * self._sigma(histogram[0] / m)
+        return int(round(m * m / (2 * math.log(2)) / z))
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data: Optional[bytes], precision: int = HLL_PRECISION) -> "HyperLogLog":
+        if not data:
+            return cls(precision)
+        return cls(precision, data)
+
+
+class PendingSketches:
+    """Регістри HyperLogLog-скетчів груп, ще не злиті з groups.hll_sketch.
+
+    Приєднання до груп у режимі hll лише оновлюють скетч у пам'яті процесу, не блокуючи
+    рядок групи; GroupService.merge_pending_sketches() раз на HLL_FLUSH_INTERVAL секунд
+    зливає їх у базу одним записом на групу. При падінні процесу втрачаються приєднання
+    за останній інтервал — для наближеного підрахунку це прийнятно.
+    """
+
+    def __init__(self, precision: int = HLL_PRECISION):
+        self.precision = precision
+        self._sketches: Dict[int, HyperLogLog] = {}
+
+    def __len__(self) -> int:
+        return len(self._sketches)
+
+    def add(self, group_id: int, user_ids: Iterable[int]) -> None:
+        sketch = self._sketches.get(group_id)
+        if sketch is None:
+            sketch = self._sketches[group_id] = HyperLogLog(self.precision)
+        sketch.update(user_ids)
+
+    def take(self) -> Dict[int, HyperLogLog]:
+        """Забирає всі накопичені скетчі; після невдалого запису їх повертає restore()."""
+        sketches, self._sketches = self._sketches, {}
+        return sketches
+
+    def restore(self, sketches: Dict[int, HyperLogLog]) -> None:
+        for group_id, sketch in sketches.items():
+            current = self._sketches.get(group_id)
+            if current is None:
+                self._sketches[group_id] = sketch
+            else:
+                current.merge(sketch)
+
+
+pending_sketches = PendingSketches()
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import os
+import zlib
+from typing import Callable, Optional
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
+from sqlalchemy.pool import NullPool
+from db_config import ASYNC_DATABASE_URL
+from services.metrics_service import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Як часто послідовник пробує стати лідером, а лідер перевіряє своє з'єднання
+LEADER_CHECK_INTERVAL = float(os.getenv("LEADER_CHECK_INTERVAL", 5))
+
+IS_LEADER = REGISTRY.gauge("leader", "1, якщо цей процес є лідером для задачі")
+LEADER_TRANSITIONS = REGISTRY.counter("leader_transitions_total", "Скільки разів процес ставав лідером або втрачав лідерство")
+
+
+def advisory_lock_id(name: str) -> int:
+    return zlib.crc32(f"leader:{name}".encode())
+
+
+class LeaderElector:
+    """Вибір лідера через сесійний advisory lock Postgres.
+
+    Кожен процес тримає одне окреме з'єднання і раз на interval секунд пробує взяти
+    pg_try_advisory_lock. Лок живе, поки живе сесія: якщо лідер зупинився чи впав,
+    Postgres знімає лок, щойно закриється з'єднання, а TCP keepalive на боці сервера
+    обмежує це кількома секундами і для обірваної мережі. Лідер тією ж періодичністю
+    перевіряє своє з'єднання і складає повноваження, якщо воно зникло.
+
+    on_elected/on_demoted викликаються при зміні ролі, наприклад для resume()/pause()
+    планувальника.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        interval: float = LEADER_CHECK_INTERVAL,
+        on_elected: Optional[Callable[[], None]] = None,
+        on_demoted: Optional[Callable[[], None]] = None,
+        database_url=ASYNC_DATABASE_URL,
+    ):
+        self.name = name
+        self.lock_id = advisory_lock_id(name)
+        self.interval = interval
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.database_url = database_url
+        self.is_leader = False
+        self._engine: Optional[AsyncEngine] = None
+        self._connection: Optional[AsyncConnection] = None
+        self._stopping = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def _create_engine(self) -> AsyncEngine:
+        # Окреме з'єднання поза пулом: не займає місце в DB_POOL_SIZE і живе весь час роботи процесу
+        keepalive = str(max(1, int(self.interval)))
+        return create_async_engine(
+            self.database_url,
+            poolclass=NullPool,
+            isolation_level="AUTOCOMMIT",
+            connect_args={"server_settings": {
+                "application_name": f"leader:{self.name}",
+                "tcp_keepalives_idle": keepalive,
+                "tcp_keepalives_interval": keepalive,
+                "tcp_keepalives_count": "2",
+            }},
+        )
+
+    def _set_leader(self, is_leader: bool) -> None:
+        if is_leader == self.is_leader:
+            return
+        self.is_leader = is_leader
+        IS_LEADER.set(int(is_leader), name=self.name)
+        LEADER_TRANSITIONS.inc(name=self.name, role="leader" if is_leader else "follower")
+        logger.info("Процес %s лідером для %s", "став" if is_leader else "більше не є", self.name)
+        callback = self.on_elected if is_leader else self.on_demoted
+        if callback is not None:
+            callback()
+
+    async def _close_connection(self) -> None:
+        if self._connection is not None:
+            try:
+                await self._connection.close()
+            except Exception:
+                logger.debug("Не вдалося закрити з'єднання лідера", exc_info=True)
+            self._connection = None
+
+    async def check(self) -> bool:
+        """Один крок виборів: підтвердити лідерство або спробувати його взяти."""
+        try:
+            if self._connection is None:
+                if self._engine is None:
+                    self._engine = self._create_engine()
+                self._connection = await self._engine.connect()
+            if self.is_leader:
+                await asyncio.wait_for(self._connection.execute(text("SELECT 1")), timeout=self.interval)
+            else:
+                acquired = await asyncio.wait_for(
+                    self._connection.execute(select(func.pg_try_advisory_lock(self.lock_id))), timeout=self.interval
+                )
+                self._set_leader(bool(acquired.scalar()))
+        except Exception as e:
+            # З втраченою сесією зник і лок, тож лідерство складаємо одразу
+            logger.warning("Втрачено з'єднання виборів лідера %s: %s", self.name, e)
+            await self._close_connection()
+            self._set_leader(False)
+        return self.is_leader
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            await self.check()
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Зупиняє вибори і відпускає лок, щоб інший процес став лідером без очікування."""
+        self._stopping.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        self._set_leader(False)
+        await self._close_connection()
+        if self._engine is not None:
+            await self._engine.dispose()
+            self._engine = None
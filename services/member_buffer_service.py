@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Iterable, Optional, Set
+from db_config import AsyncSessionLocal
+from services.cache_service import RedisCacheManager, get_cache_manager
+from services.group_service import GroupService
+from services.metrics_service import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# sync — кожне оновлення з новими учасниками одразу комітиться (за замовчуванням);
+# write_behind — приєднання буферизуються в пам'яті і записуються пачками
+MEMBER_WRITE_MODE = os.getenv("MEMBER_WRITE_MODE", "sync")
+MEMBER_BUFFER_MAX_SIZE = int(os.getenv("MEMBER_BUFFER_MAX_SIZE", 1000))
+MEMBER_BUFFER_MAX_DELAY = float(os.getenv("MEMBER_BUFFER_MAX_DELAY", 5))
+# lose — при падінні процесу втрачаються приєднання за останні MEMBER_BUFFER_MAX_DELAY секунд;
+# journal — кожне приєднання додатково записується в Redis і відновлюється при старті
+MEMBER_BUFFER_CRASH_POLICY = os.getenv("MEMBER_BUFFER_CRASH_POLICY", "lose")
+
+FLUSH_SECONDS = REGISTRY.histogram(
+    "member_buffer_flush_seconds", "Тривалість запису буфера приєднань у user_groups"
+)
+PENDING_MEMBERS = REGISTRY.gauge(
+    "member_buffer_pending", "Кількість приєднань, що ще не записані в Postgres"
+)
+JOURNAL_FAILURES = REGISTRY.counter(
+    "member_buffer_journal_failures_total", "Приєднання, не записані в журнал Redis і тому записані в Postgres одразу"
+)
+
+
+class MemberWriteBuffer:
+    """Write-behind буфер приєднань до груп.
+
+    add() лише додає користувачів у множину групи в пам'яті (дублікати відкидаються
+    одразу) і повертає керування. Буфер записується однією транзакцією, коли в ньому
+    набирається max_size приєднань або минає max_delay секунд, а також при stop().
+    unique_members_count оновлюється в тій самій транзакції, тож після кожного запису
+    він точний.
+
+    Поведінка при падінні процесу залежить від crash_policy:
+      * "lose" — втрачаються приєднання, що не встигли записатися (не більше ніж за
+        max_delay секунд або max_size штук);
+      * "journal" — приєднання також записуються в Redis (member_buffer:{group_id}),
+        прибираються звідти після коміту і дописуються в базу через recover() при
+        наступному старті. Повторний запис безпечний завдяки ON CONFLICT DO NOTHING.
+        Якщо Redis недоступний, add() записує буфер у Postgres одразу.
+    """
+
+    def __init__(
+        self,
+        max_size: int = MEMBER_BUFFER_MAX_SIZE,
+        max_delay: float = MEMBER_BUFFER_MAX_DELAY,
+        crash_policy: str = MEMBER_BUFFER_CRASH_POLICY,
+        cache: Optional[RedisCacheManager] = None,
+        session_factory=AsyncSessionLocal,
+    ):
+        if crash_policy not in ("lose", "journal"):
+            raise ValueError(f"Невідома політика MEMBER_BUFFER_CRASH_POLICY: {crash_policy}")
+        if crash_policy == "journal" and cache is None:
+            raise ValueError("Політика journal потребує Redis (REDIS_URL)")
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.crash_policy = crash_policy
+        self.cache = cache
+        self.session_factory = session_factory
+        self._pending: Dict[int, Set[int]] = {}
+        self._pending_count = 0
+        self._flush_lock = asyncio.Lock()
+        self._flush_requested = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending_count(self) -> int:
+        return self._pending_count
+
+    async def add(self, group_id: int, user_ids: Iterable[int]) -> int:
+        """Буферизує приєднання і повертає, скільки з них ще не було в буфері."""
+        members = self._pending.setdefault(group_id, set())
+        new_ids = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in members]
+        if not new_ids:
+            return 0
+        journaled = self.crash_policy != "journal" or await self.cache.journal_members(group_id, new_ids)
+        members.update(new_ids)
+        self._pending_count += len(new_ids)
+        PENDING_MEMBERS.set(self._pending_count)
+        if not journaled:
+            # Без журналу приєднання пережило б падіння лише в Postgres
+            JOURNAL_FAILURES.inc(len(new_ids))
+            try:
+                await self.flush()
+            except Exception:
+                # Помилку вже залоговано у flush(), пачка лишилась у буфері
+                pass
+        elif self._pending_count >= self.max_size:
+            self._flush_requested.set()
+        return len(new_ids)
+
+    async def flush(self) -> int:
+        """Записує вміст буфера в Postgres і повертає кількість нових учасників."""
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            self._pending_count = 0
+            PENDING_MEMBERS.set(0)
+
+            started = time.perf_counter()
+            try:
+                async with self.session_factory() as session:
+                    inserted = await GroupService(session, cache=self.cache).add_unique_members_bulk(batch)
+            except Exception:
+                # Повертаємо пачку в буфер, щоб повторити на наступному циклі
+                self._restore(batch)
+                logger.exception("Не вдалося записати буфер приєднань (%d груп)", len(batch))
+                raise
+            finally:
+                FLUSH_SECONDS.observe(time.perf_counter() - started)
+
+            if self.crash_policy == "journal":
+                await self.cache.discard_journal(batch)
+            added = sum(inserted.values())
+            logger.info("Буфер приєднань записано: %d груп, %d нових учасників", len(batch), added)
+            return added
+
+    def _restore(self, batch: Dict[int, Set[int]]) -> None:
+        for group_id, user_ids in batch.items():
+            members = self._pending.setdefault(group_id, set())
+            before = len(members)
+            members.update(user_ids)
+            self._pending_count += len(members) - before
+        PENDING_MEMBERS.set(self._pending_count)
+
+    async def recover(self) -> int:
+        """Дописує в базу приєднання, що лишились у журналі після падіння."""
+        if self.crash_policy != "journal":
+            return 0
+        journal = await self.cache.load_journal()
+        for group_id, user_ids in journal.items():
+            members = self._pending.setdefault(group_id, set())
+            before = len(members)
+            members.update(user_ids)
+            self._pending_count += len(members) - before
+        if journal:
+            logger.info("Відновлено з журналу приєднання для %d груп", len(journal))
+        return await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception:
+                # Помилку вже залоговано у flush(), пачка лишилась у буфері
+                await asyncio.sleep(self.max_delay)
+
+    async def start(self) -> None:
+        await self.recover()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Зупиняє фоновий запис і синхронно записує все, що лишилось у буфері."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            # Зупинка процесу має продовжитись; з журналом приєднання відновить recover()
+            logger.error("Буфер приєднань не записано при зупинці, лишилось %d приєднань", self._pending_count)
+
+
+_member_buffer: Optional[MemberWriteBuffer] = None
+
+
+def get_member_buffer() -> Optional[MemberWriteBuffer]:
+    """Повертає спільний буфер у режимі write_behind або None у режимі sync."""
+    global _member_buffer
+    if _member_buffer is None and MEMBER_WRITE_MODE == "write_behind":
+        _member_buffer = MemberWriteBuffer(cache=get_cache_manager())
+    return _member_buffer
@@ -0,0 +1,215 @@
+import bisect
+import functools
+import logging
+import math
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+import tornado.httpserver
+import tornado.web
+
+logger = logging.getLogger(__name__)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class Counter:
+    """Лічильник, що лише зростає."""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(_label_key(labels), 0)
+
+
+class Gauge:
+    """Значення, яке може як зростати, так і спадати."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.values: Dict[LabelKey, float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        self.values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def get(self, **labels) -> float:
+        return self.values.get(_label_key(labels), 0)
+
+
+class Histogram:
+    """Розподіл значень (зазвичай тривалостей у секундах) за кошиками."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        # Для кожного набору міток: лічильники кошиків (+Inf останній), сума і кількість
+        self.values: Dict[LabelKey, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        state = self.values.get(key)
+        if state is None:
+            state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def count(self, **labels) -> int:
+        state = self.values.get(_label_key(labels))
+        return state[2] if state else 0
+
+    def sum(self, **labels) -> float:
+        state = self.values.get(_label_key(labels))
+        return state[1] if state else 0.0
+
+
+class MetricsRegistry:
+    """Реєстр метрик процесу. Повторна реєстрація з тим самим ім'ям повертає існуючу метрику."""
+
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+
+    def _register(self, cls, name: str, documentation: str, **kwargs):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = cls(name, documentation, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Метрика {name} вже зареєстрована з іншим типом")
+        return metric
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._register(Counter, name, documentation)
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self._register(Gauge, name, documentation)
+
+    def histogram(self, name: str, documentation: str, buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, buckets=buckets)
+
+    def get(self, name: str) -> Optional[object]:
+        return self.metrics.get(name)
+
+
+REGISTRY = MetricsRegistry()
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def render_prometheus(registry: MetricsRegistry = REGISTRY) -> str:
+    """Серіалізує метрики в текстовий формат Prometheus (version 0.0.4)."""
+    lines = []
+    for name, metric in sorted(registry.metrics.items()):
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.type}")
+        for key, value in sorted(metric.values.items()):
+            if isinstance(metric, Histogram):
+                bucket_counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(metric.buckets + (math.inf,), bucket_counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(key, (("le", _format_value(bound)),))
+                    lines.append(f"{name}_bucket{labels} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(key)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(key)} {count}")
+            else:
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def timed(histogram: Histogram, label: str, errors: Optional[Counter] = None):
+    """Декоратор корутини: пише тривалість у histogram з міткою label=<qualname функції>.
+
+    Якщо передано errors, винятки рахуються в ньому з тією ж міткою і прокидаються далі.
+    """
+    def decorator(func):
+        labels = {label: func.__qualname__}
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(**labels)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+
+        return wrapper
+
+    return decorator
+
+
+# Спільні метрики для обробників Telegram, сервісів і фонових задач
+HANDLER_SECONDS = REGISTRY.histogram("bot_handler_seconds", "Тривалість обробки оновлення Telegram")
+HANDLER_ERRORS = REGISTRY.counter("bot_handler_errors_total", "Винятки в обробниках оновлень Telegram")
+SERVICE_SECONDS = REGISTRY.histogram("service_call_seconds", "Тривалість викликів методів сервісів")
+JOB_SECONDS = REGISTRY.histogram("scheduler_job_seconds", "Тривалість запусків задач планувальника")
+JOB_ERRORS = REGISTRY.counter("scheduler_job_errors_total", "Невдалі запуски задач планувальника")
+CACHE_REQUESTS = REGISTRY.counter("cache_requests_total", "Звернення до кешів за результатом (hit/miss)")
+
+handler_timed = functools.partial(timed, HANDLER_SECONDS, "handler", HANDLER_ERRORS)
+service_timed = functools.partial(timed, SERVICE_SECONDS, "method")
+job_timed = functools.partial(timed, JOB_SECONDS, "job", JOB_ERRORS)
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def initialize(self, registry: MetricsRegistry) -> None:
+        self.registry = registry
+
+    def get(self) -> None:
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(render_prometheus(self.registry))
+
+
+def start_metrics_server(port: int, registry: MetricsRegistry = REGISTRY) -> tornado.httpserver.HTTPServer:
+    """Запускає HTTP-сервер з GET /metrics на окремому порту в поточному event loop."""
+    app = tornado.web.Application([(r"/metrics", MetricsHandler, {"registry": registry})])
+    server = app.listen(port)
+    logger.info("Метрики доступні на порту %s за шляхом /metrics", port)
+    return server
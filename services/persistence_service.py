@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import os
+from typing import Dict, Optional
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from telegram.ext import BasePersistence, PersistenceInput
+from db_config import AsyncSessionLocal, PersistentData
+from services.conversation_state_service import ConversationStateStore, StateKey, encode_conversation_key
+from services.metrics_service import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Як часто Application передає змінені стани розмов і bot_data в persistence; усі зміни
+# за інтервал записуються однією пачкою, тож під час розмови запису в базу на кожне
+# повідомлення немає. Після падіння процесу втрачаються зміни не більше ніж за цей час
+PERSISTENCE_FLUSH_INTERVAL = float(os.getenv("PERSISTENCE_FLUSH_INTERVAL", 10))
+
+BOT_DATA_KEY = "bot_data"
+
+PERSISTENCE_WRITES = REGISTRY.counter("persistence_writes_total", "Записи persistence в базу, по одному на пачку змін")
+PERSISTENCE_CHANGES = REGISTRY.counter("persistence_changes_total", "Змінені стани розмов і bot_data, записані в базу")
+
+
+class PostgresPersistence(BasePersistence):
+    """Зберігає стани ConversationHandler-ів і bot_data в Postgres.
+
+    Стани розмов пишуться в таблицю conversation_states, bot_data — у persistent_data.
+    Application викликає update_* раз на update_interval для всього, що змінилось за
+    інтервал; ці виклики лише накопичують зміни, а записує їх пачкою одна фонова задача.
+    flush() при зупинці дописує залишок. Воркери черги оновлень не запускають Application
+    і викликають update_persistence() і flush() самі після кожної пачки.
+
+    user_data, chat_data і callback_data бот не використовує, тож вони не зберігаються.
+    """
+
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        update_interval: float = PERSISTENCE_FLUSH_INTERVAL,
+    ):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=False, user_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.session_factory = session_factory
+        self.store = ConversationStateStore(session_factory)
+        self._pending_conversations: Dict[StateKey, Optional[object]] = {}
+        self._pending_bot_data: Optional[dict] = None
+        self._saved_bot_data: Optional[dict] = None
+        self._write_task: Optional[asyncio.Task] = None
+
+    async def get_conversations(self, name: str) -> dict:
+        return await self.store.load_handler(name)
+
+    async def get_bot_data(self) -> dict:
+        async with self.session_factory() as session:
+            data = (
+                await session.execute(select(PersistentData.data).filter_by(key=BOT_DATA_KEY))
+            ).scalar()
+        self._saved_bot_data = data
+        return dict(data or {})
+
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]) -> None:
+        self._pending_conversations[(name, encode_conversation_key(key))] = new_state
+        self._schedule_write()
+
+    async def update_bot_data(self, data: dict) -> None:
+        # Application передає bot_data на кожному інтервалі, навіть незмінні; цей виклик
+        # заодно повторює запис, що не вдався на попередньому інтервалі
+        if data != self._saved_bot_data:
+            self._pending_bot_data = data
+        if self._pending_conversations or self._pending_bot_data is not None:
+            self._schedule_write()
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    def _schedule_write(self) -> None:
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self) -> None:
+        # Application викликає update_* для всіх змін інтервалу разом; поступаємось циклу подій,
+        # щоб вони встигли потрапити в ту саму пачку
+        await asyncio.sleep(0)
+        while self._pending_conversations or self._pending_bot_data is not None:
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            bot_data, self._pending_bot_data = self._pending_bot_data, None
+            try:
+                await self._save(conversations, bot_data)
+            except Exception:
+                logger.exception("Не вдалося записати стан розмов, повтор на наступному інтервалі")
+                # Новіші зміни, що надійшли під час запису, мають перевагу над поверненими
+                self._pending_conversations = {**conversations, **self._pending_conversations}
+                if self._pending_bot_data is None:
+                    self._pending_bot_data = bot_data
+                return
+
+    async def _save(self, conversations: Dict[StateKey, Optional[object]], bot_data: Optional[dict]) -> None:
+        if conversations:
+            await self.store.save(conversations)
+        if bot_data is not None:
+            async with self.session_factory() as session:
+                stmt = insert(PersistentData).values(key=BOT_DATA_KEY, data=bot_data)
+                await session.execute(
+                    stmt.on_conflict_do_update(
+                        index_elements=[PersistentData.key],
+                        set_={"data": stmt.excluded.data, "updated_at": stmt.excluded.updated_at},
+                    )
+                )
+                await session.commit()
+            self._saved_bot_data = bot_data
+        PERSISTENCE_WRITES.inc()
+        PERSISTENCE_CHANGES.inc(len(conversations) + (bot_data is not None))
+
+    async def flush(self) -> None:
+        """Викликається Application.stop(): дописує всі накопичені зміни."""
+        if self._write_task is not None:
+            await self._write_task
+            self._write_task = None
+        await self._write_pending()
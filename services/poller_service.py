@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Set
+from sqlalchemy.exc import IntegrityError
+from telegram.error import RetryAfter, TelegramError
+from db_config import AsyncSessionLocal
+from services.cache_service import get_cache_manager, member_count_cache
+from services.cluster_service import InstanceRegistry
+from services.group_service import GroupService
+from services.history_service import HistoryService
+from services.metrics_service import REGISTRY
+from services.telegram_service import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Telegram дозволяє близько 30 запитів на секунду від одного бота, лишаємо запас для обробників
+POLL_RATE_LIMIT = float(os.getenv("POLL_RATE_LIMIT", 20))
+POLL_BURST = float(os.getenv("POLL_BURST", 20))
+POLL_CONCURRENCY = int(os.getenv("POLL_CONCURRENCY", 10))
+
+# Адаптивний розклад: групи, де кількість змінюється, опитуються кожні POLL_MIN_INTERVAL секунд,
+# незмінні — з експоненційно зростаючим інтервалом, але не рідше ніж раз на POLL_MAX_INTERVAL
+POLL_MIN_INTERVAL = int(os.getenv("POLL_MIN_INTERVAL", 60))
+POLL_MAX_INTERVAL = int(os.getenv("POLL_MAX_INTERVAL", 3600))
+POLL_BACKOFF_FACTOR = float(os.getenv("POLL_BACKOFF_FACTOR", 2))
+POLL_JITTER = float(os.getenv("POLL_JITTER", 0.1))
+# Кількість, отриману не раніше ніж стільки секунд тому, повторно не запитуємо
+POLL_CACHE_MAX_AGE = float(os.getenv("POLL_CACHE_MAX_AGE", POLL_MIN_INTERVAL / 2))
+
+POLL_PASS_SECONDS = REGISTRY.histogram(
+    "member_count_poll_pass_seconds", "Тривалість одного проходу опитування кількості учасників"
+)
+POLL_LAST_PASS_SECONDS = REGISTRY.gauge(
+    "member_count_poll_last_pass_seconds", "Тривалість останнього проходу опитування"
+)
+POLL_REQUESTS = REGISTRY.counter(
+    "member_count_poll_requests_total", "Запити get_chat_member_count за результатом"
+)
+
+
+telegram_rate_limiter = TokenBucket(POLL_RATE_LIMIT, POLL_BURST)
+
+# Групи, де щойно з'явились нові учасники; опитуються на наступному проході поза розкладом
+_active_group_ids: Set[int] = set()
+
+
+def mark_group_active(group_id: int) -> None:
+    _active_group_ids.add(group_id)
+
+
+def next_poll_interval(
+    interval: Optional[int],
+    last_count: Optional[int],
+    count: int,
+    min_interval: int = POLL_MIN_INTERVAL,
+    max_interval: int = POLL_MAX_INTERVAL,
+    factor: float = POLL_BACKOFF_FACTOR,
+) -> int:
+    """Скидає інтервал до мінімуму при зміні кількості, інакше збільшує його в factor разів."""
+    if interval is None or last_count is None or count != last_count:
+        return min_interval
+    return int(min(max_interval, max(min_interval, interval * factor)))
+
+
+class MemberCountPoller:
+    """Опитує кількість учасників активних груп паралельно з обмеженням частоти.
+
+    Опитуються лише групи, яким настав час за адаптивним розкладом (стан зберігається
+    у group_poll_state і переживає перезапуски). Усі зміни максимумів за прохід
+    записуються одним UPDATE, а з'єднання з базою не утримується, поки йдуть запити
+    до Telegram.
+
+    З registry кожен живий процес опитує лише свій шард груп за group_id, а ліміт
+    частоти ділиться між процесами порівну.
+    """
+
+    def __init__(
+        self,
+        bot,
+        rate_limiter: TokenBucket = telegram_rate_limiter,
+        concurrency: int = POLL_CONCURRENCY,
+        registry: Optional[InstanceRegistry] = None,
+    ):
+        self.bot = bot
+        self.registry = registry
+        self.rate_limiter = rate_limiter
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_member_count(self, group_id: int) -> Optional[int]:
+        # Повтори після flood control і тайм-аутів робить TelegramRateLimiter бота
+        await self.rate_limiter.acquire()
+        try:
+            async with self.semaphore:
+                count = await self.bot.get_chat_member_count(chat_id=group_id)
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            if isinstance(retry_after, timedelta):
+                retry_after = retry_after.total_seconds()
+            POLL_REQUESTS.inc(result="retry_after")
+            logger.warning("Flood control для групи %s, пауза %s с", group_id, retry_after)
+            self.rate_limiter.pause(retry_after)
+            return None
+        except TelegramError as e:
+            POLL_REQUESTS.inc(result="error")
+            logger.error("Помилка отримання кількості учасників для групи %s: %s", group_id, e)
+            return None
+        POLL_REQUESTS.inc(result="ok")
+        return count
+
+    async def run_pass(self) -> Dict[int, int]:
+        """Виконує один прохід і повертає групи, для яких зріс максимум."""
+        started = time.perf_counter()
+        shard = None
+        if self.registry is not None:
+            shard = await self.registry.shard()
+            if shard is None:
+                # Heartbeat цього процесу ще не записано або він прострочений — групи зараз ділять інші
+                logger.warning("Процес %s поза списком живих, прохід опитування пропущено", self.registry.instance_id)
+                return {}
+            self.rate_limiter.share(shard[1])
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        active_group_ids = set(_active_group_ids)
+        _active_group_ids.difference_update(active_group_ids)
+
+        async with AsyncSessionLocal() as session:
+            groups = await GroupService(session).get_due_groups(now, active_group_ids, shard)
+
+        cache = get_cache_manager()
+        # Групу за розкладом могли щойно опитати в іншому процесі як активну — беремо готове значення.
+        # Активні групи опитуються завжди: після приєднань кешована кількість уже застаріла
+        cached = await member_count_cache.get_many(
+            (group.group_id for group in groups if group.group_id not in active_group_ids),
+            cache, max_age=POLL_CACHE_MAX_AGE,
+        )
+        if cached:
+            POLL_REQUESTS.inc(len(cached), result="cached")
+        to_fetch = [group.group_id for group in groups if group.group_id not in cached]
+        fetched = dict(zip(to_fetch, await asyncio.gather(*(self.fetch_member_count(group_id) for group_id in to_fetch))))
+        await member_count_cache.set_many(
+            {group_id: count for group_id, count in fetched.items() if count is not None}, cache
+        )
+        counts = [
+            cached[group.group_id][0] if group.group_id in cached else fetched[group.group_id] for group in groups
+        ]
+
+        changes = {}
+        states = []
+        samples = []
+        for group, count in zip(groups, counts):
+            if count is None:
+                # Невдалий запит не змінює розклад — група лишиться простроченою до наступного проходу
+                continue
+            if count > (group.max_member_count or 0):
+                changes[group.group_id] = count
+            if count != group.last_count:
+                # В історію пишемо лише зміни: незмінне значення відновлюється з попереднього зразка
+                samples.append({"group_id": group.group_id, "sampled_at": now, "count": count})
+            if group.group_id in active_group_ids:
+                interval = POLL_MIN_INTERVAL
+            else:
+                interval = next_poll_interval(group.interval_seconds, group.last_count, count)
+            delay = interval * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+            states.append({
+                "group_id": group.group_id,
+                "last_count": count,
+                "interval_seconds": interval,
+                "next_poll_at": now + timedelta(seconds=delay),
+                "last_polled_at": now,
+            })
+
+        async with AsyncSessionLocal() as session:
+            group_service = GroupService(session, cache=cache)
+            if changes:
+                await group_service.bulk_update_max_member_counts(changes)
+            try:
+                # Зразки йдуть у ту саму транзакцію, яку комітить upsert_poll_states
+                await HistoryService(session).add_samples(samples)
+                await group_service.upsert_poll_states(states)
+            except IntegrityError:
+                # Групу видалили під час проходу; стан решти буде збережено наступного разу
+                await session.rollback()
+                logger.warning("Не вдалося зберегти стан опитування: групу видалено під час проходу")
+
+        duration = time.perf_counter() - started
+        POLL_PASS_SECONDS.observe(duration)
+        POLL_LAST_PASS_SECONDS.set(duration)
+        logger.info(
+            "Прохід опитування: %d груп, %d оновлено, %d змін кількості за %.2f с (шард %s)",
+            len(groups), len(changes), len(samples), duration,
+            "%d/%d" % shard if shard else "-",
+        )
+        return changes
@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from datetime import timedelta
+from typing import Any, Dict, Optional, Tuple
+import httpx
+from telegram.error import RetryAfter, TimedOut
+from telegram.ext import BaseRateLimiter
+from telegram.request import HTTPXRequest
+from services.metrics_service import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Пул HTTPX: за замовчуванням у PTB одне з'єднання на всі запити, і паралельні виклики
+# (опитування груп, відповіді обробників) чекають у черзі пулу
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", 16))
+TELEGRAM_POOL_TIMEOUT = float(os.getenv("TELEGRAM_POOL_TIMEOUT", 5))
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv("TELEGRAM_CONNECT_TIMEOUT", 5))
+TELEGRAM_READ_TIMEOUT = float(os.getenv("TELEGRAM_READ_TIMEOUT", 10))
+TELEGRAM_KEEPALIVE_EXPIRY = float(os.getenv("TELEGRAM_KEEPALIVE_EXPIRY", 60))
+
+# Ліміти Telegram: близько 30 запитів на секунду на бота, 1 повідомлення на секунду
+# в особистий чат і 20 на хвилину в групу
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", 30))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", 1))
+TELEGRAM_GROUP_RATE_PER_MINUTE = float(os.getenv("TELEGRAM_GROUP_RATE_PER_MINUTE", 20))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", 3))
+TELEGRAM_RETRY_BASE_DELAY = float(os.getenv("TELEGRAM_RETRY_BASE_DELAY", 0.5))
+TELEGRAM_RETRY_JITTER = float(os.getenv("TELEGRAM_RETRY_JITTER", 0.2))
+
+# Методи лише для читання: однакові одночасні запити виконуються один раз
+COALESCED_METHODS = frozenset({
+    "getChat", "getChatMember", "getChatMemberCount", "getChatAdministrators", "getMe",
+})
+# Скільки відер для окремих чатів тримати, перш ніж прибрати невикористовувані
+_MAX_CHAT_BUCKETS = 512
+
+TELEGRAM_API_SECONDS = REGISTRY.histogram("telegram_api_seconds", "Тривалість запитів до Telegram Bot API")
+TELEGRAM_API_RESPONSES = REGISTRY.counter("telegram_api_responses_total", "Відповіді Telegram Bot API за HTTP-статусом")
+TELEGRAM_API_ERRORS = REGISTRY.counter("telegram_api_errors_total", "Запити до Telegram Bot API без відповіді (мережа, таймаут)")
+TELEGRAM_CALL_SECONDS = REGISTRY.histogram(
+    "telegram_call_seconds", "Тривалість виклику Bot API разом з очікуванням лімітів і повторами"
+)
+TELEGRAM_RETRIES = REGISTRY.counter("telegram_retries_total", "Повтори викликів Bot API за причиною")
+TELEGRAM_COALESCED = REGISTRY.counter(
+    "telegram_coalesced_total", "Виклики Bot API, що отримали результат уже запущеного однакового запиту"
+)
+
+
+class TokenBucket:
+    """Обмежувач частоти: rate токенів на секунду, не більше capacity підряд.
+
+    pause() блокує всіх споживачів до вказаного моменту — так обробляється RetryAfter,
+    оскільки flood control Telegram діє на весь бот, а не на окремий запит.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def is_idle(self) -> bool:
+        """True, якщо відро повне і не на паузі — тобто ним давно не користувались."""
+        now = time.monotonic()
+        self._refill(now)
+        return self._tokens >= self.capacity and now >= self._paused_until
+
+    def share(self, count: int) -> None:
+        """Ділить base_rate між count процесами, що одночасно опитують Telegram від імені бота."""
+        self.rate = self.base_rate / max(1, count)
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+
+class InstrumentedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest, що міряє затримку кожного виклику Bot API з міткою методу (getChatMemberCount тощо)."""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        try:
+            status, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            TELEGRAM_API_ERRORS.inc(method=api_method)
+            raise
+        finally:
+            TELEGRAM_API_SECONDS.observe(time.perf_counter() - start, method=api_method)
+        TELEGRAM_API_RESPONSES.inc(method=api_method, status=status)
+        return status, payload
+
+
+def build_request() -> InstrumentedHTTPXRequest:
+    """HTTPXRequest з пулом з'єднань і таймаутами з конфігурації."""
+    return InstrumentedHTTPXRequest(
+        connection_pool_size=TELEGRAM_POOL_SIZE,
+        pool_timeout=TELEGRAM_POOL_TIMEOUT,
+        connect_timeout=TELEGRAM_CONNECT_TIMEOUT,
+        read_timeout=TELEGRAM_READ_TIMEOUT,
+        httpx_kwargs={"limits": httpx.Limits(
+            max_connections=TELEGRAM_POOL_SIZE,
+            max_keepalive_connections=TELEGRAM_POOL_SIZE,
+            keepalive_expiry=TELEGRAM_KEEPALIVE_EXPIRY,
+        )},
+    )
+
+
+def _chat_key(chat_id: Any) -> Optional[Any]:
+    if chat_id is None:
+        return None
+    try:
+        return int(chat_id)
+    except (TypeError, ValueError):
+        # @username каналу чи супергрупи
+        return chat_id
+
+
+class TelegramRateLimiter(BaseRateLimiter):
+    """Обгортка над кожним викликом Bot API, підключена через ApplicationBuilder.rate_limiter().
+
+    Через неї проходять усі виклики бота — і з обробників (reply_text, send_message,
+    leave_chat), і з планувальника. Вона:
+
+    - виконує один раз однакові одночасні запити на читання (COALESCED_METHODS), решта
+      викликачів отримує той самий результат;
+    - обмежує загальну частоту запитів бота і частоту повідомлень у кожен чат;
+    - повторює запит після RetryAfter (пауза для всіх запитів бота на вказаний час),
+      а запит на читання — ще й після TimedOut (експоненційна затримка), з випадковим
+      відхиленням. Запит, що змінює стан, після TimedOut не повторюється: Telegram міг
+      його вже виконати, і повтор надіслав би повідомлення двічі.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = TELEGRAM_GLOBAL_RATE,
+        chat_rate: float = TELEGRAM_CHAT_RATE,
+        group_rate_per_minute: float = TELEGRAM_GROUP_RATE_PER_MINUTE,
+        max_retries: int = TELEGRAM_MAX_RETRIES,
+        base_delay: float = TELEGRAM_RETRY_BASE_DELAY,
+        jitter: float = TELEGRAM_RETRY_JITTER,
+    ):
+        self.global_limiter = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate_per_minute / 60
+        self.group_burst = group_rate_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.jitter = jitter
+        self._chat_limiters: Dict[Any, TokenBucket] = {}
+        self._in_flight: Dict[Tuple, asyncio.Future] = {}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _chat_limiter(self, chat_id: Any) -> TokenBucket:
+        limiter = self._chat_limiters.get(chat_id)
+        if limiter is None:
+            if len(self._chat_limiters) >= _MAX_CHAT_BUCKETS:
+                for key, idle in list(self._chat_limiters.items()):
+                    if idle.is_idle():
+                        del self._chat_limiters[key]
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            if is_group:
+                limiter = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                limiter = TokenBucket(self.chat_rate, self.chat_rate)
+            self._chat_limiters[chat_id] = limiter
+        return limiter
+
+    def _retry_delay(self, attempt: int, error: Exception) -> float:
+        if isinstance(error, RetryAfter):
+            delay = error.retry_after
+            if isinstance(delay, timedelta):
+                delay = delay.total_seconds()
+            # Flood control діє на весь бот: інші запити теж чекають
+            self.global_limiter.pause(delay)
+        else:
+            delay = self.base_delay * 2 ** attempt
+        return delay * random.uniform(1, 1 + self.jitter)
+
+    async def _call(self, callback, args, kwargs, endpoint: str, chat_id: Any, max_retries: int):
+        for attempt in range(max_retries + 1):
+            if chat_id is not None and endpoint not in COALESCED_METHODS:
+                await self._chat_limiter(chat_id).acquire()
+            await self.global_limiter.acquire()
+            try:
+                return await callback(*args, **kwargs)
+            except (RetryAfter, TimedOut) as e:
+                if attempt == max_retries or (isinstance(e, TimedOut) and endpoint not in COALESCED_METHODS):
+                    raise
+                reason = "retry_after" if isinstance(e, RetryAfter) else "timed_out"
+                TELEGRAM_RETRIES.inc(method=endpoint, reason=reason)
+                delay = self._retry_delay(attempt, e)
+                logger.warning("%s для %s, повтор через %.2f с", reason, endpoint, delay)
+                await asyncio.sleep(delay)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        """rate_limit_args — кількість повторів для окремого виклику замість max_retries."""
+        start = time.perf_counter()
+        chat_id = _chat_key(data.get("chat_id"))
+        max_retries = self.max_retries if rate_limit_args is None else rate_limit_args
+        try:
+            if endpoint not in COALESCED_METHODS:
+                return await self._call(callback, args, kwargs, endpoint, chat_id, max_retries)
+
+            key = (endpoint, tuple(sorted((name, repr(value)) for name, value in data.items())))
+            in_flight = self._in_flight.get(key)
+            if in_flight is not None:
+                TELEGRAM_COALESCED.inc(method=endpoint)
+                return await asyncio.shield(in_flight)
+            future = asyncio.get_running_loop().create_future()
+            self._in_flight[key] = future
+            try:
+                result = await self._call(callback, args, kwargs, endpoint, chat_id, max_retries)
+                future.set_result(result)
+                return result
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                future.set_exception(e)
+                # Виняток отримують ті, хто чекає; якщо чекачів немає, не лишаємо його неотриманим
+                future.exception()
+                raise
+            finally:
+                del self._in_flight[key]
+        finally:
+            TELEGRAM_CALL_SECONDS.observe(time.perf_counter() - start, method=endpoint)
@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterable, List, Optional, Tuple
+from sqlalchemy import delete, exists, func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import aliased
+from telegram import Update
+from telegram.ext import Application
+from db_config import AsyncSessionLocal, UpdateQueueItem
+from services.cluster_service import INSTANCE_HEARTBEAT_INTERVAL, WORKER_ROLE, InstanceRegistry, default_instance_id
+from services.metrics_service import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# direct — вебхук обробляє оновлення в тому ж процесі (за замовчуванням);
+# postgres — вебхук лише складає оновлення в update_queue, обробляють їх процеси worker.py
+UPDATE_QUEUE_MODE = os.getenv("UPDATE_QUEUE_MODE", "direct")
+UPDATE_QUEUE_BATCH = int(os.getenv("UPDATE_QUEUE_BATCH", 20))
+UPDATE_QUEUE_POLL_INTERVAL = float(os.getenv("UPDATE_QUEUE_POLL_INTERVAL", 0.2))
+# Скільки секунд оновлення закріплене за воркером; після цього його підхопить інший
+UPDATE_QUEUE_LEASE = int(os.getenv("UPDATE_QUEUE_LEASE", 60))
+UPDATE_QUEUE_MAX_ATTEMPTS = int(os.getenv("UPDATE_QUEUE_MAX_ATTEMPTS", 5))
+# Як часто воркер перевіряє свій шард чатів; стільки ж він чекає після зміни шарду,
+# поки інші воркери теж її помітять
+UPDATE_QUEUE_SHARD_REFRESH = float(os.getenv("UPDATE_QUEUE_SHARD_REFRESH", INSTANCE_HEARTBEAT_INTERVAL))
+
+ENQUEUED = REGISTRY.counter("update_queue_enqueued_total", "Оновлення, прийняті вебхуком у чергу")
+PROCESSED = REGISTRY.counter("update_queue_processed_total", "Оновлення, оброблені воркерами")
+DROPPED = REGISTRY.counter("update_queue_dropped_total", "Оновлення, відкинуті після UPDATE_QUEUE_MAX_ATTEMPTS спроб")
+QUEUE_LAG_SECONDS = REGISTRY.histogram(
+    "update_queue_lag_seconds", "Час від прийому оновлення вебхуком до завершення обробки",
+)
+
+# Поля оновлення, в яких Telegram передає чат (як у Update.effective_chat)
+_CHAT_FIELDS = (
+    "message", "edited_message", "channel_post", "edited_channel_post", "my_chat_member", "chat_member",
+    "chat_join_request", "message_reaction", "message_reaction_count", "chat_boost", "removed_chat_boost",
+    "business_message", "edited_business_message", "deleted_business_messages",
+)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def update_chat_id(payload: dict) -> Optional[int]:
+    """Повертає ID чату оновлення без розбору всього Update."""
+    for field in _CHAT_FIELDS:
+        chat = (payload.get(field) or {}).get("chat")
+        if chat:
+            return chat.get("id")
+    callback_message = (payload.get("callback_query") or {}).get("message")
+    if callback_message:
+        return callback_message["chat"]["id"]
+    return None
+
+
+class UpdateQueue:
+    """Черга оновлень Telegram у таблиці update_queue.
+
+    Воркери забирають оновлення через SELECT ... FOR UPDATE SKIP LOCKED і закріплюють
+    їх за собою на lease секунд. Видається лише найстаріше оновлення кожного чату:
+    наступне стає доступним, коли попереднє видалене через complete(), тож оновлення
+    одного чату обробляються строго по черзі навіть на різних воркерах. Якщо воркер
+    упав, оновлення повертається в роботу після завершення lease.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal, lease_seconds: int = UPDATE_QUEUE_LEASE):
+        self.session_factory = session_factory
+        self.lease_seconds = lease_seconds
+
+    async def enqueue(self, payload: dict) -> bool:
+        """Додає оновлення в чергу; повертає False для повторної доставки того самого update_id."""
+        async with self.session_factory() as session:
+            result = await session.execute(
+                insert(UpdateQueueItem)
+                .values(
+                    update_id=payload["update_id"],
+                    chat_id=update_chat_id(payload),
+                    payload=payload,
+                    received_at=_utcnow(),
+                )
+                .on_conflict_do_nothing(index_elements=[UpdateQueueItem.update_id])
+                .returning(UpdateQueueItem.id)
+            )
+            inserted = result.scalar() is not None
+            await session.commit()
+        if inserted:
+            ENQUEUED.inc()
+        return inserted
+
+    async def claim(
+        self, worker_id: str, limit: int = UPDATE_QUEUE_BATCH, shard: Optional[Tuple[int, int]] = None
+    ) -> List:
+        """Закріплює за воркером до limit оновлень, не більше одного на чат.
+
+        shard=(index, count) лишає оновлення чатів, для яких abs(chat_id) % count == index,
+        і оновлення без чату.
+        """
+        now = _utcnow()
+        earlier = aliased(UpdateQueueItem)
+        candidates = select(UpdateQueueItem.id)
+        if shard is not None and shard[1] > 1:
+            index, count = shard
+            candidates = candidates.where(
+                or_(UpdateQueueItem.chat_id.is_(None), func.abs(UpdateQueueItem.chat_id) % count == index)
+            )
+        candidates = (
+            candidates
+            .where(or_(UpdateQueueItem.locked_until.is_(None), UpdateQueueItem.locked_until < now))
+            .where(
+                ~exists().where(earlier.chat_id == UpdateQueueItem.chat_id, earlier.id < UpdateQueueItem.id)
+            )
+            .order_by(UpdateQueueItem.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        async with self.session_factory() as session:
+            result = await session.execute(
+                update(UpdateQueueItem)
+                .where(UpdateQueueItem.id.in_(candidates.scalar_subquery()))
+                .values(
+                    locked_by=worker_id,
+                    locked_until=now + timedelta(seconds=self.lease_seconds),
+                    attempts=UpdateQueueItem.attempts + 1,
+                )
+                .returning(
+                    UpdateQueueItem.id, UpdateQueueItem.payload, UpdateQueueItem.attempts, UpdateQueueItem.received_at
+                )
+            )
+            items = sorted(result.all(), key=lambda item: item.id)
+            await session.commit()
+        return items
+
+    async def complete(self, item_ids: Iterable[int]) -> None:
+        item_ids = list(item_ids)
+        if not item_ids:
+            return
+        async with self.session_factory() as session:
+            await session.execute(delete(UpdateQueueItem).where(UpdateQueueItem.id.in_(item_ids)))
+            await session.commit()
+
+    async def depth(self) -> int:
+        async with self.session_factory() as session:
+            return (await session.execute(select(func.count()).select_from(UpdateQueueItem))).scalar()
+
+
+class UpdateWorker:
+    """Забирає оновлення з UpdateQueue і обробляє їх обробниками Application.
+
+    Оновлення з однієї пачки належать різним чатам, тож обробляються паралельно.
+
+    ConversationHandler читає стани розмов із persistence лише в initialize(), тож
+    розмову чату веде один воркер: з registry (роль worker) воркер забирає лише чати
+    свого шарду серед живих воркерів. Після кожної пачки змінені стани записуються в
+    persistence ще до complete(). Коли шард змінюється, воркер створює Application
+    заново через application_factory і так отримує стани чатів, які досі обробляли
+    інші воркери.
+    """
+
+    def __init__(
+        self,
+        application_factory: Callable[[], Application],
+        queue: UpdateQueue,
+        registry: Optional[InstanceRegistry] = None,
+        worker_id: Optional[str] = None,
+        batch_size: int = UPDATE_QUEUE_BATCH,
+        poll_interval: float = UPDATE_QUEUE_POLL_INTERVAL,
+        max_attempts: int = UPDATE_QUEUE_MAX_ATTEMPTS,
+        shard_refresh_interval: float = UPDATE_QUEUE_SHARD_REFRESH,
+    ):
+        if registry is not None and registry.role != WORKER_ROLE:
+            raise ValueError("UpdateWorker потребує реєстру з роллю worker")
+        self.application_factory = application_factory
+        self.application: Optional[Application] = None
+        self.queue = queue
+        self.registry = registry
+        self.worker_id = worker_id or (registry.instance_id if registry is not None else default_instance_id())
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.shard_refresh_interval = shard_refresh_interval
+        self._shard: Optional[Tuple[int, int]] = None
+        self._shard_checked_at = 0.0
+        self._stopping = asyncio.Event()
+
+    async def _ensure_application(self) -> bool:
+        """Готує Application для поточного шарду; False — процес ще не бачить себе серед живих."""
+        shard = None
+        if self.registry is not None:
+            if self.application is not None and time.monotonic() - self._shard_checked_at < self.shard_refresh_interval:
+                return True
+            # Чати ділять лише процеси, що забирають оновлення, а не приймач вебхука
+            shard = await self.registry.shard(role=WORKER_ROLE)
+            self._shard_checked_at = time.monotonic()
+            if shard is None:
+                logger.warning("Воркер %s поза списком живих, оновлення не забираються", self.worker_id)
+                return False
+        if self.application is not None and shard == self._shard:
+            return True
+
+        if self.application is not None:
+            logger.info("Шард воркера %s змінився: %s -> %s", self.worker_id, self._shard, shard)
+            # shutdown() записує в persistence стани розмов, що лишились у пам'яті
+            await self.application.shutdown()
+            self.application = None
+            # За цей час решта воркерів теж помічає зміну і перестає брати чати, що відійшли цьому
+            await asyncio.sleep(self.shard_refresh_interval)
+        application = self.application_factory()
+        await application.initialize()
+        self.application, self._shard = application, shard
+        return True
+
+    async def _process(self, item) -> None:
+        if item.attempts > self.max_attempts:
+            logger.error("Оновлення %s відкинуто після %d спроб", item.payload.get("update_id"), item.attempts - 1)
+            DROPPED.inc()
+            return
+        telegram_update = Update.de_json(item.payload, self.application.bot)
+        await self.application.process_update(telegram_update)
+        PROCESSED.inc()
+        QUEUE_LAG_SECONDS.observe((_utcnow() - item.received_at).total_seconds())
+
+    async def run_once(self) -> int:
+        """Обробляє одну пачку; повертає кількість взятих з черги оновлень."""
+        if not await self._ensure_application():
+            return 0
+        items = await self.queue.claim(self.worker_id, self.batch_size, self._shard)
+        if not items:
+            return 0
+        results = await asyncio.gather(*(self._process(item) for item in items), return_exceptions=True)
+        # Наступне оновлення чату стає доступним після complete() і вже бачить новий стан розмови
+        await self.application.update_persistence()
+        if self.application.persistence is not None:
+            await self.application.persistence.flush()
+        done = []
+        for item, result in zip(items, results):
+            if isinstance(result, Exception):
+                logger.error("Помилка обробки оновлення %s", item.payload.get("update_id"), exc_info=result)
+            else:
+                done.append(item.id)
+        await self.queue.complete(done)
+        # Невдалі оновлення лишаються закріпленими і повторюються після lease,
+        # а наступні оновлення того ж чату чекають на них
+        return len(items)
+
+    async def run(self) -> None:
+        logger.info("Воркер %s запущено", self.worker_id)
+        while not self._stopping.is_set():
+            try:
+                claimed = await self.run_once()
+            except Exception:
+                logger.exception("Помилка читання черги оновлень")
+                claimed = 0
+            if not claimed:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        if self.application is not None:
+            await self.application.shutdown()
+        logger.info("Воркер %s зупинено", self.worker_id)
+
+    def stop(self) -> None:
+        self._stopping.set()
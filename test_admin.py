@@ -0,0 +1,67 @@
+import pytest
+from datetime import datetime
+from sqlalchemy import select, update
+from admin import is_admin, is_super_admin
+from db_config import AsyncSessionLocal, PotentialAdmin
+from services.admin_service import AdminService
+from services.cache_service import admin_cache
+
+
+@pytest.mark.asyncio
+async def test_admin_cache_is_invalidated_by_admin_service():
+    admin_cache.invalidate()
+    assert not await is_admin(777)
+    misses = admin_cache.misses
+
+    # Повторна перевірка обслуговується з кешу без запиту до бази
+    assert not await is_super_admin(777)
+    assert admin_cache.misses == misses
+    assert admin_cache.hits >= 1
+
+    async with AsyncSessionLocal() as session:
+        admin_service = AdminService(session)
+        assert await admin_service.add_admin(777, "cached")
+        assert await is_admin(777)
+        assert not await is_super_admin(777)
+
+        await admin_service.add_super_admin(777)
+        assert await is_super_admin(777)
+
+        await admin_service.remove_admin_by_id(777)
+        assert not await is_admin(777)
+
+
+@pytest.mark.asyncio
+async def test_potential_admin_upsert_and_batched_expiry():
+    async with AsyncSessionLocal() as session:
+        admin_service = AdminService(session)
+        await admin_service.upsert_potential_admin(888, "old_name")
+        await admin_service.upsert_potential_admin(888, "new_name")
+        assert await admin_service.get_potential_admin_by_username("old_name") is None
+        assert (await admin_service.get_potential_admin_by_username("new_name")).user_id == 888
+
+        for user_id in range(900, 905):
+            await admin_service.upsert_potential_admin(user_id, f"expired_{user_id}")
+        await session.execute(
+            update(PotentialAdmin).where(PotentialAdmin.user_id.between(900, 904)).values(requested_at=datetime(2000, 1, 1))
+        )
+        await session.commit()
+        # Прострочений запит не діє ще до прибирання
+        assert await admin_service.get_potential_admin_by_username("expired_900") is None
+
+        assert await admin_service.delete_expired_potential_admins(batch_size=2) == 5
+        remaining = (await session.execute(select(PotentialAdmin.user_id))).scalars().all()
+        assert 888 in remaining and not set(remaining) & set(range(900, 905))
+
+
+@pytest.mark.asyncio
+async def test_ensure_super_admin_keeps_existing_admin():
+    async with AsyncSessionLocal() as session:
+        admin_service = AdminService(session)
+        assert await admin_service.ensure_super_admin(779)
+        assert await is_super_admin(779)
+        assert not await admin_service.ensure_super_admin(779)
+
+        await admin_service.add_admin(780, "plain")
+        assert not await admin_service.ensure_super_admin(780)
+        assert not await is_super_admin(780)
@@ -2,17 +2,9 @@ import pytest
 from unittest.mock import AsyncMock, patch
 from telegram import Update, Chat, User
 from telegram.ext import ContextTypes
-from group import new_member
-from test_db import TestSessionLocal, create_test_database, drop_test_database
-from services.group_service import GroupService
-
-@pytest.fixture(scope="session", autouse=True)
-def setup_and_teardown_database():
-    # Створення тестової бази
-    create_test_database()
-    yield
-    # Видалення тестової бази після завершення
-    drop_test_database()
+from group import count_active_groups, new_member
+from db_config import Group, UserGroup
+from test_db import TestSessionLocal
 
 @pytest.mark.asyncio
 @patch("telegram.Bot.get_chat_member_count", new_callable=AsyncMock)
@@ -63,16 +55,78 @@ async def test_new_member_with_mocked_telegram_api(mock_get_chat_member, mock_ge
     mock_context.bot.id = 98765
 
     with TestSessionLocal() as session:
-        group_service = GroupService(session)
-
         # Виклик функції
         await new_member(mock_update, mock_context)
 
-        # Перевірка результатів у базі
-        group = group_service.get_group_by_identifier(session, mock_chat.id)
+        # Перевірка результатів у базі через синхронну сесію
+        group = session.query(Group).filter_by(group_id=mock_chat.id).first()
         assert group is not None, "Група не була додана до бази даних"
-        assert group.unique_members_count == 2, "Лічильник унікальних учасників неправильний"
+        assert group.unique_members_count == len(mock_update.message.new_chat_members), "Лічильник унікальних учасників неправильний"
 
         for user in mock_update.message.new_chat_members:
-            db_user = group_service.get_user(user_id=user.id, group_id=mock_chat.id)
+            db_user = session.query(UserGroup).filter_by(user_id=user.id, group_id=mock_chat.id).first()
             assert db_user is not None, f"Користувач ID {user.id} не був доданий до бази даних"
+
+
+@pytest.mark.asyncio
+@patch("group.is_admin", new_callable=AsyncMock, return_value=True)
+async def test_active_groups_report_is_split_into_pages(mock_is_admin):
+    with TestSessionLocal() as session:
+        session.add_all(
+            Group(group_id=-600000 - i, group_name=f"Report group {i:03d} " + "x" * 60, max_member_count=i)
+            for i in range(200)
+        )
+        session.commit()
+
+    mock_update = AsyncMock(spec=Update)
+    mock_update.effective_user = User(id=1, first_name="Admin", is_bot=False)
+    mock_context = AsyncMock(spec=ContextTypes.DEFAULT_TYPE)
+    mock_context.bot = AsyncMock()
+    mock_context.args = []
+
+    await count_active_groups(mock_update, mock_context)
+
+    pages = [call.args[1] for call in mock_context.bot.send_message.await_args_list]
+    assert len(pages) > 1
+    assert all(len(page) <= 4096 for page in pages)
+    assert sum(page.count("Report group") for page in pages) == 200
+
+    mock_context.args = ["csv"]
+    await count_active_groups(mock_update, mock_context)
+    mock_context.bot.send_document.assert_awaited_once()
+    assert mock_context.bot.send_document.await_args.kwargs["caption"].startswith("Активних груп:")
+
+
+@pytest.mark.asyncio
+async def test_join_update_is_routed_to_new_member():
+    from bot import build_application
+
+    with patch("bot.BOT_TOKEN", "123:TEST"):
+        application = build_application()
+    bot_user = {"id": 123, "is_bot": True, "first_name": "Test", "username": "test_bot"}
+    with patch.object(type(application.bot), "_post", AsyncMock(return_value=bot_user)):
+        await application.initialize()
+    try:
+        chat_id = -100987654321
+        await application.process_update(Update.de_json({
+            "update_id": 1,
+            "message": {
+                "message_id": 1, "date": 0,
+                "chat": {"id": chat_id, "type": "supergroup", "title": "Joined Group"},
+                "from": {"id": 501, "is_bot": False, "first_name": "Inviter"},
+                "new_chat_members": [
+                    {"id": 501, "is_bot": False, "first_name": "Inviter"},
+                    {"id": 502, "is_bot": False, "first_name": "Friend"},
+                    {"id": 123, "is_bot": True, "first_name": "Test"},
+                ],
+            },
+        }, application.bot))
+    finally:
+        await application.shutdown()
+
+    with TestSessionLocal() as session:
+        group = session.query(Group).filter_by(group_id=chat_id).one()
+        assert group.group_name == "Joined Group"
+        assert group.unique_members_count == 2
+        members = {row.user_id for row in session.query(UserGroup).filter_by(group_id=chat_id)}
+        assert members == {501, 502}
@@ -0,0 +1,125 @@
+import asyncio
+import time
+import pytest
+from fakeredis import FakeServer, aioredis
+from db_config import AsyncSessionLocal, Group, UserGroup
+from test_db import TestSessionLocal
+from services.cache_service import (
+    AdminCache, CacheInvalidationListener, LocalGroupCache, MemberCountCache, RedisCacheManager,
+)
+from services.group_service import GroupService
+
+
+@pytest.mark.asyncio
+async def test_group_service_reads_and_writes_through_redis():
+    redis_client = aioredis.FakeRedis()
+    cache = RedisCacheManager(client=redis_client)
+
+    async with AsyncSessionLocal() as session:
+        group_service = GroupService(session, cache=cache)
+        group = await group_service.get_or_create_group(-300001, "Cached Group")
+
+        # Створена група одразу потрапляє в кеш під узгодженими ключами
+        assert (await cache.get_group(group.group_id))["group_name"] == "Cached Group"
+        assert (await cache.get_group_by_name("Cached Group"))["group_id"] == group.group_id
+        # Назва в ключі без урахування регістру, як і пошук у Postgres
+        assert (await cache.get_group_by_name("cached GROUP"))["group_id"] == group.group_id
+
+        assert await group_service.add_unique_members(group, [1, 2]) == 2
+        assert await redis_client.sismember(f"group:{group.group_id}:users", 1)
+        assert (await cache.get_group(group.group_id))["unique_members_count"] == 2
+
+    # Відомих кешу учасників не відправляємо в базу: видалений напряму рядок не повертається
+    with TestSessionLocal() as session:
+        session.query(UserGroup).filter_by(group_id=-300001, user_id=1).delete()
+        session.commit()
+
+    async with AsyncSessionLocal() as session:
+        group_service = GroupService(session, cache=cache)
+        cached_group = await group_service.get_group_by_identifier(-300001)
+        assert await group_service.add_unique_members(cached_group, [1, 2, 3]) == 1
+        assert await group_service.get_user(user_id=1, group_id=-300001) is not None
+
+        assert await group_service.delete_group("Cached Group") == "Групу Cached Group було видаленно."
+        assert await cache.get_group(-300001) is None
+        assert await cache.get_group_by_name("cached group") is None
+        assert not await redis_client.exists("group:-300001:users")
+
+    with TestSessionLocal() as session:
+        assert session.query(Group).filter_by(group_id=-300001).first() is None
+        # Учасників прибрав ON DELETE CASCADE
+        assert session.query(UserGroup).filter_by(group_id=-300001).count() == 0
+
+
+@pytest.mark.asyncio
+async def test_known_group_is_served_from_local_lru_without_network():
+    local_cache = LocalGroupCache(maxsize=2, ttl=60)
+    async with AsyncSessionLocal() as session:
+        await GroupService(session, local_cache=local_cache).get_or_create_group(-300002, "Local Group")
+
+    # Без сесії та Redis: будь-яке звернення до мережі завершилося б помилкою
+    group = await GroupService(None, local_cache=local_cache).get_group_by_identifier(-300002)
+    assert group.group_name == "Local Group"
+    assert (await GroupService(None, local_cache=local_cache).get_group_by_identifier("Local Group")).group_id == -300002
+    assert (await GroupService(None, local_cache=local_cache).get_group_by_identifier("LOCAL group")).group_id == -300002
+
+    local_cache.set(1, {"group_id": 1, "group_name": "a"})
+    local_cache.set(2, {"group_id": 2, "group_name": "b"})
+    # Найдавніший запис витіснено разом з індексом за назвою
+    assert local_cache.get(-300002) is None
+    assert local_cache.get_by_name("local group") is None
+
+    local_cache.ttl = 0
+    local_cache.set(3, {"group_id": 3, "group_name": "c"})
+    assert local_cache.get(3) is None
+
+
+@pytest.mark.asyncio
+async def test_member_counts_are_shared_through_redis_within_staleness_bound():
+    cache = RedisCacheManager(client=aioredis.FakeRedis())
+    await MemberCountCache().set_many({-1: 10, -2: 20}, cache, fetched_at=time.time() - 120)
+
+    # Інший процес бачить значення з Redis, але лише в межах ttl
+    other_process = MemberCountCache(ttl=600)
+    current = await other_process.get_many([-1, -2, -3], cache)
+    assert {group_id: count for group_id, (count, _) in current.items()} == {-1: 10, -2: 20}
+    assert await MemberCountCache(ttl=60).get_many([-1], cache) == {}
+
+
+@pytest.mark.asyncio
+async def test_invalidations_from_other_processes_reset_local_caches():
+    server = FakeServer()
+    publisher = RedisCacheManager(client=aioredis.FakeRedis(server=server))
+    local_cache = LocalGroupCache(ttl=60)
+    admins = AdminCache(ttl=60)
+    listener = CacheInvalidationListener(
+        RedisCacheManager(client=aioredis.FakeRedis(server=server)), local_cache, admins, retry_delay=0.01,
+    )
+    await listener.start()
+    try:
+        await asyncio.wait_for(listener.subscribed.wait(), timeout=1)
+        local_cache.set(1, {"group_id": 1, "group_name": "a"})
+        local_cache.set(2, {"group_id": 2, "group_name": "b"})
+
+        async def load_admins():
+            return {1}, set()
+
+        await admins.get(load_admins)
+        assert admins._is_fresh()
+
+        # Інший процес змінив групу 1 і список адміністраторів
+        await publisher.invalidate_groups([1])
+        await publisher.publish_admins_changed()
+        for _ in range(50):
+            if not admins._is_fresh() and local_cache.get(1) is None:
+                break
+            await asyncio.sleep(0.01)
+        assert local_cache.get(1) is None
+        assert not admins._is_fresh()
+        assert local_cache.get(2) is not None
+
+        # Власні повідомлення процес пропускає
+        listener.apply({"origin": listener.cache.origin, "groups": [2]})
+        assert local_cache.get(2) is not None
+    finally:
+        await listener.stop()
@@ -0,0 +1,47 @@
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from db_config import AsyncSessionLocal, BotInstance
+from services.cluster_service import InstanceRegistry
+from services.group_service import GroupService
+
+
+@pytest.mark.asyncio
+async def test_live_instances_split_due_groups_and_rebalance_on_leave():
+    group_ids = [-300001 - i for i in range(10)]
+    async with AsyncSessionLocal() as session:
+        group_service = GroupService(session)
+        for group_id in group_ids:
+            await group_service.get_or_create_group(group_id, f"Shard {group_id}")
+
+    first = InstanceRegistry("test-a")
+    second = InstanceRegistry("test-b")
+    stale = InstanceRegistry("test-c")
+    try:
+        for registry in (first, second, stale):
+            await registry.heartbeat()
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                update(BotInstance).filter_by(instance_id="test-c").values(heartbeat_at=datetime.utcnow() - timedelta(minutes=5))
+            )
+            await session.commit()
+        # Процес без свіжого heartbeat не входить до списку живих
+        assert await stale.shard() is None
+        shards = [await first.shard(), await second.shard()]
+        assert shards == [(0, 2), (1, 2)]
+
+        now = datetime.utcnow()
+        polled = []
+        async with AsyncSessionLocal() as session:
+            for shard in shards:
+                groups = await GroupService(session).get_due_groups(now, shard=shard)
+                polled.append({group.group_id for group in groups} & set(group_ids))
+        assert polled[0] and polled[1]
+        assert polled[0].isdisjoint(polled[1])
+        assert polled[0] | polled[1] == set(group_ids)
+
+        await second.leave()
+        assert await first.shard() == (0, 1)
+    finally:
+        for registry in (first, second, stale):
+            await registry.leave()
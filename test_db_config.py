@@ -0,0 +1,20 @@
+import pytest
+from sqlalchemy import text
+from db_config import (
+    DB_POOL_CHECKED_OUT, DB_POOL_CHECKOUT_SECONDS, DB_POOL_SATURATION, DB_POOL_SIZE, DB_MAX_OVERFLOW,
+    AsyncSessionLocal,
+)
+
+
+@pytest.mark.asyncio
+async def test_async_pool_records_checkout_wait_and_saturation():
+    checkouts = DB_POOL_CHECKOUT_SECONDS.count(engine="async")
+    async with AsyncSessionLocal() as session:
+        assert (await session.execute(text("SELECT 1"))).scalar() == 1
+        assert DB_POOL_CHECKED_OUT.get(engine="async") == 1
+        assert DB_POOL_SATURATION.get(engine="async") == pytest.approx(1 / (DB_POOL_SIZE + DB_MAX_OVERFLOW))
+
+    assert DB_POOL_CHECKOUT_SECONDS.count(engine="async") == checkouts + 1
+    # Після повернення з'єднання в пул заповненість падає
+    assert DB_POOL_CHECKED_OUT.get(engine="async") == 0
+    assert DB_POOL_SATURATION.get(engine="async") == 0
@@ -0,0 +1,73 @@
+import pytest
+from db_config import AsyncSessionLocal, Group
+from test_db import TestSessionLocal
+from services.group_service import GroupService, parse_group_identifier
+
+
+@pytest.mark.asyncio
+async def test_add_unique_members_counts_only_new_rows():
+    async with AsyncSessionLocal() as session:
+        group_service = GroupService(session)
+        group = await group_service.get_or_create_group(-100555, "Batch Group")
+
+        # Дублікати всередині пачки рахуються один раз
+        assert await group_service.add_unique_members(group, [1, 2, 3, 3]) == 3
+        # Повторна пачка додає лише нових користувачів
+        assert await group_service.add_unique_members(group, [2, 3, 4]) == 1
+        assert await group_service.add_unique_members(group, []) == 0
+        assert await group_service.get_user(user_id=4, group_id=group.group_id) is not None
+
+    with TestSessionLocal() as session:
+        stored = session.query(Group).filter_by(group_id=-100555).one()
+        assert stored.unique_members_count == 4
+
+
+@pytest.mark.asyncio
+async def test_reconcile_mode_skips_counter_and_reconciles_from_deltas(monkeypatch):
+    monkeypatch.setattr("services.group_service.UNIQUE_COUNT_MODE", "reconcile")
+    async with AsyncSessionLocal() as session:
+        group_service = GroupService(session)
+        group = await group_service.get_or_create_group(-100556, "Reconciled Group")
+
+        assert await group_service.add_unique_members(group, [1, 2, 3]) == 3
+        with TestSessionLocal() as sync_session:
+            assert sync_session.query(Group).filter_by(group_id=-100556).one().unique_members_count == 0
+
+        assert await group_service.reconcile_unique_member_counts() == {-100556: 3}
+
+        await group_service.add_unique_members(group, [3, 4, 5])
+        assert await group_service.reconcile_unique_member_counts() == {-100556: 2}
+        assert await group_service.reconcile_unique_member_counts() == {}
+
+        # Повний перерахунок збігається з інкрементальним і забирає ще не враховані прирости
+        await group_service.add_unique_members(group, [6])
+        assert (await group_service.reconcile_unique_member_counts(full=True)).get(-100556) == 1
+        assert await group_service.reconcile_unique_member_counts() == {}
+
+    with TestSessionLocal() as session:
+        assert session.query(Group).filter_by(group_id=-100556).one().unique_members_count == 6
+
+
+def test_parse_group_identifier():
+    assert parse_group_identifier(" -100123 ") == -100123
+    assert parse_group_identifier("42") == 42
+    assert parse_group_identifier("Group 42") == "Group 42"
+    assert parse_group_identifier("-") == "-"
+
+
+@pytest.mark.asyncio
+async def test_find_groups_ranks_exact_then_prefix_then_substring():
+    async with AsyncSessionLocal() as session:
+        group_service = GroupService(session, local_cache=None)
+        await group_service.create_group(-100601, "Chess Club")
+        await group_service.create_group(-100602, "chess")
+        await group_service.create_group(-100603, "Kyiv Chess Fans")
+        await group_service.create_group(-100604, "100%_real")
+
+        found = await group_service.find_groups("CHESS")
+        assert [group.group_id for group in found] == [-100602, -100601, -100603]
+        assert (await group_service.get_group_by_identifier("CHESS club")).group_id == -100601
+        assert [group.group_id for group in await group_service.find_groups("-100603")] == [-100603]
+        # Символи LIKE у запиті не працюють як шаблон
+        assert [group.group_id for group in await group_service.find_groups("0%_")] == [-100604]
+        assert [group.group_id for group in await group_service.find_groups("%")] == [-100604]
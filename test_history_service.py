@@ -0,0 +1,64 @@
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock
+from sqlalchemy import select, update
+from db_config import AsyncSessionLocal, GroupPollState, MemberCountSample
+from services.cache_service import member_count_cache
+from services.group_service import GroupService
+from services.history_service import HistoryService
+from services.poller_service import MemberCountPoller, TokenBucket
+
+
+@pytest.mark.asyncio
+async def test_poller_stores_only_changed_counts():
+    async with AsyncSessionLocal() as session:
+        group = await GroupService(session).get_or_create_group(-400001, "Sampled")
+
+    bot = AsyncMock()
+    poller = MemberCountPoller(bot, rate_limiter=TokenBucket(rate=1000, capacity=10))
+    for count in (5, 5, 7):
+        bot.get_chat_member_count.return_value = count
+        member_count_cache.clear()
+        await poller.run_pass()
+        async with AsyncSessionLocal() as session:
+            # Наступний прохід має знову опитати групу
+            await session.execute(
+                update(GroupPollState).filter_by(group_id=group.group_id).values(next_poll_at=datetime(2000, 1, 1))
+            )
+            await session.commit()
+
+    async with AsyncSessionLocal() as session:
+        counts = (await session.execute(
+            select(MemberCountSample.count).filter_by(group_id=group.group_id).order_by(MemberCountSample.sampled_at)
+        )).scalars().all()
+    assert counts == [5, 7]
+
+
+@pytest.mark.asyncio
+async def test_rollups_include_carried_value_and_retention_keeps_latest_sample():
+    day = datetime(2026, 10, 1)
+    async with AsyncSessionLocal() as session:
+        group = await GroupService(session).get_or_create_group(-400002, "History")
+        history_service = HistoryService(session)
+        await history_service.add_samples([
+            {"group_id": group.group_id, "sampled_at": day + timedelta(hours=hour, minutes=minute), "count": count}
+            for hour, minute, count in ((9, 50, 10), (10, 5, 12), (10, 20, 9), (10, 40, 11), (12, 10, 15))
+        ])
+        await session.commit()
+
+        await history_service.rollup(day + timedelta(hours=12, minutes=30))
+        hours = await history_service.get_history(group.group_id, "hour")
+        assert [(r.bucket_start.hour, r.min_count, r.max_count, r.last_count) for r in hours] == [
+            (9, 10, 10, 10), (10, 9, 12, 11), (12, 11, 15, 15),
+        ]
+        days = await history_service.get_history(group.group_id, "day")
+        assert [(r.bucket_start, r.min_count, r.max_count, r.last_count) for r in days] == [(day, 9, 15, 15)]
+        peak = await history_service.get_peak(group.group_id)
+        assert (peak.bucket_start, peak.max_count) == (day, 15)
+
+        await history_service.apply_retention(day + timedelta(days=10))
+        remaining = (await session.execute(
+            select(MemberCountSample.count).filter_by(group_id=group.group_id)
+        )).scalars().all()
+        assert remaining == [15]
+        assert len(await history_service.get_history(group.group_id, "hour")) == 3
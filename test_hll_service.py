@@ -0,0 +1,55 @@
+import pytest
+from db_config import AsyncSessionLocal, Group, UserGroup
+from test_db import TestSessionLocal
+from services.group_service import GroupService
+from services.hll_service import HyperLogLog
+
+
+def test_sketch_estimate_is_within_error_bound():
+    sketch = HyperLogLog()
+    sketch.update(range(100000))
+    sketch.update(range(50000))  # повтори не впливають на оцінку
+    assert abs(sketch.count() - 100000) / 100000 < 3 * sketch.relative_error
+
+    restored = HyperLogLog.from_bytes(sketch.to_bytes())
+    assert restored.count() == sketch.count()
+
+
+def test_sketch_estimate_is_unbiased_in_transition_range():
+    # 2.5 * m–5 * m: тут сира оцінка HLL без корекції завищує результат на кілька відсотків
+    errors = []
+    for start in range(0, 8 * 60000, 60000):
+        sketch = HyperLogLog()
+        sketch.update(range(start, start + 50000))
+        errors.append((sketch.count() - 50000) / 50000)
+    assert abs(sum(errors) / len(errors)) < HyperLogLog().relative_error
+    assert max(abs(error) for error in errors) < 3 * HyperLogLog().relative_error
+
+
+@pytest.mark.asyncio
+async def test_hll_group_counts_without_user_group_rows():
+    async with AsyncSessionLocal() as session:
+        group_service = GroupService(session)
+        group = await group_service.get_or_create_group(-500001, "Huge Group")
+        await group_service.add_unique_members(group, [1, 2, 3])
+
+        message = await group_service.set_count_mode(-500001, "hll", purge_rows=True)
+        assert "HyperLogLog" in message
+        assert "неможливе" in await group_service.set_count_mode(-500001, "exact")
+
+        group = await group_service.get_group_by_identifier(-500001)
+        assert group.count_mode == "hll"
+        # Приєднання до групи hll не чіпають рядок groups до злиття скетчів
+        assert await group_service.add_unique_members(group, [3, 4, 5]) == 0
+        # Режим читається з бази, якщо його не передано (шлях write-behind буфера)
+        assert await group_service.add_unique_members_bulk({-500001: [5, 6]}) == {}
+        with TestSessionLocal() as sync_session:
+            assert sync_session.query(Group).filter_by(group_id=-500001).one().unique_members_count == 3
+
+        assert await group_service.merge_pending_sketches() == {-500001: 6}
+        assert await group_service.merge_pending_sketches() == {}
+
+    with TestSessionLocal() as session:
+        stored = session.query(Group).filter_by(group_id=-500001).one()
+        assert stored.unique_members_count == 6
+        assert session.query(UserGroup).filter_by(group_id=-500001).count() == 0
@@ -0,0 +1,40 @@
+import pytest
+from services.leader_service import LeaderElector
+
+
+@pytest.mark.asyncio
+async def test_only_one_leader_and_failover_on_stop():
+    events = []
+    first = LeaderElector("test-job", interval=0.05, on_elected=lambda: events.append("first"))
+    second = LeaderElector("test-job", interval=0.05, on_elected=lambda: events.append("second"))
+    other = LeaderElector("other-job", interval=0.05)
+    try:
+        assert await first.check()
+        assert not await second.check()
+        # Інша задача має власний лок
+        assert await other.check()
+        # Лідер підтверджує лідерство, не втрачаючи лок
+        assert await first.check()
+
+        await first.stop()
+        assert not first.is_leader
+        assert await second.check()
+        assert events == ["first", "second"]
+    finally:
+        for elector in (first, second, other):
+            await elector.stop()
+
+
+@pytest.mark.asyncio
+async def test_leader_steps_down_when_connection_is_lost():
+    demoted = []
+    elector = LeaderElector("test-lost", interval=0.05, on_demoted=lambda: demoted.append(True))
+    try:
+        assert await elector.check()
+        await elector._connection.invalidate()
+        assert not await elector.check()
+        assert demoted == [True]
+        # Наступна спроба відкриває нове з'єднання і знову бере вільний лок
+        assert await elector.check()
+    finally:
+        await elector.stop()
@@ -0,0 +1,48 @@
+import io
+import json
+import logging
+import pytest
+from logging_config import SAMPLED, JsonFormatter, SamplingFilter, setup_logging, stop_logging
+
+
+@pytest.fixture
+def restore_root_logger():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield
+    stop_logging()
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def test_sampling_filter_only_drops_marked_records():
+    sampling = SamplingFilter(rate=0)
+    plain = logging.makeLogRecord({"msg": "звичайна подія"})
+    sampled = logging.makeLogRecord({"msg": "приєднання", **SAMPLED})
+
+    assert sampling.filter(plain)
+    assert not sampling.filter(sampled)
+    assert SamplingFilter(rate=1).filter(sampled)
+
+
+def test_json_logging_through_queue(restore_root_logger):
+    stream = io.StringIO()
+    setup_logging(level="INFO", fmt="json", sample_rate=1, stream=stream)
+    logger = logging.getLogger("test_logging_config")
+
+    logger.debug("не має потрапити: %s", "debug")
+    logger.info("Додано %d учасників", 3, extra={**SAMPLED, "group_id": -100})
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logger.exception("Помилка")
+    # Зупинка слухача дописує чергу в потік
+    stop_logging()
+
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [record["message"] for record in records] == ["Додано 3 учасників", "Помилка"]
+    assert records[0]["group_id"] == -100
+    assert records[0]["sample_rate"] == 1
+    assert "sampled" not in records[0]
+    assert "ValueError: boom" in records[1]["exc_info"]
+    assert JsonFormatter().format(logging.makeLogRecord({"msg": "x"})).startswith("{")
@@ -0,0 +1,83 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, patch
+from fakeredis import aioredis
+from db_config import AsyncSessionLocal, Group, UserGroup
+from test_db import TestSessionLocal
+from services.cache_service import RedisCacheManager
+from services.group_service import GroupService
+from services.member_buffer_service import FLUSH_SECONDS, JOURNAL_FAILURES, MemberWriteBuffer
+
+
+def stored_members(group_id):
+    with TestSessionLocal() as session:
+        group = session.query(Group).filter_by(group_id=group_id).one()
+        rows = session.query(UserGroup).filter_by(group_id=group_id).count()
+        return group.unique_members_count, rows
+
+
+@pytest.mark.asyncio
+async def test_buffer_deduplicates_and_flushes_on_size():
+    async with AsyncSessionLocal() as session:
+        group = await GroupService(session).get_or_create_group(-400001, "Buffered")
+
+    buffer = MemberWriteBuffer(max_size=4, max_delay=60, crash_policy="lose")
+    await buffer.start()
+    try:
+        assert await buffer.add(group.group_id, [1, 2, 2]) == 2
+        assert await buffer.add(group.group_id, [2]) == 0
+        # Поки поріг не досягнуто, в базі нічого немає
+        await asyncio.sleep(0)
+        assert stored_members(group.group_id) == (0, 0)
+
+        flushes = FLUSH_SECONDS.count()
+        await buffer.add(group.group_id, [3, 4])
+        for _ in range(50):
+            if FLUSH_SECONDS.count() > flushes:
+                break
+            await asyncio.sleep(0.02)
+        assert stored_members(group.group_id) == (4, 4)
+
+        await buffer.add(group.group_id, [4, 5])
+    finally:
+        # Коректна зупинка записує залишок буфера
+        await buffer.stop()
+    assert stored_members(group.group_id) == (5, 5)
+
+
+@pytest.mark.asyncio
+async def test_journal_survives_crash_and_is_replayed():
+    async with AsyncSessionLocal() as session:
+        group = await GroupService(session).get_or_create_group(-400002, "Journaled")
+
+    cache = RedisCacheManager(client=aioredis.FakeRedis())
+    crashed = MemberWriteBuffer(max_size=100, max_delay=60, crash_policy="journal", cache=cache)
+    await crashed.add(group.group_id, [10, 11])
+    # "Падіння": буфер зникає без flush, але журнал у Redis лишається
+
+    restarted = MemberWriteBuffer(max_size=100, max_delay=60, crash_policy="journal", cache=cache)
+    assert await restarted.recover() == 2
+    assert stored_members(group.group_id) == (2, 2)
+    assert await cache.load_journal() == {}
+
+
+@pytest.mark.asyncio
+async def test_unjournaled_members_are_flushed_at_once_and_stop_survives_errors():
+    async with AsyncSessionLocal() as session:
+        group = await GroupService(session).get_or_create_group(-400003, "Unjournaled")
+
+    cache = RedisCacheManager(client=aioredis.FakeRedis())
+    buffer = MemberWriteBuffer(max_size=100, max_delay=60, crash_policy="journal", cache=cache)
+    failures = JOURNAL_FAILURES.get()
+    with patch.object(cache, "journal_members", AsyncMock(return_value=False)):
+        assert await buffer.add(group.group_id, [20, 21]) == 2
+    assert JOURNAL_FAILURES.get() == failures + 2
+    assert stored_members(group.group_id) == (2, 2)
+
+    def broken_session():
+        raise ConnectionError("база недоступна")
+
+    broken = MemberWriteBuffer(max_size=100, max_delay=60, crash_policy="lose", session_factory=broken_session)
+    await broken.add(group.group_id, [22])
+    await broken.stop()
+    assert broken.pending_count == 1
@@ -0,0 +1,48 @@
+import httpx
+import pytest
+from services.metrics_service import MetricsRegistry, render_prometheus, start_metrics_server, timed
+
+
+def test_render_prometheus_text_format():
+    registry = MetricsRegistry()
+    registry.counter("joins_total", "Приєднання").inc(3, group="a")
+    histogram = registry.histogram("pass_seconds", "Прохід", buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+
+    text = render_prometheus(registry)
+
+    assert "# TYPE joins_total counter" in text
+    assert 'joins_total{group="a"} 3' in text
+    # Кошики кумулятивні, останній +Inf дорівнює кількості спостережень
+    assert 'pass_seconds_bucket{le="0.1"} 1' in text
+    assert 'pass_seconds_bucket{le="1"} 2' in text
+    assert 'pass_seconds_bucket{le="+Inf"} 2' in text
+    assert "pass_seconds_count 2" in text
+
+
+@pytest.mark.asyncio
+async def test_timed_decorator_and_metrics_endpoint(unused_tcp_port):
+    registry = MetricsRegistry()
+    seconds = registry.histogram("handler_seconds", "Обробники")
+    errors = registry.counter("handler_errors_total", "Помилки")
+
+    @timed(seconds, "handler", errors)
+    async def failing_handler():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        await failing_handler()
+    labels = {"handler": failing_handler.__qualname__}
+    assert seconds.count(**labels) == 1
+    assert errors.get(**labels) == 1
+
+    server = start_metrics_server(unused_tcp_port, registry)
+    try:
+        async with httpx.AsyncClient() as client:
+            response = await client.get(f"http://127.0.0.1:{unused_tcp_port}/metrics")
+    finally:
+        server.stop()
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "handler_errors_total{handler=" in response.text
@@ -0,0 +1,57 @@
+import pytest
+from unittest.mock import AsyncMock, patch
+from telegram import Update
+from telegram.ext import ApplicationBuilder, CommandHandler, ConversationHandler, MessageHandler, filters
+from services.conversation_state_service import ConversationStateStore
+from services.persistence_service import PostgresPersistence
+from test_update_queue_service import message_update
+
+CONVERSATION_KEY = ("persistent_conversation", "[801, 1]")
+
+
+async def start_application(seen: list):
+    async def begin(update, context):
+        context.bot_data["started"] = context.bot_data.get("started", 0) + 1
+        return 1
+
+    async def finish(update, context):
+        seen.append(update.message.text)
+        return ConversationHandler.END
+
+    persistence = PostgresPersistence(update_interval=3600)
+    application = ApplicationBuilder().token("123:TEST").persistence(persistence).build()
+    application.add_handler(ConversationHandler(
+        name="persistent_conversation",
+        persistent=True,
+        entry_points=[CommandHandler("begin", begin)],
+        states={1: [MessageHandler(filters.TEXT & ~filters.COMMAND, finish)]},
+        fallbacks=[],
+    ))
+    bot_user = {"id": 123, "is_bot": True, "first_name": "Test", "username": "test_bot"}
+    with patch.object(type(application.bot), "_post", AsyncMock(return_value=bot_user)):
+        await application.initialize()
+    return application, persistence
+
+
+@pytest.mark.asyncio
+async def test_conversation_survives_restart_and_writes_are_batched():
+    seen = []
+    store = ConversationStateStore()
+    application, persistence = await start_application(seen)
+    await application.process_update(Update.de_json(message_update(9301, 801, "/begin"), application.bot))
+    # Сама обробка повідомлення в базу не пише
+    assert await store.load([CONVERSATION_KEY]) == {}
+
+    await application.update_persistence()
+    await persistence.flush()
+    assert await store.load([CONVERSATION_KEY]) == {CONVERSATION_KEY: 1}
+
+    # Після "перезапуску" новий процес продовжує розмову зі збереженого стану
+    restarted, restarted_persistence = await start_application(seen)
+    assert restarted.bot_data == {"started": 1}
+    await restarted.process_update(Update.de_json(message_update(9302, 801, "відповідь"), restarted.bot))
+    assert seen == ["відповідь"]
+
+    await restarted.update_persistence()
+    await restarted_persistence.flush()
+    assert await store.load([CONVERSATION_KEY]) == {}
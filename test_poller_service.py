@@ -0,0 +1,97 @@
+import pytest
+from unittest.mock import AsyncMock
+from telegram.error import RetryAfter
+from db_config import AsyncSessionLocal, Group
+from test_db import TestSessionLocal
+from services.group_service import GroupService
+from services.cache_service import member_count_cache
+from services.poller_service import MemberCountPoller, TokenBucket, mark_group_active, next_poll_interval
+
+
+@pytest.mark.asyncio
+async def test_poller_bulk_updates_only_increased_counts():
+    async with AsyncSessionLocal() as session:
+        group_service = GroupService(session)
+        grown = await group_service.get_or_create_group(-200001, "Grown")
+        shrunk = await group_service.get_or_create_group(-200002, "Shrunk")
+        flooded = await group_service.get_or_create_group(-200006, "Flooded")
+        shrunk.max_member_count = 50
+        await session.commit()
+
+    live_counts = {grown.group_id: 10, shrunk.group_id: 40, flooded.group_id: 70}
+    flood_hits = []
+
+    async def get_chat_member_count(chat_id):
+        # Повтори робить rate limiter бота; сюди flood control доходить, лише коли вони вичерпані
+        if chat_id == flooded.group_id:
+            flood_hits.append(chat_id)
+            raise RetryAfter(0)
+        return live_counts.get(chat_id, 0)
+
+    bot = AsyncMock()
+    bot.get_chat_member_count.side_effect = get_chat_member_count
+    poller = MemberCountPoller(bot, rate_limiter=TokenBucket(rate=1000, capacity=10))
+
+    changes = await poller.run_pass()
+
+    assert changes == {grown.group_id: 10}
+    assert flood_hits == [flooded.group_id]
+    with TestSessionLocal() as session:
+        stored = {g.group_id: g.max_member_count for g in session.query(Group).all()}
+    assert stored[grown.group_id] == 10
+    assert stored[shrunk.group_id] == 50
+    assert stored[flooded.group_id] == 0
+
+
+def test_next_poll_interval_backs_off_until_count_changes():
+    assert next_poll_interval(None, None, 5, min_interval=60, max_interval=600) == 60
+    assert next_poll_interval(60, 5, 5, min_interval=60, max_interval=600) == 120
+    assert next_poll_interval(480, 5, 5, min_interval=60, max_interval=600) == 600
+    assert next_poll_interval(600, 5, 6, min_interval=60, max_interval=600) == 60
+
+
+@pytest.mark.asyncio
+async def test_poller_skips_groups_until_due_or_active():
+    async with AsyncSessionLocal() as session:
+        group = await GroupService(session).get_or_create_group(-200003, "Scheduled")
+
+    bot = AsyncMock()
+    bot.get_chat_member_count.return_value = 3
+    poller = MemberCountPoller(bot, rate_limiter=TokenBucket(rate=1000, capacity=10))
+
+    await poller.run_pass()
+    polled = [call.kwargs["chat_id"] for call in bot.get_chat_member_count.await_args_list]
+    assert group.group_id in polled
+
+    # Стан збережено, тож до настання next_poll_at група не опитується
+    bot.get_chat_member_count.reset_mock()
+    await poller.run_pass()
+    assert bot.get_chat_member_count.await_count == 0
+
+    # Нові учасники роблять групу позачергово "гарячою"
+    mark_group_active(group.group_id)
+    await poller.run_pass()
+    bot.get_chat_member_count.assert_awaited_once_with(chat_id=group.group_id)
+
+
+@pytest.mark.asyncio
+async def test_poller_caches_counts_and_reuses_fresh_ones():
+    member_count_cache.clear()
+    async with AsyncSessionLocal() as session:
+        fresh = await GroupService(session).get_or_create_group(-200004, "Fresh elsewhere")
+        polled = await GroupService(session).get_or_create_group(-200005, "Polled")
+
+    # Іншому процесу щойно відповів Telegram для цієї групи
+    await member_count_cache.set_many({fresh.group_id: 7})
+    bot = AsyncMock()
+    bot.get_chat_member_count.return_value = 4
+    poller = MemberCountPoller(bot, rate_limiter=TokenBucket(rate=1000, capacity=10))
+
+    changes = await poller.run_pass()
+
+    polled_ids = [call.kwargs["chat_id"] for call in bot.get_chat_member_count.await_args_list]
+    assert fresh.group_id not in polled_ids
+    assert polled.group_id in polled_ids
+    assert changes[fresh.group_id] == 7
+    current = await member_count_cache.get_many([fresh.group_id, polled.group_id])
+    assert {group_id: count for group_id, (count, _) in current.items()} == {fresh.group_id: 7, polled.group_id: 4}
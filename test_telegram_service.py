@@ -0,0 +1,59 @@
+import asyncio
+import pytest
+from telegram.error import RetryAfter, TimedOut
+from services.telegram_service import TelegramRateLimiter
+
+
+@pytest.mark.asyncio
+async def test_identical_reads_are_coalesced_and_sends_are_not():
+    calls = []
+
+    async def callback(endpoint):
+        calls.append(endpoint)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    limiter = TelegramRateLimiter(global_rate=1000, chat_rate=1000)
+    data = {"chat_id": -100}
+    counts = await asyncio.gather(*(
+        limiter.process_request(callback, ("getChatMemberCount",), {}, "getChatMemberCount", data, None)
+        for _ in range(3)
+    ))
+    assert counts == [1, 1, 1]
+
+    await asyncio.gather(*(
+        limiter.process_request(callback, ("sendMessage",), {}, "sendMessage", {"chat_id": 5, "text": "a"}, None)
+        for _ in range(2)
+    ))
+    assert calls == ["getChatMemberCount", "sendMessage", "sendMessage"]
+
+
+@pytest.mark.asyncio
+async def test_retries_on_retry_after_and_timeout_then_gives_up():
+    errors = [RetryAfter(0), TimedOut()]
+
+    async def flaky():
+        if errors:
+            raise errors.pop(0)
+        return True
+
+    limiter = TelegramRateLimiter(global_rate=1000, base_delay=0.001)
+    assert await limiter.process_request(flaky, (), {}, "getChat", {"chat_id": -100}, None)
+
+    async def always_timed_out():
+        raise TimedOut()
+
+    with pytest.raises(TimedOut):
+        await limiter.process_request(always_timed_out, (), {}, "getChat", {"chat_id": -100}, 1)
+    # Запит, що змінює стан, після тайм-ауту не повторюється
+    calls = []
+
+    async def send_timed_out():
+        calls.append(1)
+        raise TimedOut()
+
+    with pytest.raises(TimedOut):
+        await limiter.process_request(send_timed_out, (), {}, "sendMessage", {"chat_id": -100}, None)
+    assert calls == [1]
+    # Після невдачі запит більше не вважається активним і наступний виклик виконується заново
+    assert not limiter._in_flight
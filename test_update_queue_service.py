@@ -0,0 +1,148 @@
+import httpx
+import pytest
+import receiver
+from unittest.mock import AsyncMock, patch
+from sqlalchemy import delete
+from telegram.ext import ApplicationBuilder, CommandHandler, ConversationHandler, ExtBot, MessageHandler, filters
+from db_config import AsyncSessionLocal, BotInstance
+from services.cluster_service import WORKER_ROLE, InstanceRegistry
+from services.conversation_state_service import ConversationStateStore
+from services.persistence_service import PostgresPersistence
+from services.update_queue_service import UpdateQueue, UpdateWorker
+
+
+def message_update(update_id: int, chat_id: int, text: str, user_id: int = 1) -> dict:
+    message = {
+        "message_id": update_id, "date": 0, "text": text,
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+    return {"update_id": update_id, "message": message}
+
+
+@pytest.mark.asyncio
+async def test_queue_keeps_chat_order_and_retries_after_lease():
+    queue = UpdateQueue(lease_seconds=0)
+    assert await queue.enqueue(message_update(9001, 501, "a"))
+    assert not await queue.enqueue(message_update(9001, 501, "a"))  # повторна доставка
+    await queue.enqueue(message_update(9002, 501, "b"))
+    await queue.enqueue(message_update(9003, 502, "c"))
+
+    # Від кожного чату видається лише найстаріше оновлення
+    first = await queue.claim("worker-1")
+    assert [item.payload["update_id"] for item in first] == [9001, 9003]
+
+    # Lease нульовий: незавершене оновлення видається знову, а наступне того ж чату чекає
+    retried = await queue.claim("worker-2")
+    assert [item.payload["update_id"] for item in retried] == [9001, 9003]
+    assert retried[0].attempts == 2
+
+    await queue.complete(item.id for item in retried)
+    assert [item.payload["update_id"] for item in await queue.claim("worker-1")] == [9002]
+    assert await queue.depth() == 1
+    await queue.complete([item.id for item in await queue.claim("worker-1")])
+    assert await queue.depth() == 0
+
+
+def build_application(seen: list):
+    async def begin(update, context):
+        return 1
+
+    async def finish(update, context):
+        seen.append(update.message.text)
+        return ConversationHandler.END
+
+    application = ApplicationBuilder().token("123:TEST").persistence(PostgresPersistence()).build()
+    application.add_handler(ConversationHandler(
+        name="test_conversation",
+        persistent=True,
+        entry_points=[CommandHandler("begin", begin)],
+        states={1: [MessageHandler(filters.TEXT & ~filters.COMMAND, finish)]},
+        fallbacks=[],
+    ))
+    return application
+
+
+@pytest.mark.asyncio
+async def test_conversation_moves_to_new_shard_owner_through_persistence():
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(BotInstance))
+        await session.commit()
+    seen = []
+    queue = UpdateQueue()
+    store = ConversationStateStore()
+    state_key = ("test_conversation", "[601, 1]")
+    registries = [InstanceRegistry("worker-a", role=WORKER_ROLE), InstanceRegistry("worker-b", role=WORKER_ROLE)]
+    workers = [
+        UpdateWorker(lambda: build_application(seen), queue, registry=registry, shard_refresh_interval=0)
+        for registry in registries
+    ]
+    bot_user = {"id": 123, "is_bot": True, "first_name": "Test", "username": "test_bot"}
+    with patch.object(ExtBot, "_post", AsyncMock(return_value=bot_user)):
+        for registry in registries:
+            await registry.heartbeat()
+        # Шардів два, і чат 601 (601 % 2 == 1) належить worker-b
+        await queue.enqueue(message_update(9101, 601, "/begin"))
+        assert await workers[0].run_once() == 0
+        assert await workers[1].run_once() == 1
+        # Стан записано ще до complete()
+        assert await store.load([state_key]) == {state_key: 1}
+
+        # worker-b виходить, і worker-a перестворює Application, щоб отримати стан розмови з бази
+        await workers[1].application.shutdown()
+        await registries[1].leave()
+        await queue.enqueue(message_update(9102, 601, "відповідь"))
+        assert await workers[0].run_once() == 1
+        assert seen == ["відповідь"]
+        # Завершена розмова прибирається з бази
+        assert await store.load([state_key]) == {}
+        await workers[0].application.shutdown()
+    await registries[0].leave()
+
+
+@pytest.mark.asyncio
+async def test_webhook_receiver_does_not_take_a_chat_shard():
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(BotInstance))
+        await session.commit()
+    queue = UpdateQueue()
+    # Приймач вебхука теж подає heartbeat (він опитує групи), але оновлень не забирає
+    receiver_registry = InstanceRegistry("web.1:10")
+    worker_registry = InstanceRegistry("worker.1:20", role=WORKER_ROLE)
+    worker = UpdateWorker(lambda: build_application([]), queue, registry=worker_registry, shard_refresh_interval=0)
+    bot_user = {"id": 123, "is_bot": True, "first_name": "Test", "username": "test_bot"}
+    try:
+        for registry in (receiver_registry, worker_registry):
+            await registry.heartbeat()
+        assert await worker_registry.shard() == (1, 2)
+        for update_id, chat_id in ((9301, 100), (9302, 101)):
+            await queue.enqueue(message_update(update_id, chat_id, "привіт"))
+        with patch.object(ExtBot, "_post", AsyncMock(return_value=bot_user)):
+            # Оновлення кожного чату забирає єдиний воркер
+            assert await worker.run_once() == 2
+            await worker.application.shutdown()
+        assert await queue.depth() == 0
+    finally:
+        for registry in (receiver_registry, worker_registry):
+            await registry.leave()
+
+
+@pytest.mark.asyncio
+async def test_receiver_checks_secret_and_enqueues(unused_tcp_port):
+    queue = UpdateQueue()
+    server = receiver.listen(receiver.make_receiver_app(queue, "hook", "s3cret"), unused_tcp_port)
+    url = f"http://127.0.0.1:{unused_tcp_port}/hook"
+    try:
+        async with httpx.AsyncClient() as client:
+            payload = message_update(9201, 701, "a")
+            assert (await client.post(url, json=payload)).status_code == 403
+            headers = {receiver.SECRET_TOKEN_HEADER: "s3cret"}
+            assert (await client.post(url, content=b"not json", headers=headers)).status_code == 400
+            assert (await client.post(url, json=payload, headers=headers)).status_code == 200
+    finally:
+        server.stop()
+    claimed = await queue.claim("worker-1")
+    assert [item.payload["update_id"] for item in claimed] == [9201]
+    await queue.complete(item.id for item in claimed)
@@ -0,0 +1,50 @@
+import asyncio
+import logging
+from logging_config import setup_logging
+from bot import (
+    background_services, build_application, setup_scheduler, shutdown, startup, wait_for_stop_signal,
+    warm_up_database,
+)
+from services.cluster_service import WORKER_ROLE
+from services.persistence_service import PostgresPersistence
+from services.telegram_service import TelegramRateLimiter
+from services.update_queue_service import UpdateQueue, UpdateWorker
+
+logger = logging.getLogger(__name__)
+
+
+async def run_worker() -> None:
+    """Обробляє оновлення з update_queue тими самими обробниками, що й бот у режимі direct.
+
+    Фонові задачі працюють з окремим Application: UpdateWorker перестворює своє при зміні шарду.
+    """
+    rate_limiter = TelegramRateLimiter()
+    application = build_application(rate_limiter=rate_limiter)
+    await asyncio.gather(application.initialize(), warm_up_database())
+    # Воркери теж опитують кількість учасників, кожен — свій шард груп
+    setup_scheduler(application, role=WORKER_ROLE)
+    await startup(application)
+    worker = UpdateWorker(
+        lambda: build_application(PostgresPersistence(), rate_limiter),
+        UpdateQueue(),
+        registry=background_services["instance_registry"],
+    )
+    worker_task = asyncio.create_task(worker.run())
+    try:
+        await wait_for_stop_signal()
+    finally:
+        # Поточна пачка дообробляється і стани розмов записуються ще до виходу з реєстру,
+        # решта оновлень лишається в черзі для інших воркерів
+        worker.stop()
+        await worker_task
+        await shutdown(application)
+        await application.shutdown()
+
+
+def main() -> None:
+    setup_logging()
+    asyncio.run(run_worker())
+
+
+if __name__ == '__main__':
+    main()